@@ -105,6 +105,7 @@ setup(name='substanced',
       sd_drain_indexing = substanced.scripts.drain_indexing:main
       sd_dump = substanced.scripts.dump:main
       sd_adduser = substanced.scripts.add_user:main
+      sd_objectmap = substanced.scripts.objectmap:main
       [pyramid.scaffold]
       substanced=substanced.scaffolds:SubstanceDProjectTemplate
       """,
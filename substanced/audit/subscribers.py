@@ -1,5 +1,4 @@
 from pyramid.threadlocal import get_current_request
-from pyramid.traversal import resource_path
 
 from substanced.event import (
     subscribe_acl_modified,
@@ -10,6 +9,7 @@ from substanced.event import (
     subscribe_root_added,
     )
 
+from substanced.objectmap import get_path
 from substanced.util import (
     get_oid,
     postorder,
@@ -34,7 +34,7 @@ def _add_record(event_name, event, objects):
     for obj in objects:
         content_type = str(event.registry.content.typeof(obj))
         parent = obj.__parent__
-        folder_path = resource_path(parent)
+        folder_path = get_path(parent)
         folder_oid = get_oid(parent, None)
         object_oid = get_oid(obj, None)
         log.add(
@@ -58,7 +58,7 @@ def acl_modified(event):
     oid = get_oid(event.object, None)
     old_acl = str(event.old_acl)
     new_acl = str(event.new_acl)
-    path = resource_path(event.object)
+    path = get_path(event.object)
     content_type = str(event.registry.content.typeof(event.object))
     log.add(
         'ACLModified',
@@ -95,7 +95,7 @@ def content_modified(event):
         return
     userinfo = _get_userinfo()
     oid = get_oid(event.object, None)
-    object_path = resource_path(event.object)
+    object_path = get_path(event.object)
     content_type = str(event.registry.content.typeof(event.object))
     log.add(
         'ContentModified',
@@ -1,5 +1,6 @@
 import inspect
 import logging
+import time
 import transaction
 import venusian
 
@@ -13,7 +14,6 @@ from zope.interface import (
     providedBy,
     )
 
-from pyramid.traversal import resource_path
 from pyramid.threadlocal import get_current_registry
 from pyramid.util import object_description
 
@@ -29,9 +29,15 @@ from ..interfaces import (
     IIndexingActionProcessor,
     MODE_IMMEDIATE,
     )
-from ..objectmap import find_objectmap
+from ..objectmap import (
+    find_objectmap,
+    get_path,
+    )
 from ..stats import statsd_timer
-from ..util import get_oid
+from ..util import (
+    get_oid,
+    is_nonstr_iter,
+    )
 
 from .factories import (
     IndexFactory,
@@ -42,11 +48,16 @@ from .factories import (
     Facet,
     Allowed,
     Path,
+    Extent,
     )
 
+from .discriminators import invalidate_index_view_cache
 from .util import oid_from_resource
 
-from . import deferred
+from . import (
+    deferred,
+    parallel,
+    )
 
 try:
     # pyramid 1.9 and below
@@ -65,6 +76,7 @@ Keyword = Keyword # API
 Facet = Facet # API
 Allowed = Allowed # API
 Path = Path # API
+Extent = Extent # API
 
 logger = logging.getLogger(__name__) # API
 
@@ -72,6 +84,20 @@ _SLASH = '/'
 
 _marker = object()
 
+def _progress(name, done, total, resumed_at, elapsed):
+    """ Return a message telling how far a reindex of the catalog named
+    ``name`` got after ``elapsed`` seconds, and when it should be done """
+    percent = total and 100.0 * done / total or 100.0
+    msg = '%s reindexed %s of %s objects (%.1f%%)' % (
+        name, done, total, percent)
+    processed = done - resumed_at
+    if processed and done < total:
+        remaining = int(elapsed * (total - done) / processed)
+        hours, rest = divmod(remaining, 3600)
+        minutes, seconds = divmod(rest, 60)
+        msg += ', ETA %d:%02d:%02d' % (hours, minutes, seconds)
+    return msg
+
 def catalog_buttons(context, request, default_buttons):
     """ Show a reindex button before default buttons in the folder contents
     view of a catalog"""
@@ -99,6 +125,10 @@ def catalog_buttons(context, request, default_buttons):
 class Catalog(Folder):
 
     transaction = transaction
+    pool_factory = staticmethod(parallel.spawn_pool) # for testing
+    clock = staticmethod(time.time) # for testing
+    _fresh_indexes = None # indexes being rebuilt by a parallel reindex
+    _reindex_checkpoints = None # b/c; see ``reindex_checkpoint``
 
     def __init__(self, family=None):
         Folder.__init__(self, family=family)
@@ -192,7 +222,8 @@ class Catalog(Folder):
         """ Bw compatibility function """
         return self.unindex_resource(docid)
 
-    def reindex_resource(self, resource, oid=None, action_mode=None):
+    def reindex_resource(self, resource, oid=None, action_mode=None,
+                         indexes=None):
         """Register the resource in indexes of this catalog using ``oid`` as
         the indexing identifier.  If ``oid`` is not supplied, the ``__oid__``
         attribute of ``resource`` will be used as the indexing identifier.
@@ -206,6 +237,11 @@ class Catalog(Folder):
         which explicitly indicates that you'd like to use the index's
         action_mode value.
 
+        ``indexes``, if not ``None``, should be a sequence of the names of the
+        indexes of this catalog the resource is reindexed in (e.g. those
+        which depend on what changed); by default it is reindexed in all of
+        them.  Either way, ``oid`` is added to the objectids of the catalog.
+
         The result of calling this method is logically the same as calling
         ``unindex_resource``, then ``index_resource`` with the same resource,
         but calling those two methods in succession is often more expensive
@@ -215,8 +251,12 @@ class Catalog(Folder):
         """
         if oid is None:
             oid = oid_from_resource(resource)
+        if indexes is None:
+            members = self.values()
+        else:
+            members = [ self[name] for name in indexes ]
         with statsd_timer('catalog.reindex_resource'):
-            for index in self.values():
+            for index in members:
                 index.reindex_resource(
                     resource, oid=oid, action_mode=action_mode
                     )
@@ -228,8 +268,41 @@ class Catalog(Folder):
         """ Bw compatibility method """
         return self.reindex_resource(obj, oid=docid)
 
+    def _checkpoint_key(self, indexes, path_re):
+        if indexes is None:
+            names = ()
+        else:
+            names = tuple(sorted(indexes))
+        if path_re is None:
+            pattern = ''
+        else:
+            pattern = path_re.pattern
+        return (names, pattern)
+
+    def reindex_checkpoint(self, indexes=None, path_re=None):
+        """ Return the objectid of the last object processed by an
+        unfinished :meth:`reindex` of the indexes named in ``indexes`` (all
+        of them if ``indexes`` is ``None``) with the regular expression
+        ``path_re``, as of its last commit, or ``None`` if there is no such
+        reindex."""
+        checkpoints = self._reindex_checkpoints
+        if checkpoints is None:
+            return None
+        return checkpoints.get(self._checkpoint_key(indexes, path_re))
+
+    def _set_reindex_checkpoint(self, key, oid):
+        checkpoints = self._reindex_checkpoints
+        if oid is None:
+            if checkpoints is not None and key in checkpoints:
+                del checkpoints[key]
+            return
+        if checkpoints is None:
+            checkpoints = self._reindex_checkpoints = self.family.OO.BTree()
+        checkpoints[key] = oid
+
     def reindex(self, dry_run=False, commit_interval=3000, indexes=None,
-                path_re=None, output=None, registry=None):
+                path_re=None, output=None, registry=None, workers=None,
+                config_uri=None, resume=False):
 
         """\
         Reindex all objects in the catalog using the existing set of
@@ -262,6 +335,28 @@ class Catalog(Folder):
         passed, the ``get_current_registry()`` function will be used to
         look up the current registry.  This function needs the registry in
         order to access content catalog views.
+
+        ``workers``, if passed, should be a number of worker processes.  The
+        values of the indexes are then computed by the workers, in parallel,
+        and loaded into the indexes by this process.  Each worker opens the
+        database itself, so ``config_uri``, the Pyramid configuration file of
+        the application, must be passed too.  When all objects are
+        reindexed (``path_re`` is ``None``), each index made by the catalog
+        factory is rebuilt as a new index which replaces the old one once it
+        is complete.  Resources indexed by other processes during the
+        reindex may be missing from the new indexes, so this is best done
+        while the site is offline.
+
+        Indexes which keep fingerprints reindex each object even if its
+        value did not change.
+
+        Objects are reindexed in objectid order.  Along with each commit, the
+        objectid of the last object processed is stored as a checkpoint for
+        ``indexes`` and ``path_re`` (see :meth:`reindex_checkpoint`); it is
+        removed when the reindex is complete.  If ``resume`` is ``True``, the
+        reindex continues after the checkpoint of a previous one which did
+        not complete, if there is one.  A reindex with ``workers`` cannot be
+        resumed.
         """
         if output is None: # pragma: no cover
             output = logger.info
@@ -269,6 +364,12 @@ class Catalog(Folder):
         if registry is None:
             registry = get_current_registry()
 
+        if workers and config_uri is None:
+            raise ValueError('config_uri is required to reindex with workers')
+
+        if workers and resume:
+            raise ValueError('a reindex with workers cannot be resumed')
+
         def commit_or_abort():
             if dry_run:
                 output and output('*** aborting ***')
@@ -286,12 +387,58 @@ class Catalog(Folder):
 
         self.flush(all=True)
 
+        if workers:
+            return parallel.reindex(
+                self,
+                workers,
+                config_uri,
+                commit_or_abort,
+                indexes=indexes,
+                path_re=path_re,
+                commit_interval=commit_interval,
+                output=output,
+                registry=registry,
+                pool_factory=self.pool_factory,
+                )
+
         i = 1
 
+        # a reindex rewrites what it reindexes, even if unchanged
+        fingerprinted = [
+            index for index_name, index in self.items()
+            if (indexes is None or index_name in indexes)
+            and getattr(index, 'fingerprints', None) is not None
+            ]
+
         objectmap = find_objectmap(self)
 
-        for oid in self.objectids:
-            resource = objectmap.object_for(oid)
+        oids = self.objectids
+        total = len(oids)
+        done = 0
+
+        key = self._checkpoint_key(indexes, path_re)
+        checkpoint = None
+        if resume:
+            checkpoint = self.reindex_checkpoint(indexes, path_re)
+        if checkpoint is not None:
+            done = len(oids.keys(max=checkpoint))
+            oids = oids.keys(min=checkpoint, excludemin=True)
+            output and output(
+                '%s resuming reindex after objectid %s (%s of %s)' % (
+                    name, checkpoint, done, total))
+
+        started = self.clock()
+        resumed_at = done
+
+        def checkpoint_and_commit(oid):
+            self._set_reindex_checkpoint(key, oid)
+            if output:
+                output(_progress(name, done, total, resumed_at,
+                                 self.clock() - started))
+            commit_or_abort()
+
+        for oid, resource in zip(oids, objectmap.object_for_many(oids)):
+            done += 1
             if resource is None:
                 path = objectmap.path_for(oid)
                 if path is None:
@@ -302,11 +449,14 @@ class Catalog(Folder):
                 upath = _SLASH.join(path)
                 output and output('error: object at path %s not found' % upath)
                 continue
-            path = resource_path(resource)
+            path = get_path(resource, objectmap)
             if path_re is not None and path_re.match(path) is None:
                 continue
             output and output('%s reindexing %s' % (name, path))
 
+            for index in fingerprinted:
+                index.fingerprints.pop(oid, None)
+
             if indexes is None:
                 self.reindex_resource(
                     resource,
@@ -321,12 +471,11 @@ class Catalog(Folder):
                         action_mode=MODE_IMMEDIATE,
                         )
 
-            if i % commit_interval == 0: # pragma: no cover
-                commit_or_abort()
+            if i % commit_interval == 0:
+                checkpoint_and_commit(oid)
             i+=1
 
-        if i:
-            commit_or_abort()
+        checkpoint_and_commit(None)
 
     def update_indexes(
         self,
@@ -627,7 +776,9 @@ def add_indexview(
     catalog_name,
     index_name,
     context=None,
-    attr=None
+    attr=None,
+    location_dependent=True,
+    depends_on=None,
     ):
     """ Directive which adds an index view to the configuration state state.
     The ``view`` argument should be function that is an indeview function, or
@@ -686,6 +837,21 @@ def add_indexview(
     resource being indexed has that class or interface.  Eventually we'll
     provide a way to add predicates other than ``context`` too.
 
+    If the value returned by an index view depends only on the resource
+    itself, and not on its location in the resource tree (its ancestors or the
+    path to it), pass ``location_dependent=False``.  When a folder is moved or
+    renamed within the same set of catalogs, the descendants of the moved
+    folder are only reindexed in indexes that have a location-dependent index
+    view.  The moved object itself is always reindexed.
+
+    If the value returned by an index view depends only on some attributes
+    of the resource, pass their names as ``depends_on`` (a sequence of
+    strings, e.g. the names of the fields of a property sheet).  When an
+    :class:`substanced.event.ObjectModified` event names the attributes that
+    changed, the resource is only reindexed in the indexes whose index views
+    depend on any of them.  The default, ``None``, means the index view may
+    depend on anything.
+
     The :class:`substanced.catalog.indexview` decorator provides a declarative
     analogue to using this configuration directive.
     """
@@ -705,6 +871,7 @@ def add_indexview(
             IIndexView,
             name=composite_name,
             )
+        invalidate_index_view_cache(config.registry)
 
     if inspect.isclass(view) and attr:
         view_desc = 'method %r of %s' % (attr, object_description(view))
@@ -723,6 +890,12 @@ def add_indexview(
     intr['name'] = composite_name
     intr['callable'] = view
     intr['attr'] = attr
+    intr['location_dependent'] = location_dependent
+    if depends_on is not None:
+        if not is_nonstr_iter(depends_on):
+            depends_on = (depends_on,)
+        depends_on = frozenset(depends_on)
+    intr['depends_on'] = depends_on
 
     config.action(discriminator, callable=register, introspectables=(intr,))
 
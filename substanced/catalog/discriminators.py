@@ -6,27 +6,98 @@ from ..interfaces import IIndexView
 
 _marker = object()
 
+class IndexViewCache(object):
+    """ The index views resolved for each ``providedBy`` spec of the
+    resources discriminated, and what the registered index views declare
+    (see :func:`substanced.catalog.subscribers.index_view_declarations`),
+    valid until :func:`invalidate_index_view_cache` is called."""
+    declarations = None
+
+    def __init__(self):
+        self.views = {}
+
+    def lookup(self, adapters, spec, catalog_name, index_name):
+        key = (spec, catalog_name, index_name)
+        index_view = self.views.get(key, _marker)
+        if index_view is _marker:
+            composite_name = '%s|%s' % (catalog_name, index_name)
+            index_view = adapters.lookup(
+                (spec,),
+                IIndexView,
+                name=composite_name,
+                default=None,
+                )
+            self.views[key] = index_view
+        return index_view
+
+def get_index_view_cache(registry):
+    """ Return the :class:`IndexViewCache` of ``registry``, making an empty
+    one if there is none."""
+    cache = getattr(registry, '_sd_index_view_cache', None)
+    if cache is None:
+        cache = registry._sd_index_view_cache = IndexViewCache()
+    return cache
+
+def invalidate_index_view_cache(registry):
+    """ Drop the :class:`IndexViewCache` of ``registry``.
+    :func:`substanced.catalog.add_indexview` calls this when it registers an
+    index view; code registering index views any other way (e.g. directly
+    with ``registry.registerAdapter``) after resources were discriminated
+    must call it too."""
+    registry._sd_index_view_cache = None
+
 class IndexViewDiscriminator(object):
     get_current_registry = staticmethod(get_current_registry) # for testing
-    
+
     def __init__(self, catalog_name, index_name):
         self.catalog_name = catalog_name
         self.index_name = index_name
 
     def __call__(self, resource, default):
         registry = self.get_current_registry() # XXX lame
-        composite_name = '%s|%s' % (self.catalog_name, self.index_name)
-        resource_iface = providedBy(resource)
-        index_view = registry.adapters.lookup(
-            (resource_iface,),
-            IIndexView,
-            name=composite_name,
-            default=None,
+        cache = get_index_view_cache(registry)
+        index_view = cache.lookup(
+            registry.adapters,
+            providedBy(resource),
+            self.catalog_name,
+            self.index_name,
             )
         if index_view is None:
             return default
         return index_view(resource, default)
 
+def discriminate_all(catalog, resource, default, names=None):
+    """ Return a dictionary mapping the name of each index of ``catalog``
+    (or only those in ``names``) to the value of ``resource`` for it, or
+    ``default``.  Indexes without a discriminator, such as the path index,
+    are left out.  The index views of all the indexes are looked up at once
+    in the current registry, which their discriminators use, for the class
+    (``providedBy`` spec) of ``resource`` the first time one of its
+    instances is discriminated."""
+    registry = get_current_registry()
+    if names is None:
+        names = list(catalog.keys())
+    cache = get_index_view_cache(registry)
+    spec = providedBy(resource)
+    indexes = []
+    for name in names:
+        index = catalog[name]
+        discriminator = getattr(index, 'discriminator', None)
+        if discriminator is None:
+            continue
+        indexes.append((name, index))
+        if isinstance(discriminator, IndexViewDiscriminator):
+            cache.lookup(
+                registry.adapters,
+                spec,
+                discriminator.catalog_name,
+                discriminator.index_name,
+                )
+    return dict(
+        (name, index.discriminate(resource, default))
+        for name, index in indexes
+        )
+
 class AllowedIndexDiscriminator(object):
     """ bw compat for unpickling only; safe to delete after system catalog has
     been resynced"""
@@ -19,6 +19,7 @@ from .indexes import (
     FacetIndex,
     AllowedIndex,
     PathIndex,
+    ExtentIndex,
     )
 
 from .discriminators import IndexViewDiscriminator
@@ -88,9 +89,20 @@ class Facet(IndexFactory):
 class Allowed(IndexFactory):
     index_type = AllowedIndex
 
+    def hashvalues(self):
+        values = IndexFactory.hashvalues(self)
+        materialized = values.get('materialized')
+        if materialized: # an unmaterialized index keeps its old hash
+            values['materialized'] = tuple(
+                sorted([(x,y) for x, y in materialized]))
+        return values
+
 class Path(IndexFactory):
     index_type = PathIndex
 
+class Extent(IndexFactory):
+    index_type = ExtentIndex
+
 @implementer(ICatalogFactory)
 class CatalogFactory(object):
     def __init__(self, name, index_factories):
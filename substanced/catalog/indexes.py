@@ -1,5 +1,8 @@
 from urllib.parse import unquote as url_unquote
 
+import hashlib
+import pickle
+
 import colander
 import deform.widget
 import re
@@ -13,7 +16,12 @@ import hypatia.keyword
 import hypatia.text
 import hypatia.util
 from persistent import Persistent
+from pyramid.security import Everyone
 from pyramid.settings import asbool
+from pyramid.threadlocal import (
+    get_current_registry,
+    get_current_request,
+    )
 from pyramid.traversal import resource_path_tuple
 from pyramid.interfaces import IRequest
 from zope.interface import implementer
@@ -24,14 +32,27 @@ from ..interfaces import (
     MODE_IMMEDIATE,
     MODE_ATCOMMIT,
     )
-from ..objectmap import find_objectmap
+from ..objectmap import (
+    AllowedCache,
+    find_objectmap,
+    )
 from ..property import PropertySheet
 from ..schema import Schema
-from ..stats import statsd_timer
-from ..util import is_nonstr_iter
+from ..stats import (
+    statsd_incr,
+    statsd_timer,
+    )
+from ..util import (
+    get_factory_type,
+    is_nonstr_iter,
+    )
 
 from .discriminators import dummy_discriminator
-from .util import oid_from_resource
+from .util import (
+    oid_from_resource,
+    ObjectMapResolver,
+    ResultSet,
+    )
 
 from . import deferred
 
@@ -41,11 +62,92 @@ _SLASH = '/'
 
 _marker = object()
 
+class _Missing(object):
+    """ The value of a resource for which the discriminator of an index
+    returned its default (a class, so it pickles by reference) """
+
+MISSING = _Missing
+
+class Discriminated(object):
+    """ Stands in for a resource when it is indexed by an
+    :class:`SDIndex`: holds the ``value`` which the discriminator of the
+    index already returned for the resource (e.g. in another process), or
+    ``MISSING``."""
+    def __init__(self, value):
+        self.value = value
+
+def fingerprint(value, family=BTrees.family64):
+    """ Return an integer hash of the discriminated ``value`` which fits the
+    ``II`` trees of ``family``, or ``None`` if ``value`` cannot be pickled.
+    """
+    if isinstance(value, (set, frozenset)):
+        # the iteration order of a set differs between processes
+        value = sorted(value, key=repr)
+    try:
+        data = pickle.dumps(value, 3)
+    except Exception:
+        return None
+    size = (family.maxint.bit_length() + 1) // 8
+    digest = hashlib.blake2b(data, digest_size=size).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
 class SDIndex(object):
 
     _p_action_tm = None
     action_mode = MODE_ATCOMMIT
     tm_class = deferred.IndexActionTM # for testing
+    fingerprints = None # b/c; oid -> fingerprint of the indexed value
+
+    def discriminate(self, obj, default):
+        if isinstance(obj, Discriminated):
+            if obj.value is MISSING:
+                return default
+            return obj.value
+        return super(SDIndex, self).discriminate(obj, default)
+
+    def enable_fingerprints(self):
+        """ Keep a fingerprint of the value indexed for each oid, so that
+        ``reindex_resource`` can skip resources whose value did not change.
+        Only oids indexed from now on get a fingerprint."""
+        if self.fingerprints is None:
+            self.fingerprints = self.family.II.BTree()
+
+    def reset(self):
+        super(SDIndex, self).reset()
+        if self.fingerprints is not None:
+            self.fingerprints.clear()
+
+    def index_doc(self, docid, obj):
+        if self.fingerprints is None:
+            return super(SDIndex, self).index_doc(docid, obj)
+        value = self.discriminate(obj, MISSING)
+        result = super(SDIndex, self).index_doc(docid, Discriminated(value))
+        # set after indexing, which may unindex the docid first
+        fp = fingerprint(value, self.family)
+        if fp is None:
+            self.fingerprints.pop(docid, None)
+        else:
+            self.fingerprints[docid] = fp
+        return result
+
+    def unindex_doc(self, docid):
+        if self.fingerprints is not None:
+            self.fingerprints.pop(docid, None)
+        return super(SDIndex, self).unindex_doc(docid)
+
+    def _changed(self, resource, oid):
+        # ``None`` if the value of ``resource`` is the one last indexed for
+        # ``oid``; otherwise what to reindex ``oid`` with: the value already
+        # discriminated to compare fingerprints, or ``resource`` itself
+        if self.fingerprints is None:
+            return resource
+        old = self.fingerprints.get(oid)
+        if old is None:
+            return resource
+        value = self.discriminate(resource, MISSING)
+        if fingerprint(value, self.family) == old:
+            return None
+        return Discriminated(value)
 
     def resultset_from_query(self, query, names=None, resolver=None):
         # XXX we should probably flush pending atcommit actions before
@@ -54,12 +156,12 @@ class SDIndex(object):
         # to this query.
         if resolver is None:
             objectmap = find_objectmap(self)
-            resolver = objectmap.object_for
+            resolver = ObjectMapResolver(objectmap)
         with statsd_timer('catalog.query'):
             query.flush()
             docids = query._apply(names)
             numdocs = len(docids)
-            return hypatia.util.ResultSet(docids, numdocs, resolver)
+            return ResultSet(docids, numdocs, resolver)
 
     def get_action_tm(self):
         action_tm = self._p_action_tm
@@ -93,11 +195,17 @@ class SDIndex(object):
     def reindex_resource(self, resource, oid=None, action_mode=None):
         if oid is None:
             oid = oid_from_resource(resource)
+        changed = self._changed(resource, oid)
+        if changed is None:
+            statsd_incr('catalog.reindex_skipped')
+            return
         if action_mode is None:
             action_mode = self.action_mode
         if action_mode is MODE_IMMEDIATE:
-            self.reindex_doc(oid, resource)
+            self.reindex_doc(oid, changed)
         else:
+            # the resource is discriminated again when the action is
+            # executed, as it may change again before then
             action = deferred.ReindexAction(self, action_mode, oid)
             self.add_action(action)
 
@@ -124,6 +232,7 @@ class SDIndex(object):
 class FakeIndex(object):
 
     family = BTrees.family64
+    location_dependent = False
 
     def reset(self):
         self._not_indexed = self.family.IF.TreeSet()
@@ -296,6 +405,108 @@ class PathIndex(SDIndex, hypatia.util.BaseIndexMixin, Persistent, FakeIndex):
             val['include_origin'] = include_origin
         return hypatia.query.NotEq(self, val)
 
+@content(
+    'Extent Index',
+    icon='glyphicon glyphicon-search',
+    is_index=True,
+    )
+@implementer(hypatia.interfaces.IIndex)
+class ExtentIndex(SDIndex, hypatia.util.BaseIndexMixin, Persistent, FakeIndex):
+    """ Uses the extents kept by the objectmap (see
+    :meth:`substanced.objectmap.ObjectMap.get_extent`) to apply a query to
+    retrieve the object identifiers of resources of a type, so filtering by
+    type needs no index of its own: nothing is written to this index when a
+    resource is indexed.
+
+    A type can be passed to methods as a content type (e.g. ``'Folder'``)
+    or as a factory type (the dotted name of a content class, or its
+    ``__factory_type__``).  A content type stands for all of the factory
+    types registered for it.
+
+    Query types supported:
+
+    - Eq
+
+    - NotEq
+
+    - Any
+
+    - NotAny
+
+    """
+
+    def __init__(self, discriminator=None, family=None):
+        if family is not None:
+            self.family = family
+        self.reset()
+
+    def document_repr(self, docid, default=None):
+        objectmap = find_objectmap(self.__parent__)
+        obj = objectmap.object_for(docid)
+        if obj is None:
+            return default
+        return get_factory_type(obj)
+
+    def _factory_types(self, value):
+        factory_types = set([value])
+        content_registry = getattr(get_current_registry(), 'content', None)
+        if content_registry is not None:
+            for factory_type, content_type in (
+                content_registry.factory_types.items()
+                ):
+                if content_type == value:
+                    factory_types.add(factory_type)
+        return factory_types
+
+    def search(self, values):
+        """ Return an ``IF`` set of the oids of the resources of any of the
+        types in ``values``."""
+        objectmap = find_objectmap(self.__parent__)
+        factory_types = set()
+        for value in values:
+            factory_types.update(self._factory_types(value))
+        extents = []
+        for factory_type in factory_types:
+            extent = objectmap.get_extent(factory_type, None)
+            if extent:
+                extents.append(extent)
+        return self.family.IF.multiunion(extents)
+
+    def count(self, value):
+        """ Return the number of resources of the type ``value`` from the
+        counters kept by the objectmap, without loading any extent."""
+        objectmap = find_objectmap(self.__parent__)
+        return sum(
+            objectmap.extent_count(factory_type)
+            for factory_type in self._factory_types(value)
+            )
+
+    def applyEq(self, value):
+        return self.search([value])
+
+    apply = applyEq
+
+    def applyNotEq(self, value):
+        return self._negate(self.applyEq, value)
+
+    def applyAny(self, values):
+        return self.search(values)
+
+    def applyNotAny(self, values):
+        return self._negate(self.applyAny, values)
+
+    def eq(self, value):
+        return hypatia.query.Eq(self, value)
+
+    def noteq(self, value):
+        return hypatia.query.NotEq(self, value)
+
+    def any(self, values):
+        return hypatia.query.Any(self, values)
+
+    def notany(self, values):
+        return hypatia.query.NotAny(self, values)
+
 class IndexSchema(Schema):
     """ A property schema for :class:`hypatia.interfaces.IIndex` objects."""
     action_mode = colander.SchemaNode(
@@ -330,12 +541,15 @@ class IndexPropertySheet(PropertySheet):
     is_index=True,
     )
 class FieldIndex(SDIndex, hypatia.field.FieldIndex):
-    def __init__(self, discriminator=None, family=None, action_mode=None):
+    def __init__(self, discriminator=None, family=None, action_mode=None,
+                 fingerprint=False):
         if discriminator is None:
             discriminator = dummy_discriminator
         hypatia.field.FieldIndex.__init__(self, discriminator, family=family)
         if action_mode is not None:
             self.action_mode = action_mode
+        if fingerprint:
+            self.enable_fingerprints()
 
 @content(
     'Keyword Index',
@@ -343,7 +557,8 @@ class FieldIndex(SDIndex, hypatia.field.FieldIndex):
     is_index=True,
     )
 class KeywordIndex(SDIndex, hypatia.keyword.KeywordIndex):
-    def __init__(self, discriminator=None, family=None, action_mode=None):
+    def __init__(self, discriminator=None, family=None, action_mode=None,
+                 fingerprint=False):
         if discriminator is None:
             discriminator = dummy_discriminator
         hypatia.keyword.KeywordIndex.__init__(
@@ -351,6 +566,8 @@ class KeywordIndex(SDIndex, hypatia.keyword.KeywordIndex):
             )
         if action_mode is not None:
             self.action_mode = action_mode
+        if fingerprint:
+            self.enable_fingerprints()
 
 @content(
     'Text Index',
@@ -365,6 +582,7 @@ class TextIndex(SDIndex, hypatia.text.TextIndex):
         index=None,
         family=None,
         action_mode=None,
+        fingerprint=False,
         ):
         if discriminator is None:
             discriminator = dummy_discriminator
@@ -373,6 +591,8 @@ class TextIndex(SDIndex, hypatia.text.TextIndex):
             )
         if action_mode is not None:
             self.action_mode = action_mode
+        if fingerprint:
+            self.enable_fingerprints()
 
 @content(
     'Facet Index',
@@ -381,7 +601,7 @@ class TextIndex(SDIndex, hypatia.text.TextIndex):
     )
 class FacetIndex(SDIndex, hypatia.facet.FacetIndex):
     def __init__(self, discriminator=None, facets=None, family=None,
-                 action_mode=None):
+                 action_mode=None, fingerprint=False):
         if discriminator is None:
             discriminator = dummy_discriminator
         if facets is None:
@@ -391,6 +611,8 @@ class FacetIndex(SDIndex, hypatia.facet.FacetIndex):
             )
         if action_mode is not None:
             self.action_mode = action_mode
+        if fingerprint:
+            self.enable_fingerprints()
 
 @content(
     'Allowed Index',
@@ -399,12 +621,113 @@ class FacetIndex(SDIndex, hypatia.facet.FacetIndex):
     )
 class AllowedIndex(SDIndex, hypatia.util.BaseIndexMixin, Persistent, FakeIndex):
     """ An index which defers to ``objectmap.allowed`` as part of a query
-    intersection."""
-    
-    def __init__(self, discriminator, family=None):
+    intersection.
+
+    If ``materialized`` is passed, it should be a sequence of ``(principal,
+    permission)`` pairs.  For each of them, the index then keeps the set of
+    the oids of the resources in which the principal, together with
+    ``Everyone`` (which every set of effective principals includes), is
+    granted the permission, maintained as resources are indexed, moved and
+    have their ACL changed.  An ``allows`` query for ``Everyone`` and
+    materialized principals only is answered from those sets for the
+    resources in which the principals are all granted, or all denied, the
+    permission; ACLs are only evaluated for the resources in which they
+    disagree.
+
+    Materialized mode is advisory: the sets are a cache of what
+    ``objectmap.allowed`` answers for a single principal, only as fresh as
+    the events which maintain them (an ACL changed without an
+    ``ACLModified`` event leaves them stale), and a query naming any
+    principal which isn't materialized evaluates ACLs as usual."""
+
+    materialized = () # b/c
+    _allowed = None # b/c; (principal, permission) -> IF.TreeSet
+
+    def __init__(self, discriminator, family=None, materialized=()):
         if family is not None:
             self.family = family
-        
+        if materialized:
+            self.materialized = tuple(tuple(pair) for pair in materialized)
+            self._allowed = self.family.OO.BTree()
+            for pair in self.materialized:
+                self._allowed[pair] = self.family.IF.TreeSet()
+
+    @property
+    def location_dependent(self):
+        # what a resource inherits from the ACLs of its lineage changes when
+        # it is moved
+        return self._allowed is not None
+
+    def reset(self):
+        FakeIndex.reset(self)
+        if self._allowed is not None:
+            for oidset in self._allowed.values():
+                oidset.clear()
+
+    def index_doc(self, docid, obj):
+        self.recompute([docid])
+
+    def reindex_doc(self, docid, obj):
+        self.recompute([docid])
+
+    def unindex_doc(self, docid):
+        if self._allowed is not None:
+            for oidset in self._allowed.values():
+                if docid in oidset:
+                    oidset.remove(docid)
+
+    def recompute(self, oids):
+        """ Recompute the materialized sets for the oids in ``oids`` from the
+        ACLs kept by the objectmap."""
+        if self._allowed is None:
+            return
+        oids = self.family.IF.Set(oids)
+        objectmap = find_objectmap(self)
+        cache = AllowedCache()
+        for (principal, permission), oidset in self._allowed.items():
+            principals = (Everyone, principal)
+            allowed = self.family.IF.Set(
+                objectmap.allowed(oids, principals, permission, cache=cache)
+                )
+            oidset.update(allowed)
+            for oid in self.family.IF.difference(oids, allowed):
+                if oid in oidset:
+                    oidset.remove(oid)
+
+    def materialized_allowed(self, oids, principals, permission):
+        """ Return a pair of subsets of the ``IF`` set ``oids``: the oids in
+        which ``principals`` are granted ``permission``, and the oids for
+        which the materialized sets can't tell, which must be checked
+        against the ACLs.  Return ``None`` if ``principals`` doesn't include
+        ``Everyone`` or if the set of any of the other principals is not
+        materialized.
+
+        The first ACE matching any of the principals is also the first ACE
+        matching one of them together with ``Everyone``, so the principals
+        are granted the permission wherever each of them with ``Everyone``
+        is, and denied it wherever none of them with ``Everyone`` is.  Only
+        where they disagree (e.g. an ACE denying one of them comes before an
+        ACE allowing another) is the answer unknown."""
+        if self._allowed is None:
+            return None
+        principals = set(principals)
+        if not Everyone in principals:
+            return None
+        if len(principals) > 1:
+            principals.remove(Everyone)
+        sets = []
+        for principal in principals:
+            oidset = self._allowed.get((principal, permission))
+            if oidset is None:
+                return None
+            sets.append(oidset)
+        IF = self.family.IF
+        anyone = IF.intersection(oids, IF.multiunion(sets))
+        everyone = anyone
+        for oidset in sets:
+            everyone = IF.intersection(everyone, oidset)
+        return everyone, IF.difference(anyone, everyone)
+
     def document_repr(self, docid, default=None):
         return 'N/A'
 
@@ -429,11 +752,24 @@ class AllowsComparator(hypatia.query.Comparator):
         raise NotImplementedError
     
     def intersect(self, left, names):
+        # the ACL decisions made for the ancestors of the oids in ``left``
+        # are shared with the other allows queries of the current request
         principals, permission = self._value
+        allowed = None
+        materialized_allowed = getattr(self.index, 'materialized_allowed', None)
+        if materialized_allowed is not None:
+            decided = materialized_allowed(left, principals, permission)
+            if decided is not None:
+                allowed, left = decided
+                if not left:
+                    return allowed
         omap = find_objectmap(self.index)
+        cache = _allowed_cache(get_current_request())
         result = self.family.IF.Set(
-            list(omap.allowed(left, principals, permission))
+            list(omap.allowed(left, principals, permission, cache=cache))
             )
+        if allowed is not None:
+            result = self.family.IF.union(allowed, result)
         return result
 
     def _apply(self, names):
@@ -445,6 +781,14 @@ class AllowsComparator(hypatia.query.Comparator):
     def __str__(self):
         return 'allows query'
 
+def _allowed_cache(request):
+    if request is None:
+        return AllowedCache()
+    cache = getattr(request, '_sd_allowed_cache', None)
+    if cache is None:
+        cache = request._sd_allowed_cache = AllowedCache()
+    return cache
+
 def includeme(config): # pragma: no cover
         config.include('..property')   # 'add_propertysheet' directive
         config.add_propertysheet(
@@ -0,0 +1,205 @@
+""" Parallel catalog reindexing.
+
+Worker processes, each of which opens the database itself, compute the
+values of the indexes of a catalog for disjoint chunks of its objectids.  The
+calling process, the single writer, loads the values into the indexes. """
+
+import collections
+import functools
+import itertools
+import multiprocessing
+
+from pyramid.paster import bootstrap
+from pyramid.traversal import find_resource
+
+from ..interfaces import ICatalogFactory
+from ..objectmap import (
+    find_objectmap,
+    get_path,
+    )
+
+from .discriminators import discriminate_all
+from .indexes import (
+    Discriminated,
+    FakeIndex,
+    MISSING,
+    SDIndex,
+    )
+
+_SLASH = '/'
+
+_worker = {} # the state of a worker process, set up by ``_init_worker``
+
+def spawn_pool(workers, initializer, initargs):
+    # workers are spawned rather than forked: a forked process would share
+    # the file descriptors and sockets of the storage of its parent
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(workers, initializer, initargs)
+
+def _init_worker(config_uri, catalog_path): # pragma: no cover
+    env = bootstrap(config_uri)
+    catalog = find_resource(env['root'], catalog_path)
+    _worker['catalog'] = catalog
+    _worker['objectmap'] = find_objectmap(catalog)
+
+def discriminate(oids, names, path_re=None):
+    """ Run in a worker process.  Return a list of ``(oid, path, values)``
+    for the objects whose objectids are in ``oids``, where ``values`` holds
+    the value of the object for each of the indexes named ``names`` (or
+    ``MISSING``).  ``path`` is ``None`` if the object cannot be found.
+    Objects whose path does not match ``path_re`` are left out."""
+    catalog = _worker['catalog']
+    objectmap = _worker['objectmap']
+    results = []
+    for oid, resource in zip(oids, objectmap.object_for_many(oids)):
+        if resource is None:
+            results.append((oid, None, None))
+            continue
+        path = get_path(resource, objectmap)
+        if path_re is not None and path_re.match(path) is None:
+            continue
+        values = discriminate_all(catalog, resource, MISSING, names=names)
+        values = tuple(values[name] for name in names)
+        results.append((oid, path, values))
+    # don't let the cache of the worker's connection grow with the catalog
+    jar = getattr(catalog, '_p_jar', None)
+    if jar is not None: # pragma: no cover
+        jar.cacheGC()
+    return results
+
+def _chunks(oids, chunk_size):
+    oids = iter(oids)
+    while True:
+        chunk = list(itertools.islice(oids, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+def _bounded_imap(pool, func, iterable, limit):
+    # like ``pool.imap``, except that at most ``limit`` tasks are submitted
+    # whose results weren't consumed yet, so that on a large catalog the
+    # results don't pile up in the calling process
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def reindex(catalog, workers, config_uri, commit_or_abort, indexes=None,
+            path_re=None, commit_interval=3000, output=None, registry=None,
+            chunk_size=500, pool_factory=spawn_pool):
+    """ Reindex ``catalog`` with ``workers`` worker processes, which open
+    the database using the Pyramid configuration file ``config_uri``.  See
+    :meth:`substanced.catalog.Catalog.reindex`.
+
+    When every object is reindexed (``path_re`` is ``None``), each index
+    made by the catalog factory of the catalog is rebuilt as a new index,
+    which replaces the old one once it is complete.  Other indexes are
+    reindexed in place.  The new indexes are kept on the catalog while they
+    are built, so that each commit stores what was indexed since the last
+    one; those left by a reindex which didn't complete are discarded by the
+    next one."""
+    name = catalog.__name__
+    objectmap = find_objectmap(catalog)
+
+    if indexes is None:
+        indexes = list(catalog.keys())
+
+    if catalog._fresh_indexes is not None:
+        # the new indexes of an earlier reindex which didn't complete
+        output and output(
+            '%s discarding the indexes left by an interrupted reindex' % name)
+        catalog._fresh_indexes = None
+
+    factory = None
+    if path_re is None:
+        factory = registry.queryUtility(ICatalogFactory, name=name)
+
+    targets = []
+    fresh = {}
+    for index_name in indexes:
+        index = catalog[index_name]
+        if not isinstance(index, SDIndex):
+            raise ValueError(
+                'index %r of catalog %s cannot be reindexed by workers' % (
+                    index_name, name))
+        index_factory = None
+        if factory is not None and not isinstance(index, FakeIndex):
+            index_factory = factory.index_factories.get(index_name)
+        if index_factory is not None:
+            index = fresh[index_name] = index_factory(name, index_name)
+        targets.append((index_name, index))
+
+    # the values of fake indexes (which compute their results from the
+    # objectmap) are never looked at
+    names = [
+        index_name for index_name, index in targets
+        if not isinstance(index, FakeIndex)
+        ]
+
+    if fresh:
+        # keep the new indexes reachable, so they are committed at each
+        # interval rather than held in memory
+        catalog._fresh_indexes = catalog.family.OO.BTree(fresh)
+
+    output and output('%s reindexing with %s workers' % (name, workers))
+
+    pool = pool_factory(
+        workers, _init_worker, (config_uri, get_path(catalog, objectmap)))
+
+    i = 1
+
+    try:
+        results = _bounded_imap(
+            pool,
+            functools.partial(discriminate, names=names, path_re=path_re),
+            _chunks(catalog.objectids, chunk_size),
+            workers * 2,
+            )
+        for chunk in results:
+            for oid, path, values in chunk:
+                if path is None:
+                    path = objectmap.path_for(oid)
+                    if path is None:
+                        output and output(
+                            'error: no path for objectid %s in object map' %
+                            oid)
+                        continue
+                    upath = _SLASH.join(path)
+                    output and output(
+                        'error: object at path %s not found' % upath)
+                    continue
+                output and output('%s reindexing %s' % (name, path))
+
+                values = dict(zip(names, values))
+                for index_name, index in targets:
+                    value = Discriminated(values.get(index_name, MISSING))
+                    if index_name in fresh:
+                        index.index_doc(oid, value)
+                    else:
+                        index.reindex_doc(oid, value)
+
+                if i % commit_interval == 0:
+                    commit_or_abort()
+                i += 1
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    for index_name, index in sorted(fresh.items()):
+        output and output(
+            '%s replacing index %r with its rebuilt version' % (
+                name, index_name))
+        index.__sdi_deletable__ = False
+        catalog.replace(index_name, index, registry=registry)
+
+    if fresh:
+        catalog._fresh_indexes = None
+
+    commit_or_abort()
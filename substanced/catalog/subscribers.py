@@ -11,6 +11,7 @@ from pyramid.events import (
 from pyramid.request import Request
 
 from ..event import (
+    subscribe_acl_modified,
     subscribe_added,
     subscribe_removed,
     subscribe_modified,
@@ -26,8 +27,123 @@ from ..util import (
 
 from ..evolution import EvolutionManager
 
+from ..interfaces import IIndexView
+
+from .discriminators import (
+    IndexViewDiscriminator,
+    get_index_view_cache,
+    )
+from .indexes import (
+    AllowedIndex,
+    FakeIndex,
+    )
+
 logger = logging.getLogger(__name__)
 
+class IndexViewDeclarations(object):
+    """ What the index views registered in a registry declare, keyed by the
+    ``catalog_name|index_name`` composite name they are registered under.
+    Index views registered without an introspectable (e.g. directly with
+    ``registerAdapter``) declare nothing: they are assumed to be location
+    dependent and to depend on every attribute."""
+    def __init__(self, registry):
+        self.introspected = False
+        self.location_dependent = {}
+        self.depends_on = {}
+        for data in registry.introspector.get_category('sd index views', ()):
+            intr = data['introspectable']
+            self.introspected = True
+            name = intr['name']
+            dependent = intr.get('location_dependent', True)
+            self.location_dependent[name] = (
+                self.location_dependent.get(name, False) or dependent)
+            depends_on = intr.get('depends_on')
+            if name in self.depends_on:
+                if self.depends_on[name] is None or depends_on is None:
+                    depends_on = None
+                else:
+                    depends_on = self.depends_on[name] | depends_on
+            self.depends_on[name] = depends_on
+        for registration in registry.registeredAdapters():
+            if registration.provided is IIndexView:
+                name = registration.name
+                if not name in self.location_dependent:
+                    self.location_dependent[name] = True
+                    self.depends_on[name] = None
+
+def index_view_declarations(registry):
+    """ Return the :class:`IndexViewDeclarations` of ``registry``, kept in
+    its index view cache (see
+    :func:`substanced.catalog.discriminators.get_index_view_cache`) until
+    an index view is added."""
+    cache = get_index_view_cache(registry)
+    if cache.declarations is None:
+        cache.declarations = IndexViewDeclarations(registry)
+    return cache.declarations
+
+def _composite_name(discriminator):
+    return '%s|%s' % (discriminator.catalog_name, discriminator.index_name)
+
+def location_dependent_indexes(catalog, registry):
+    """ Return a list of the names of the indexes in ``catalog`` which may
+    hold values that depend on the location of an indexed resource, based on
+    the ``location_dependent`` flag of the index views registered for them.
+    Indexes with no registered index views are never location dependent, and
+    virtual indexes (path, allowed) only are if their ``location_dependent``
+    attribute says so, as a materialized allowed index's does.  Return
+    ``None`` if ``registry`` is ``None`` or if no index view was registered
+    with an introspectable (e.g. because introspection is disabled); every
+    index must then be assumed to be location dependent."""
+    if registry is None:
+        return None
+    declarations = index_view_declarations(registry)
+    if not declarations.introspected:
+        return None
+    declared = declarations.location_dependent
+    names = []
+    for name, index in catalog.items():
+        if isinstance(index, FakeIndex):
+            if index.location_dependent:
+                names.append(name)
+            continue
+        discriminator = getattr(index, 'discriminator', None)
+        if isinstance(discriminator, IndexViewDiscriminator):
+            if not declared.get(_composite_name(discriminator), False):
+                continue
+        names.append(name)
+    return names
+
+def affected_indexes(catalog, registry, changed):
+    """ Return a list of the names of the indexes in ``catalog`` which may
+    hold values that depend on any of the attributes named in ``changed``,
+    based on the ``depends_on`` names declared by the index views registered
+    for them.  Indexes with no registered index views and virtual indexes
+    (path, allowed) are never affected; an index with a registered index view
+    that declares no ``depends_on`` always is.  Return ``None`` if
+    ``registry`` or ``changed`` is ``None``, or if no index view was
+    registered with an introspectable (e.g. because introspection is
+    disabled); every index must then be assumed to be affected."""
+    if registry is None or changed is None:
+        return None
+    declarations = index_view_declarations(registry)
+    if not declarations.introspected:
+        return None
+    declared = declarations.depends_on
+    names = []
+    for name, index in catalog.items():
+        if isinstance(index, FakeIndex):
+            continue
+        discriminator = getattr(index, 'discriminator', None)
+        if isinstance(discriminator, IndexViewDiscriminator):
+            key = _composite_name(discriminator)
+            if key not in declared:
+                continue
+            depends_on = declared[key]
+            if depends_on is not None and depends_on.isdisjoint(changed):
+                continue
+        names.append(name)
+    return names
+
 @subscribe_added()
 def object_added(event):
     """ An IObjectAdded event subscriber which indexes an object and and its
@@ -55,6 +171,10 @@ def object_added(event):
             if catalogs == old_catalogs:
                 reindex_only = True
 
+    if reindex_only:
+        _reindex_moved(obj, catalogs, event.registry)
+        return
+
     # XXX note that adding objects to an unseated folder that itself contains a
     # catalog will cause rework to be done, as the below logic will fire once
     # for the children of the object that was added before the seating, then
@@ -64,10 +184,70 @@ def object_added(event):
         oid = get_oid(node, None)
         if oid is not None:
             for catalog in catalogs:
-                if reindex_only:
-                    catalog.reindex_resource(node, oid=oid)
-                else:
-                    catalog.index_resource(node, oid=oid)
+                catalog.index_resource(node, oid=oid)
+
+def _reindex_moved(obj, catalogs, registry):
+    # The moved object itself is reindexed in every index (its name may have
+    # changed).  Its descendants kept their names, oids and everything else
+    # but their location, so they are only reindexed in location-dependent
+    # indexes; if there are none, the descendants aren't visited at all.
+    # Materialized allowed indexes are recomputed for the whole subtree at
+    # once afterwards rather than one resource at a time.
+    objectmap = find_objectmap(obj)
+    own = []
+    dependent = []
+    allowed = []
+    for catalog in catalogs:
+        names = location_dependent_indexes(catalog, registry)
+        materialized = []
+        if objectmap is not None:
+            materialized = _materialized_allowed_names(catalog)
+        if materialized:
+            allowed.extend((catalog, catalog[name]) for name in materialized)
+            own.append(
+                (catalog,
+                 [name for name in catalog.keys() if name not in materialized])
+                )
+            if names is None:
+                names = catalog.keys()
+            names = [name for name in names if name not in materialized]
+        else:
+            own.append((catalog, None))
+        if names is None or names:
+            dependent.append((catalog, names))
+
+    if dependent:
+        nodes = postorder(obj)
+    else:
+        nodes = (obj,)
+
+    for node in nodes:
+        oid = get_oid(node, None)
+        if oid is None:
+            continue
+        if node is obj:
+            for catalog, names in own:
+                catalog.reindex_resource(node, oid=oid, indexes=names)
+            continue
+        for catalog, names in dependent:
+            catalog.reindex_resource(node, oid=oid, indexes=names)
+
+    if allowed:
+        _recompute_allowed(obj, objectmap, allowed)
+
+def _materialized_allowed_names(catalog):
+    return [
+        name for name, index in catalog.items()
+        if isinstance(index, AllowedIndex) and index.materialized
+        ]
+
+def _recompute_allowed(obj, objectmap, indexes):
+    # recompute each of the ``(catalog, index)`` materialized allowed indexes
+    # for ``obj`` and its descendants in one go, so that the ACL decisions
+    # made for their common ancestors are shared between them
+    oids = objectmap.pathlookup(obj)
+    for catalog, index in indexes:
+        index.recompute(catalog.family.IF.intersection(oids, catalog.objectids))
 
 @subscribe_removed()
 def object_removed(event):
@@ -105,13 +285,36 @@ def object_removed(event):
 def object_modified(event):
     """ Reindex a single object (non-recursive) in every catalog service in
     the object's lineage; an :class:`substanced.event.ObjectModifed` event
-    subscriber"""
+    subscriber.  If the event names the attributes which changed, the object
+    is only reindexed in the indexes which depend on them."""
     obj = event.object
     oid = get_oid(obj, None)
     if oid is not None:
         catalogs = find_catalogs(obj)
+        changed = getattr(event, 'changed', None)
         for catalog in catalogs:
-            catalog.reindex_resource(obj, oid=oid)
+            names = affected_indexes(catalog, event.registry, changed)
+            catalog.reindex_resource(obj, oid=oid, indexes=names)
+
+@subscribe_acl_modified()
+def acl_modified(event):
+    """ Recompute the materialized sets of every materialized allowed index
+    in the catalogs in the lineage of an object whose ACL has changed, for
+    the object and its descendants; an
+    :class:`substanced.event.ACLModified` event subscriber"""
+    obj = event.object
+    objectmap = find_objectmap(obj)
+    if objectmap is None: # object might not yet be seated
+        return
+    indexes = [
+        (catalog, catalog[name]) for catalog in find_catalogs(obj)
+        for name in _materialized_allowed_names(catalog)
+        ]
+    if not indexes:
+        return
+    # the objectmap's own acl_modified subscriber may not have run yet
+    objectmap.set_acl(obj, event.new_acl)
+    _recompute_allowed(obj, objectmap, indexes)
 
 @subscriber(ApplicationCreated)
 def on_startup(event):
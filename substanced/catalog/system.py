@@ -19,7 +19,7 @@ from ..interfaces import (
     )
 from ..util import get_content_type
 
-@indexview_defaults(catalog_name='system')
+@indexview_defaults(catalog_name='system', location_dependent=False)
 class SystemIndexViews(object):
     def __init__(self, resource):
         self.resource = resource
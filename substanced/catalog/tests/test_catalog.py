@@ -178,6 +178,24 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(idx.reindexed_oid, 1)
         self.assertEqual(idx.reindexed_resource, 'value')
 
+    def test_reindex_resource_some_indexes(self):
+        catalog = self._makeOne()
+        idx1 = DummyIndex()
+        idx2 = DummyIndex()
+        catalog['name'] = idx1
+        catalog['other'] = idx2
+        catalog.reindex_resource('value', 1, indexes=['name'])
+        self.assertEqual(idx1.reindexed_oid, 1)
+        self.assertFalse(hasattr(idx2, 'reindexed_oid'))
+        self.assertEqual(list(catalog.objectids), [1])
+
+    def test_reindex_resource_no_indexes_objectids_notexists(self):
+        catalog = self._makeOne()
+        catalog['name'] = DummyIndex()
+        catalog.reindex_resource('value', 1, indexes=[])
+        self.assertFalse(hasattr(catalog['name'], 'reindexed_oid'))
+        self.assertEqual(list(catalog.objectids), [1])
+
     def test_reindex_resource_objectids_exists(self):
         inst = self._makeOne()
         inst.objectids.insert(1)
@@ -228,6 +246,7 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(L[0][1], a)
         self.assertEqual(out,
                           ["catalog reindexing /a",
+                          'catalog reindexed 1 of 1 objects (100.0%)',
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 1)
 
@@ -254,6 +273,7 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(out,
                           ["catalog reindexing /a",
                           "error: object at path /b not found",
+                          'catalog reindexed 2 of 2 objects (100.0%)',
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 1)
 
@@ -273,6 +293,7 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(L, [])
         self.assertEqual(out,
                           ["error: no path for objectid 1 in object map",
+                          'catalog reindexed 1 of 1 objects (100.0%)',
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 1)
         
@@ -303,6 +324,7 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(L[0][1], a)
         self.assertEqual(out,
                           ['catalog reindexing /a',
+                          'catalog reindexed 2 of 2 objects (100.0%)',
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 1)
 
@@ -333,6 +355,7 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(out,
                          ['catalog reindexing /a',
                           'catalog reindexing /b',
+                          'catalog reindexed 2 of 2 objects (100.0%)',
                           '*** aborting ***'])
         self.assertEqual(transaction.aborted, 1)
         self.assertEqual(transaction.committed, 0)
@@ -359,12 +382,155 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(out,
                           ["catalog reindexing only indexes ('index',)",
                           'catalog reindexing /a',
+                          'catalog reindexed 1 of 1 objects (100.0%)',
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 1)
         self.assertEqual(len(L), 1)
         self.assertEqual(L[0][0], 1)
         self.assertEqual(L[0][1], a)
 
+    def test_reindex_forgets_fingerprints(self):
+        a = testing.DummyModel()
+        L = []
+        objectmap = DummyObjectMap({1: [a, (_BLANK, _A)]})
+        transaction = DummyTransaction()
+        inst = self._makeOne()
+        inst.transaction = transaction
+        site = _makeSite(catalog=inst, objectmap=objectmap)
+        site['a'] = a
+        inst.objectids = [1]
+        index = DummyIndex()
+        index.fingerprints = {1: 123, 2: 456}
+        inst['index'] = index
+        other = DummyIndex()
+        other.fingerprints = {1: 123}
+        inst['other'] = other
+        def reindex_resource(resource, oid=None, action_mode=None):
+            L.append(dict(index.fingerprints))
+        index.reindex_resource = reindex_resource
+        inst.flush = lambda *arg, **kw: True
+        inst.reindex(indexes=('index',), output=False)
+        self.assertEqual(L, [{2: 456}])
+        self.assertEqual(other.fingerprints, {1: 123})
+
+    def test_reindex_workers(self):
+        from .. import parallel
+        inst = self._makeOne()
+        inst.flush = lambda *arg, **kw: True
+        L = []
+        def reindex(catalog, workers, config_uri, commit_or_abort, **kw):
+            L.append((catalog, workers, config_uri, kw))
+        orig = parallel.reindex
+        parallel.reindex = reindex
+        try:
+            inst.reindex(workers=4, config_uri='development.ini',
+                         output=False, commit_interval=10)
+        finally:
+            parallel.reindex = orig
+        catalog, workers, config_uri, kw = L[0]
+        self.assertTrue(catalog is inst)
+        self.assertEqual(workers, 4)
+        self.assertEqual(config_uri, 'development.ini')
+        self.assertEqual(kw['commit_interval'], 10)
+        self.assertEqual(kw['pool_factory'], inst.pool_factory)
+
+    def test_reindex_workers_without_config_uri(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.reindex, workers=4, output=False)
+
+    def test_reindex_workers_with_resume(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.reindex, workers=4,
+                          config_uri='development.ini', resume=True,
+                          output=False)
+
+    def _makeReindexable(self, names):
+        objects = {}
+        for oid, name in enumerate(names, 1):
+            objects[oid] = [testing.DummyModel(), (_BLANK, name)]
+        transaction = DummyTransaction()
+        inst = self._makeOne()
+        inst.transaction = transaction
+        inst.flush = lambda *arg, **kw: True
+        site = _makeSite(catalog=inst, objectmap=DummyObjectMap(objects))
+        for oid, (resource, path) in objects.items():
+            site[path[-1]] = resource
+        inst.objectids = inst.family.IF.TreeSet(objects)
+        reindexed = []
+        def reindex_resource(resource, oid=None, action_mode=None):
+            if oid == inst.fail_at:
+                raise RuntimeError(oid)
+            reindexed.append(oid)
+        inst.fail_at = None
+        inst.reindex_resource = reindex_resource
+        return inst, reindexed
+
+    def test_reindex_checkpoints(self):
+        inst, reindexed = self._makeReindexable(['a', 'b', 'c', 'd'])
+        checkpoints = []
+        def commit():
+            checkpoints.append(inst.reindex_checkpoint())
+        inst.transaction.commit = commit
+        inst.reindex(commit_interval=2, output=False)
+        self.assertEqual(reindexed, [1, 2, 3, 4])
+        self.assertEqual(checkpoints, [2, 4, None])
+        self.assertEqual(inst.reindex_checkpoint(), None)
+
+    def test_reindex_resume(self):
+        inst, reindexed = self._makeReindexable(['a', 'b', 'c', 'd'])
+        inst.fail_at = 4
+        self.assertRaises(
+            RuntimeError, inst.reindex, commit_interval=2, output=False)
+        self.assertEqual(inst.reindex_checkpoint(), 2)
+        inst.fail_at = None
+        del reindexed[:]
+        out = []
+        inst.reindex(commit_interval=2, output=out.append, resume=True)
+        self.assertEqual(reindexed, [3, 4])
+        self.assertEqual(
+            out[0], 'catalog resuming reindex after objectid 2 (2 of 4)')
+        self.assertEqual(out[-2], 'catalog reindexed 4 of 4 objects (100.0%)')
+        self.assertEqual(inst.reindex_checkpoint(), None)
+
+    def test_reindex_resume_without_checkpoint(self):
+        inst, reindexed = self._makeReindexable(['a', 'b'])
+        inst.reindex(output=False, resume=True)
+        self.assertEqual(reindexed, [1, 2])
+
+    def test_reindex_without_resume_ignores_checkpoint(self):
+        inst, reindexed = self._makeReindexable(['a', 'b'])
+        inst._set_reindex_checkpoint(inst._checkpoint_key(None, None), 1)
+        inst.reindex(output=False)
+        self.assertEqual(reindexed, [1, 2])
+        self.assertEqual(inst.reindex_checkpoint(), None)
+
+    def test_reindex_checkpoint_per_indexes_and_path(self):
+        inst, reindexed = self._makeReindexable(['a', 'b'])
+        inst['x'] = DummyIndex()
+        inst['y'] = DummyIndex()
+        path_re = re.compile('/a')
+        inst._set_reindex_checkpoint(
+            inst._checkpoint_key(['y', 'x'], path_re), 1)
+        self.assertEqual(inst.reindex_checkpoint(['x', 'y'], path_re), 1)
+        self.assertEqual(inst.reindex_checkpoint(['x', 'y']), None)
+        self.assertEqual(inst.reindex_checkpoint(), None)
+
+    def test_reindex_progress(self):
+        inst, reindexed = self._makeReindexable(['a', 'b', 'c', 'd'])
+        times = [100.0, 110.0, 120.0, 130.0, 140.0, 150.0]
+        inst.clock = lambda: times.pop(0)
+        out = []
+        inst.reindex(commit_interval=1, output=out.append)
+        progress = [ x for x in out if ' reindexed ' in x ]
+        self.assertEqual(
+            progress,
+            ['catalog reindexed 1 of 4 objects (25.0%), ETA 0:00:30',
+             'catalog reindexed 2 of 4 objects (50.0%), ETA 0:00:20',
+             'catalog reindexed 3 of 4 objects (75.0%), ETA 0:00:10',
+             'catalog reindexed 4 of 4 objects (100.0%)',
+             'catalog reindexed 4 of 4 objects (100.0%)']
+            )
+
     def _setup_factory(self, factory=None):
         from substanced.interfaces import ICatalogFactory
         registry = self.config.registry
@@ -509,10 +675,12 @@ class Test_add_indexview(unittest.TestCase):
         index_name,
         context=None,
         attr=None,
+        **kw
         ):
         from .. import add_indexview
         return add_indexview(
-            config, view, catalog_name, index_name, context=context, attr=attr
+            config, view, catalog_name, index_name, context=context, attr=attr,
+            **kw
             )
 
     def test_it_func(self):
@@ -535,12 +703,37 @@ class Test_add_indexview(unittest.TestCase):
         self.assertEqual(config.intr['name'], 'catalog|index')
         self.assertEqual(config.intr['callable'], view)
         self.assertEqual(config.intr['attr'], None)
+        self.assertEqual(config.intr['location_dependent'], True)
+        self.assertEqual(config.intr['depends_on'], None)
         callable = action['callable']
         callable()
         wrapper = self.config.registry.adapters.lookup(
             (Interface,), IIndexView, name='catalog|index')
         self.assertEqual(config.intr['derived_callable'], wrapper)
 
+    def test_it_location_independent(self):
+        config = DummyConfigurator(registry=self.config.registry)
+        def view(resource, default): return True
+        self._callFUT(
+            config, view, 'catalog', 'index', location_dependent=False
+            )
+        self.assertEqual(config.intr['location_dependent'], False)
+
+    def test_it_depends_on(self):
+        config = DummyConfigurator(registry=self.config.registry)
+        def view(resource, default): return True
+        self._callFUT(
+            config, view, 'catalog', 'index', depends_on=['title', 'body']
+            )
+        self.assertEqual(config.intr['depends_on'],
+                         frozenset(['title', 'body']))
+
+    def test_it_depends_on_string(self):
+        config = DummyConfigurator(registry=self.config.registry)
+        def view(resource, default): return True
+        self._callFUT(config, view, 'catalog', 'index', depends_on='title')
+        self.assertEqual(config.intr['depends_on'], frozenset(['title']))
+
     def test_it_cls_with_attr(self):
         from zope.interface import Interface
         from substanced.interfaces import IIndexView
@@ -889,7 +1082,10 @@ class DummyObjectMap(object):
             return
         return data[0]
 
-    def add(self, node, path_tuple, duplicating=False, moving=False):
+    def object_for_many(self, objectids):
+        return [ self.object_for(objectid) for objectid in objectids ]
+
+    def add_subtree(self, node, path_tuple, duplicating=False, moving=False):
         pass
 
 class DummyCatalog(dict):
@@ -35,8 +35,135 @@ class TestIndexViewDiscriminator(unittest.TestCase):
         inst = self._makeOne('system', 'attr')
         result = inst(resource, True)
         self.assertEqual(result, True)
-        
-            
+
+    def test_call_caches_lookup(self):
+        from zope.interface import Interface
+        from substanced.interfaces import IIndexView
+        registry = self.config.registry
+        def view(resource, default):
+            return 'value'
+        registry.registerAdapter(view, (Interface,), IIndexView, 'system|attr')
+        inst = self._makeOne('system', 'attr')
+        self.assertEqual(inst(testing.DummyResource(), None), 'value')
+        lookups = []
+        orig = registry.adapters.lookup
+        def lookup(*arg, **kw):
+            lookups.append(arg)
+            return orig(*arg, **kw)
+        registry.adapters.lookup = lookup
+        try:
+            self.assertEqual(inst(testing.DummyResource(), None), 'value')
+            self.assertEqual(lookups, [])
+            self.assertEqual(inst(DummyOther(), None), 'value')
+        finally:
+            del registry.adapters.lookup
+        self.assertEqual(len(lookups), 1)
+
+    def test_call_cache_invalidated(self):
+        from zope.interface import Interface
+        from substanced.interfaces import IIndexView
+        from ..discriminators import invalidate_index_view_cache
+        registry = self.config.registry
+        resource = testing.DummyResource()
+        inst = self._makeOne('system', 'attr')
+        self.assertEqual(inst(resource, None), None)
+        def view(resource, default):
+            return 'value'
+        registry.registerAdapter(view, (Interface,), IIndexView, 'system|attr')
+        self.assertEqual(inst(resource, None), None)
+        invalidate_index_view_cache(registry)
+        self.assertEqual(inst(resource, None), 'value')
+
+    def test_call_index_view_added(self):
+        from .. import add_indexview
+        resource = testing.DummyResource()
+        inst = self._makeOne('system', 'attr')
+        self.assertEqual(inst(resource, None), None)
+        add_indexview(
+            self.config, lambda resource, default: 'value', 'system', 'attr')
+        self.assertEqual(inst(resource, None), 'value')
+
+class Test_get_index_view_cache(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, registry):
+        from ..discriminators import get_index_view_cache
+        return get_index_view_cache(registry)
+
+    def test_unchanged(self):
+        registry = self.config.registry
+        cache = self._callFUT(registry)
+        self.assertTrue(self._callFUT(registry) is cache)
+
+    def test_invalidated(self):
+        from ..discriminators import invalidate_index_view_cache
+        registry = self.config.registry
+        cache = self._callFUT(registry)
+        invalidate_index_view_cache(registry)
+        self.assertFalse(self._callFUT(registry) is cache)
+
+class Test_discriminate_all(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, catalog, resource, default, **kw):
+        from ..discriminators import discriminate_all
+        return discriminate_all(catalog, resource, default, **kw)
+
+    def _makeCatalog(self):
+        from zope.interface import Interface
+        from substanced.interfaces import IIndexView
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import (
+            FieldIndex,
+            PathIndex,
+            )
+        registry = self.config.registry
+        def title(resource, default):
+            return getattr(resource, 'title', default)
+        registry.registerAdapter(
+            title, (Interface,), IIndexView, 'catalog|title')
+        catalog = {
+            'title':FieldIndex(IndexViewDiscriminator('catalog', 'title')),
+            'name':FieldIndex(IndexViewDiscriminator('catalog', 'name')),
+            'attr':FieldIndex('attr'),
+            'path':PathIndex(),
+            }
+        return catalog
+
+    def test_it(self):
+        catalog = self._makeCatalog()
+        resource = testing.DummyResource(title='title', attr='attr')
+        result = self._callFUT(catalog, resource, None)
+        self.assertEqual(
+            result,
+            {'title':'title', 'name':None, 'attr':'attr'}
+            )
+
+    def test_names(self):
+        catalog = self._makeCatalog()
+        resource = testing.DummyResource(title='title')
+        result = self._callFUT(
+            catalog, resource, None, names=['title'])
+        self.assertEqual(result, {'title':'title'})
+
+    def test_looks_up_once_per_class(self):
+        from ..discriminators import get_index_view_cache
+        catalog = self._makeCatalog()
+        registry = self.config.registry
+        self._callFUT(catalog, testing.DummyResource(title='a'), None)
+        views = get_index_view_cache(registry).views
+        self.assertEqual(len(views), 2)
+        self._callFUT(catalog, testing.DummyResource(title='b'), None)
+        self.assertEqual(len(views), 2)
+
 
 class Test_dummy_discriminator(unittest.TestCase):
     def _callFUT(self, object, default):
@@ -47,3 +174,5 @@ class Test_dummy_discriminator(unittest.TestCase):
         result = self._callFUT(None, '123')
         self.assertEqual(result, '123')
 
+class DummyOther(object):
+    pass
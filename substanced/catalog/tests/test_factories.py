@@ -183,6 +183,17 @@ class TestPath(unittest.TestCase):
             {'class': 'substanced.catalog.factories.Path'}
             )
 
+class TestExtent(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from ..factories import Extent
+        return Extent(**kw)
+
+    def test_call(self):
+        inst = self._makeOne()
+        result = inst('catalog', 'index')
+        self.assertEqual(result.__class__.__name__, 'ExtentIndex')
+        self.assertTrue(hasattr(result, '__factory_hash__'))
+
 class TestAllowed(unittest.TestCase):
     def _makeOne(self, **kw):
         from ..factories import Allowed
@@ -194,6 +205,28 @@ class TestAllowed(unittest.TestCase):
         self.assertEqual(result.__class__.__name__, 'AllowedIndex')
         self.assertTrue(hasattr(result, '__factory_hash__'))
 
+    def test_call_materialized(self):
+        inst = self._makeOne(materialized=[('bob', 'view')])
+        result = inst('catalog', 'index')
+        self.assertEqual(result.materialized, (('bob', 'view'),))
+
+    def test_hashvalues(self):
+        inst = self._makeOne()
+        result = inst.hashvalues()
+        self.assertEqual(
+            result,
+            {'class': 'substanced.catalog.factories.Allowed'}
+            )
+
+    def test_hashvalues_materialized(self):
+        inst = self._makeOne(materialized=[('bob', 'view'), ('al', 'edit')])
+        result = inst.hashvalues()
+        self.assertEqual(
+            result,
+            {'class': 'substanced.catalog.factories.Allowed',
+             'materialized':(('al', 'edit'), ('bob', 'view'))}
+            )
+
 class TestCatalogFactory(unittest.TestCase):
     def _makeOne(self, name, index_factories):
         from ..factories import CatalogFactory
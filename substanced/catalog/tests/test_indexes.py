@@ -73,7 +73,8 @@ class TestSDIndex(unittest.TestCase):
         query = DummyQuery()
         resultset = inst.resultset_from_query(query)
         self.assertEqual(resultset.ids, [1,2,3])
-        self.assertEqual(resultset.resolver, inst.__objectmap__.object_for)
+        self.assertEqual(resultset.resolver.objectmap, inst.__objectmap__)
+        self.assertEqual(list(resultset.all()), ['a', 'a', 'a'])
         self.assertTrue(query.flushed)
 
     def test_resultset_from_query_with_resolver(self):
@@ -249,6 +250,176 @@ class TestSDIndex(unittest.TestCase):
         
         
 
+class TestSDIndexDiscriminate(unittest.TestCase):
+    def _makeOne(self):
+        from ..indexes import FieldIndex
+        def discriminator(resource, default):
+            return getattr(resource, 'title', default)
+        return FieldIndex(discriminator)
+
+    def test_resource(self):
+        inst = self._makeOne()
+        self.assertEqual(inst.discriminate(testing.DummyResource(), 1), 1)
+        resource = testing.DummyResource(title='a')
+        self.assertEqual(inst.discriminate(resource, 1), 'a')
+
+    def test_discriminated(self):
+        from ..indexes import Discriminated
+        inst = self._makeOne()
+        self.assertEqual(inst.discriminate(Discriminated('a'), 1), 'a')
+
+    def test_discriminated_missing(self):
+        from ..indexes import (
+            Discriminated,
+            MISSING,
+            )
+        inst = self._makeOne()
+        self.assertEqual(inst.discriminate(Discriminated(MISSING), 1), 1)
+        inst.index_doc(5, Discriminated(MISSING))
+        self.assertEqual(list(inst.not_indexed()), [5])
+
+class Test_fingerprint(unittest.TestCase):
+    def _callFUT(self, value, family=None):
+        from ..indexes import fingerprint
+        if family is None:
+            return fingerprint(value)
+        return fingerprint(value, family)
+
+    def test_same_value(self):
+        self.assertEqual(self._callFUT(('a', 1)), self._callFUT(('a', 1)))
+
+    def test_different_value(self):
+        self.assertNotEqual(self._callFUT('a'), self._callFUT('b'))
+
+    def test_set_order_independent(self):
+        self.assertEqual(self._callFUT({'a', 'b', 'c'}),
+                         self._callFUT(frozenset(['c', 'b', 'a'])))
+
+    def test_fits_family(self):
+        import BTrees
+        for family in (BTrees.family32, BTrees.family64):
+            result = self._callFUT('abc', family)
+            self.assertTrue(-family.maxint - 1 <= result <= family.maxint)
+            family.II.BTree()[1] = result
+
+    def test_unpicklable(self):
+        self.assertEqual(self._callFUT(lambda: None), None)
+
+class TestSDIndexFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.client = DummyStatsdClient()
+        self.config.registry['statsd_client'] = self.client
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, fingerprint=True):
+        from substanced.interfaces import MODE_IMMEDIATE
+        from ..indexes import FieldIndex
+        def discriminator(resource, default):
+            return getattr(resource, 'title', default)
+        return FieldIndex(
+            discriminator, action_mode=MODE_IMMEDIATE, fingerprint=fingerprint
+            )
+
+    def test_ctor_without_fingerprint(self):
+        inst = self._makeOne(fingerprint=False)
+        self.assertEqual(inst.fingerprints, None)
+
+    def test_index_doc_stores_fingerprint(self):
+        from ..indexes import fingerprint
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        self.assertEqual(inst.fingerprints[1], fingerprint('a'))
+        self.assertEqual(list(inst.applyEq('a')), [1])
+
+    def test_index_doc_missing_value(self):
+        from ..indexes import (
+            fingerprint,
+            MISSING,
+            )
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource())
+        self.assertEqual(inst.fingerprints[1], fingerprint(MISSING))
+        self.assertEqual(list(inst.not_indexed()), [1])
+
+    def test_index_doc_unpicklable_value(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.index_doc(1, testing.DummyResource(title=DummyUnpicklable()))
+        self.assertFalse(1 in inst.fingerprints)
+
+    def test_unindex_doc_removes_fingerprint(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.unindex_doc(1)
+        self.assertFalse(1 in inst.fingerprints)
+        inst.unindex_doc(1)
+
+    def test_reset_clears_fingerprints(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.reset()
+        self.assertEqual(len(inst.fingerprints), 0)
+
+    def test_reindex_resource_unchanged(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        fingerprints = dict(inst.fingerprints)
+        inst.reindex_doc = None # would fail if called
+        inst.reindex_resource(testing.DummyResource(title='a'), oid=1)
+        self.assertEqual(self.client.incrs, [('catalog.reindex_skipped', 1)])
+        self.assertEqual(list(inst.applyEq('a')), [1])
+        self.assertEqual(inst.indexed_count(), 1)
+        self.assertEqual(dict(inst.fingerprints), fingerprints)
+
+    def test_reindex_resource_unchanged_no_action_queued(self):
+        from substanced.interfaces import MODE_ATCOMMIT
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.add_action = None # would fail if called
+        inst.reindex_resource(
+            testing.DummyResource(title='a'), oid=1, action_mode=MODE_ATCOMMIT
+            )
+        self.assertEqual(len(self.client.incrs), 1)
+
+    def test_reindex_resource_changed(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.reindex_resource(testing.DummyResource(title='b'), oid=1)
+        self.assertEqual(list(inst.applyEq('b')), [1])
+        self.assertEqual(self.client.incrs, [])
+
+    def test_reindex_resource_changed_discriminates_once(self):
+        inst = self._makeOne()
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        resource = DummyCountingResource('b')
+        inst.reindex_resource(resource, oid=1)
+        self.assertEqual(resource.gets, 1)
+        self.assertEqual(list(inst.applyEq('b')), [1])
+        inst.reindex_doc = None # would fail if called
+        inst.reindex_resource(testing.DummyResource(title='b'), oid=1)
+        self.assertEqual(self.client.incrs, [('catalog.reindex_skipped', 1)])
+
+    def test_reindex_resource_not_yet_fingerprinted(self):
+        inst = self._makeOne()
+        inst.reindex_resource(testing.DummyResource(title='a'), oid=1)
+        self.assertEqual(list(inst.applyEq('a')), [1])
+        self.assertEqual(self.client.incrs, [])
+
+    def test_reindex_resource_without_fingerprints(self):
+        inst = self._makeOne(fingerprint=False)
+        inst.index_doc(1, testing.DummyResource(title='a'))
+        inst.reindex_resource(testing.DummyResource(title='a'), oid=1)
+        self.assertEqual(self.client.incrs, [])
+
+    def test_enable_fingerprints_idempotent(self):
+        inst = self._makeOne()
+        fingerprints = inst.fingerprints
+        inst.enable_fingerprints()
+        self.assertTrue(inst.fingerprints is fingerprints)
+
 class TestPathIndex(unittest.TestCase):
     def _makeOne(self, family=None):
         from ..indexes import PathIndex
@@ -540,6 +711,11 @@ class TestKeywordIndex(unittest.TestCase):
         inst = self._makeOne('abc')
         self.assertEqual(inst.action_mode, MODE_ATCOMMIT)
 
+    def test_ctor_with_fingerprint(self):
+        from ..indexes import KeywordIndex
+        inst = KeywordIndex('abc', fingerprint=True)
+        self.assertEqual(len(inst.fingerprints), 0)
+
 class TestFacetIndex(unittest.TestCase):
     def _makeOne(self, discriminator=None, facets=None, family=None,
                  action_mode=None):
@@ -566,6 +742,11 @@ class TestFacetIndex(unittest.TestCase):
         inst = self._makeOne('abc')
         self.assertEqual(inst.action_mode, MODE_ATCOMMIT)
 
+    def test_ctor_with_fingerprint(self):
+        from ..indexes import FacetIndex
+        inst = FacetIndex('abc', fingerprint=True)
+        self.assertEqual(len(inst.fingerprints), 0)
+
 class TestTextIndex(unittest.TestCase):
     def _makeOne(
         self,
@@ -596,6 +777,118 @@ class TestTextIndex(unittest.TestCase):
         inst = self._makeOne()
         self.assertEqual(inst.action_mode, MODE_ATCOMMIT)
 
+    def test_ctor_with_fingerprint(self):
+        from ..indexes import TextIndex
+        inst = TextIndex('abc', fingerprint=True)
+        self.assertEqual(len(inst.fingerprints), 0)
+
+class TestExtentIndex(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, family=None):
+        from ..indexes import ExtentIndex
+        from ...objectmap import ObjectMap
+        catalog = DummyCatalog()
+        index = ExtentIndex(family=family)
+        index.__parent__ = catalog
+        site = _makeSite(catalog=catalog)
+        objectmap = ObjectMap(site)
+        site.__objectmap__ = objectmap
+        self.a = site['a'] = testing.DummyResource()
+        self.b = site['b'] = Dummy()
+        self.c = site['c'] = Dummy()
+        objectmap.add(self.a, (_BLANK, 'a'))
+        objectmap.add(self.b, (_BLANK, 'b'))
+        objectmap.add(self.c, (_BLANK, 'c'))
+        catalog.objectids = catalog.family.II.TreeSet(
+            [self.a.__oid__, self.b.__oid__, self.c.__oid__])
+        return index
+
+    def _registerContent(self, factory_types):
+        registry = self.config.registry
+        registry.content = DummyContentRegistry(factory_types)
+
+    def test_ctor_alternate_family(self):
+        inst = self._makeOne(family=BTrees.family32)
+        self.assertEqual(inst.family, BTrees.family32)
+
+    def test_document_repr(self):
+        inst = self._makeOne()
+        result = inst.document_repr(self.a.__oid__)
+        self.assertEqual(result, 'pyramid.testing.DummyResource')
+
+    def test_document_repr_missing(self):
+        inst = self._makeOne()
+        self.assertEqual(inst.document_repr(1), None)
+
+    def test_index_doc(self):
+        inst = self._makeOne()
+        self.assertEqual(inst.index_doc(1, None), None)
+        self.assertEqual(inst.reindex_doc(1, None), None)
+        self.assertEqual(inst.unindex_doc(1), None)
+
+    def test_applyEq_factory_type(self):
+        inst = self._makeOne()
+        result = inst.applyEq(_DUMMY_DOTTED)
+        self.assertEqual(
+            sorted(result), sorted([self.b.__oid__, self.c.__oid__]))
+        self.assertEqual(result.__class__, BTrees.family64.IF.Set)
+
+    def test_applyEq_content_type(self):
+        self._registerContent({_DUMMY_DOTTED:'Dummy'})
+        inst = self._makeOne()
+        result = inst.applyEq('Dummy')
+        self.assertEqual(
+            sorted(result), sorted([self.b.__oid__, self.c.__oid__]))
+
+    def test_applyEq_missing(self):
+        self._registerContent({_DUMMY_DOTTED:'Dummy'})
+        inst = self._makeOne()
+        self.assertEqual(list(inst.applyEq('Nope')), [])
+
+    def test_applyNotEq(self):
+        inst = self._makeOne()
+        result = inst.applyNotEq(_DUMMY_DOTTED)
+        self.assertEqual(list(result), [self.a.__oid__])
+
+    def test_applyAny(self):
+        self._registerContent({_DUMMY_DOTTED:'Dummy'})
+        inst = self._makeOne()
+        result = inst.applyAny(['Dummy', 'pyramid.testing.DummyResource'])
+        self.assertEqual(len(result), 3)
+
+    def test_applyNotAny(self):
+        inst = self._makeOne()
+        result = inst.applyNotAny(['pyramid.testing.DummyResource', 'Nope'])
+        self.assertEqual(
+            sorted(result), sorted([self.b.__oid__, self.c.__oid__]))
+
+    def test_count(self):
+        self._registerContent({_DUMMY_DOTTED:'Dummy'})
+        inst = self._makeOne()
+        self.assertEqual(inst.count('Dummy'), 2)
+        self.assertEqual(inst.count(_DUMMY_DOTTED), 2)
+        self.assertEqual(inst.count('Nope'), 0)
+
+    def test_queries(self):
+        import hypatia.query
+        inst = self._makeOne()
+        self.assertEqual(inst.eq('a').__class__, hypatia.query.Eq)
+        self.assertEqual(inst.noteq('a').__class__, hypatia.query.NotEq)
+        self.assertEqual(inst.any(['a']).__class__, hypatia.query.Any)
+        self.assertEqual(inst.notany(['a']).__class__, hypatia.query.NotAny)
+
+    def test_query_execute(self):
+        inst = self._makeOne()
+        query = inst.eq(_DUMMY_DOTTED) & inst.noteq('Nope')
+        result = query._apply(None)
+        self.assertEqual(
+            sorted(result), sorted([self.b.__oid__, self.c.__oid__]))
+
 class TestAllowedIndex(unittest.TestCase):
     def setUp(self):
         self.config = testing.setUp()
@@ -632,6 +925,122 @@ class TestAllowedIndex(unittest.TestCase):
         q = index.allows('bob', 'edit')
         self.assertEqual(q._value, (('bob',), 'edit'))
 
+    def _makeMaterialized(self, allowed=None):
+        from ..indexes import AllowedIndex
+        index = AllowedIndex(
+            None, materialized=[('bob', 'view'), ('joe', 'view')])
+        index.__objectmap__ = DummyMaterializingObjectmap(allowed or {})
+        return index
+
+    def test_ctor_not_materialized(self):
+        index = self._makeOne(None)
+        self.assertEqual(index.materialized, ())
+        self.assertFalse(index.location_dependent)
+
+    def test_ctor_materialized(self):
+        index = self._makeMaterialized()
+        self.assertEqual(index.materialized, (('bob', 'view'), ('joe', 'view')))
+        self.assertEqual(
+            sorted(index._allowed.keys()), [('bob', 'view'), ('joe', 'view')])
+        self.assertTrue(index.location_dependent)
+
+    def test_index_doc_not_materialized(self):
+        index = self._makeOne(None)
+        index.index_doc(1, None)
+        index.reindex_doc(1, None)
+        index.unindex_doc(1)
+        self.assertEqual(index._allowed, None)
+
+    def test_index_doc_materialized(self):
+        index = self._makeMaterialized({'bob':[1, 2], 'joe':[2]})
+        index.index_doc(1, None)
+        index.index_doc(2, None)
+        self.assertEqual(list(index._allowed[('bob', 'view')]), [1, 2])
+        self.assertEqual(list(index._allowed[('joe', 'view')]), [2])
+
+    def test_reindex_doc_materialized(self):
+        index = self._makeMaterialized({'bob':[1]})
+        index.index_doc(1, None)
+        index.__objectmap__.allowed_oids = {'joe':[1]}
+        index.reindex_doc(1, None)
+        self.assertEqual(list(index._allowed[('bob', 'view')]), [])
+        self.assertEqual(list(index._allowed[('joe', 'view')]), [1])
+
+    def test_unindex_doc_materialized(self):
+        index = self._makeMaterialized({'bob':[1, 2]})
+        index.recompute([1, 2])
+        index.unindex_doc(1)
+        index.unindex_doc(3)
+        self.assertEqual(list(index._allowed[('bob', 'view')]), [2])
+
+    def test_reset_materialized(self):
+        index = self._makeMaterialized({'bob':[1, 2]})
+        index.recompute([1, 2])
+        index.reset()
+        self.assertEqual(list(index._allowed[('bob', 'view')]), [])
+        self.assertEqual(list(index.not_indexed()), [])
+
+    def test_recompute_with_everyone(self):
+        from pyramid.security import Everyone
+        index = self._makeMaterialized({Everyone:[1], 'bob':[2]})
+        index.recompute([1, 2, 3])
+        self.assertEqual(list(index._allowed[('bob', 'view')]), [1, 2])
+        self.assertEqual(list(index._allowed[('joe', 'view')]), [1])
+
+    def test_materialized_allowed(self):
+        from pyramid.security import Everyone
+        index = self._makeMaterialized({'bob':[1, 2], 'joe':[3]})
+        index.recompute([1, 2, 3, 4])
+        oids = index.family.IF.Set([2, 3, 4])
+        allowed, undecided = index.materialized_allowed(
+            oids, [Everyone, 'bob'], 'view')
+        self.assertEqual(list(allowed), [2])
+        self.assertEqual(list(undecided), [])
+        allowed, undecided = index.materialized_allowed(
+            oids, [Everyone, 'bob', 'joe'], 'view')
+        self.assertEqual(list(allowed), [])
+        self.assertEqual(list(undecided), [2, 3])
+
+    def test_materialized_allowed_principals_agree(self):
+        from pyramid.security import Everyone
+        index = self._makeMaterialized({'bob':[1, 2], 'joe':[2, 3]})
+        index.recompute([1, 2, 3, 4])
+        oids = index.family.IF.Set([1, 2, 3, 4])
+        allowed, undecided = index.materialized_allowed(
+            oids, [Everyone, 'bob', 'joe', 'bob'], 'view')
+        self.assertEqual(list(allowed), [2])
+        self.assertEqual(list(undecided), [1, 3])
+
+    def test_materialized_allowed_everyone(self):
+        from pyramid.security import Everyone
+        from ..indexes import AllowedIndex
+        index = AllowedIndex(None, materialized=[(Everyone, 'view')])
+        index.__objectmap__ = DummyMaterializingObjectmap({Everyone:[1]})
+        index.recompute([1, 2])
+        oids = index.family.IF.Set([1, 2])
+        allowed, undecided = index.materialized_allowed(
+            oids, [Everyone], 'view')
+        self.assertEqual(list(allowed), [1])
+        self.assertEqual(list(undecided), [])
+        self.assertEqual(
+            index.materialized_allowed(oids, [Everyone, 'bob'], 'view'), None)
+
+    def test_materialized_allowed_unknown_pair(self):
+        from pyramid.security import Everyone
+        index = self._makeMaterialized()
+        oids = index.family.IF.Set([1])
+        self.assertEqual(
+            index.materialized_allowed(
+                oids, [Everyone, 'bob', 'fred'], 'view'),
+            None)
+        self.assertEqual(
+            index.materialized_allowed(oids, [Everyone, 'bob'], 'edit'), None)
+        self.assertEqual(
+            index.materialized_allowed(oids, ['bob'], 'view'), None)
+        index = self._makeOne(None)
+        self.assertEqual(
+            index.materialized_allowed(oids, [Everyone, 'bob'], 'view'), None)
+
 class TestAllowsComparator(unittest.TestCase):
     def _makeOne(self, index, value):
         from ..indexes import AllowsComparator
@@ -653,6 +1062,93 @@ class TestAllowsComparator(unittest.TestCase):
         inst = self._makeOne(None, None)
         self.assertEqual(inst.__str__(), 'allows query')
 
+    def test_intersect_materialized_decided(self):
+        import BTrees
+        objectmap = DummyObjectmap()
+        index = Dummy()
+        index.__objectmap__ = objectmap
+        def materialized_allowed(oids, principals, permission):
+            IF = BTrees.family64.IF
+            return IF.Set([2]), IF.Set()
+        index.materialized_allowed = materialized_allowed
+        inst = self._makeOne(index, (('bob', 'joe'), 'view'))
+        result = inst.intersect(BTrees.family64.IF.Set([1, 2]), [])
+        self.assertEqual(list(result), [2])
+        self.assertFalse(hasattr(objectmap, 'cache'))
+
+    def test_intersect_materialized_undecided(self):
+        import BTrees
+        objectmap = DummyObjectmap()
+        index = Dummy()
+        index.__objectmap__ = objectmap
+        def materialized_allowed(oids, principals, permission):
+            IF = BTrees.family64.IF
+            return IF.Set([2]), IF.Set([3])
+        index.materialized_allowed = materialized_allowed
+        inst = self._makeOne(index, (('bob', 'joe'), 'view'))
+        result = inst.intersect(BTrees.family64.IF.Set([1, 2, 3]), [])
+        # DummyObjectmap.allowed allows everything it is passed
+        self.assertEqual(list(result), [2, 3])
+        self.assertTrue(hasattr(objectmap, 'cache'))
+
+    def test_intersect_materialized_effective_principals(self):
+        import BTrees
+        from pyramid import testing
+        from pyramid.security import (
+            Allow,
+            Authenticated,
+            Deny,
+            Everyone,
+            )
+        from ...objectmap import ObjectMap
+        from ..indexes import AllowedIndex
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        oids = {}
+        for name in ('a', 'b', 'c', 'd'):
+            oids[name] = objectmap.add(testing.DummyResource(), ('', name))
+        objectmap.set_acl(('',), [(Allow, Everyone, 'view')])
+        objectmap.set_acl(('', 'b'), [(Deny, Everyone, 'view')])
+        objectmap.set_acl(
+            ('', 'c'),
+            [(Allow, 'fred', 'view'), (Deny, Authenticated, 'view')],
+            )
+        objectmap.set_acl(
+            ('', 'd'),
+            [(Deny, Authenticated, 'view'), (Allow, 'fred', 'view')],
+            )
+        principals = (Everyone, Authenticated, 'fred')
+        index = AllowedIndex(
+            None,
+            materialized=[ (principal, 'view') for principal in principals ],
+            )
+        index.__objectmap__ = objectmap
+        index.recompute(oids.values())
+        walked = []
+        allowed = objectmap.allowed
+        def walk(oids, principals, permission, cache=None):
+            walked.extend(oids)
+            return allowed(oids, principals, permission, cache=cache)
+        objectmap.allowed = walk
+        inst = self._makeOne(index, (principals, 'view'))
+        result = inst.intersect(
+            BTrees.family64.IF.Set([oids['a'], oids['b']]), [])
+        self.assertEqual(list(result), [oids['a']])
+        self.assertEqual(walked, [])
+        result = inst.intersect(BTrees.family64.IF.Set(oids.values()), [])
+        self.assertEqual(sorted(result), sorted([oids['a'], oids['c']]))
+        self.assertEqual(sorted(walked), sorted([oids['c'], oids['d']]))
+
+    def test_intersect_not_materialized(self):
+        import BTrees
+        objectmap = DummyObjectmap()
+        index = Dummy()
+        index.__objectmap__ = objectmap
+        index.materialized_allowed = lambda *arg: None
+        inst = self._makeOne(index, (('bob',), 'view'))
+        result = inst.intersect(BTrees.family64.IF.Set([1, 2]), [])
+        self.assertEqual(list(result), [1, 2])
+
     def test_intersect(self):
         objectmap = DummyObjectmap()
         context = Dummy()
@@ -660,6 +1156,26 @@ class TestAllowsComparator(unittest.TestCase):
         inst = self._makeOne(context, (('fred',), 'edit'))
         result = inst.intersect([1], [])
         self.assertEqual(list(result), [1])
+        self.assertTrue(objectmap.cache is not None)
+
+    def test_intersect_shares_cache_within_request(self):
+        from pyramid.threadlocal import manager
+        objectmap = DummyObjectmap()
+        context = Dummy()
+        context.__objectmap__ = objectmap
+        inst = self._makeOne(context, (('fred',), 'edit'))
+        request = testing.DummyRequest()
+        manager.push({'request':request, 'registry':None})
+        try:
+            inst.intersect([1], [])
+            cache = objectmap.cache
+            inst.intersect([1], [])
+        finally:
+            manager.pop()
+        self.assertTrue(objectmap.cache is cache)
+        self.assertTrue(request._sd_allowed_cache is cache)
+        inst.intersect([1], [])
+        self.assertFalse(objectmap.cache is cache)
         
 class TestIndexPropertySheet(unittest.TestCase):
     def _makeOne(self, context, request):
@@ -696,6 +1212,22 @@ class TestIndexPropertySheet(unittest.TestCase):
 class Dummy(object):
     pass
 
+_DUMMY_DOTTED = 'substanced.catalog.tests.test_indexes.Dummy'
+
+class DummyContentRegistry(object):
+    def __init__(self, factory_types):
+        self.factory_types = factory_types
+
+class DummyCountingResource(object):
+    def __init__(self, title):
+        self._title = title
+        self.gets = 0
+
+    @property
+    def title(self):
+        self.gets += 1
+        return self._title
+
 class DummyCatalog(object):
     family = BTrees.family64
     def __init__(self, objectids=None):
@@ -706,7 +1238,21 @@ class DummyCatalog(object):
 class DummyObjectmap(object):
     def object_for(self, docid): return 'a'
 
-    def allowed(self, theset, principals, permission): return theset
+    def object_for_many(self, docids): return [ 'a' for x in docids ]
+
+    def allowed(self, theset, principals, permission, cache=None):
+        self.cache = cache
+        return theset
+
+class DummyMaterializingObjectmap(object):
+    def __init__(self, allowed_oids):
+        self.allowed_oids = allowed_oids
+
+    def allowed(self, oids, principals, permission, cache=None):
+        allowed = set()
+        for principal in principals:
+            allowed.update(self.allowed_oids.get(principal, ()))
+        return [ oid for oid in oids if oid in allowed ]
 
 class DummyQuery(object):
     def flush(self, *arg, **kw):
@@ -715,6 +1261,17 @@ class DummyQuery(object):
     def _apply(self, names):
         return [1,2,3]
     
+class DummyUnpicklable(str):
+    def __reduce__(self):
+        raise TypeError('not picklable')
+
+class DummyStatsdClient(object):
+    def __init__(self):
+        self.incrs = []
+
+    def incr(self, name, value, rate=1):
+        self.incrs.append((name, value))
+
 class DummyDiscriminator(object):
     permissions = (1, 2)
     def __call__(self): pass
@@ -0,0 +1,269 @@
+import re
+import unittest
+
+from pyramid import testing
+
+_BLANK = ''
+
+class Test_reindex(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        from .. import parallel
+        parallel._worker.clear()
+        testing.tearDown()
+
+    def _callFUT(self, catalog, **kw):
+        from ..parallel import reindex
+        self.committed = []
+        def commit_or_abort():
+            self.committed.append(True)
+        kw.setdefault('registry', self.config.registry)
+        kw.setdefault('pool_factory', self._makePool)
+        return reindex(catalog, 2, 'development.ini', commit_or_abort, **kw)
+
+    def _makePool(self, workers, initializer, initargs):
+        from .. import parallel
+        self.pool = DummyPool(workers, initializer, initargs)
+        # what _init_worker would do in each worker process
+        catalog = self.catalog
+        parallel._worker['catalog'] = catalog
+        parallel._worker['objectmap'] = catalog.__parent__.__objectmap__
+        return self.pool
+
+    def _makeSite(self, nodes=('a', 'b')):
+        from zope.interface import Interface
+        from ...folder import Folder
+        from ...interfaces import (
+            ICatalogFactory,
+            IIndexView,
+            )
+        from ...objectmap import ObjectMap
+        from .. import Catalog
+        from ..factories import (
+            CatalogFactory,
+            Field,
+            Path,
+            )
+        registry = self.config.registry
+        def title(resource, default):
+            return getattr(resource, 'title', default)
+        registry.registerAdapter(
+            title, (Interface,), IIndexView, name='catalog|title')
+        factory = CatalogFactory(
+            'catalog', {'title':Field(), 'path':Path()})
+        registry.registerUtility(factory, ICatalogFactory, name='catalog')
+        site = Folder()
+        site.__objectmap__ = ObjectMap(site)
+        site.__objectmap__.add(site, (_BLANK,))
+        catalog = self.catalog = Catalog()
+        site.add('catalog', catalog, send_events=False)
+        for index_name, index_factory in factory.index_factories.items():
+            catalog.add(
+                index_name,
+                index_factory('catalog', index_name),
+                send_events=False,
+                )
+        for name in nodes:
+            resource = testing.DummyResource(title=name.upper())
+            site.add(name, resource, send_events=False)
+            catalog.objectids.insert(resource.__oid__)
+        return site
+
+    def test_rebuilds_factory_indexes(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        old_title = catalog['title']
+        old_path = catalog['path']
+        out = []
+        self._callFUT(catalog, output=out.append)
+        title = catalog['title']
+        self.assertFalse(title is old_title)
+        self.assertTrue(catalog['path'] is old_path)
+        self.assertEqual(title.__sdi_deletable__, False)
+        self.assertEqual(
+            list(title.applyEq('A')), [site['a'].__oid__])
+        self.assertEqual(title.indexed_count(), 2)
+        self.assertEqual(catalog._fresh_indexes, None)
+        self.assertEqual(
+            sorted(out),
+            sorted(["catalog replacing index 'title' with its rebuilt version",
+                    'catalog reindexing /a',
+                    'catalog reindexing /b',
+                    'catalog reindexing with 2 workers']))
+        self.assertEqual(self.committed, [True])
+        self.assertEqual(self.pool.workers, 2)
+        self.assertEqual(self.pool.initargs, ('development.ini', '/catalog'))
+        self.assertTrue(self.pool.closed)
+        self.assertTrue(self.pool.joined)
+        self.assertFalse(self.pool.terminated)
+
+    def test_not_indexed(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        del site['a'].title
+        self._callFUT(catalog, output=False)
+        title = catalog['title']
+        self.assertEqual(list(title.not_indexed()), [site['a'].__oid__])
+        self.assertEqual(list(title.indexed()), [site['b'].__oid__])
+
+    def test_path_re_reindexes_in_place(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        title = catalog['title']
+        site['a'].title = 'OLD'
+        title.index_doc(site['a'].__oid__, site['a'])
+        site['a'].title = 'NEW'
+        site['b'].title = 'NEW'
+        out = []
+        self._callFUT(catalog, path_re=re.compile('/a'), output=out.append)
+        self.assertTrue(catalog['title'] is title)
+        self.assertEqual(
+            list(title.applyEq('NEW')), [site['a'].__oid__])
+        self.assertEqual(
+            out,
+            ['catalog reindexing with 2 workers',
+             'catalog reindexing /a',
+             ])
+
+    def test_indexes(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        old_title = catalog['title']
+        self._callFUT(catalog, indexes=['path'], output=False)
+        self.assertTrue(catalog['title'] is old_title)
+        self.assertEqual(old_title.indexed_count(), 0)
+
+    def test_no_catalog_factory(self):
+        from ...interfaces import ICatalogFactory
+        site = self._makeSite()
+        catalog = site['catalog']
+        title = catalog['title']
+        self.config.registry.unregisterUtility(
+            provided=ICatalogFactory, name='catalog')
+        self._callFUT(catalog, output=False)
+        self.assertTrue(catalog['title'] is title)
+        self.assertEqual(title.indexed_count(), 2)
+
+    def test_missing_objects(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        oid_a = site['a'].__oid__
+        site.__objectmap__.remove(oid_a)
+        catalog.objectids.insert(12345)
+        b = site['b']
+        del site.data['b'] # behind the objectmap's back
+        out = []
+        self._callFUT(catalog, output=out.append)
+        self.assertEqual(
+            sorted(out[1:4]),
+            sorted(['error: no path for objectid %s in object map' % oid_a,
+                    'error: no path for objectid 12345 in object map',
+                    'error: object at path /b not found']))
+        self.assertEqual(catalog['title'].indexed_count(), 0)
+        self.assertTrue(b)
+
+    def test_commit_interval(self):
+        site = self._makeSite(nodes=('a', 'b', 'c'))
+        self._callFUT(site['catalog'], commit_interval=2, output=False)
+        self.assertEqual(len(self.committed), 2)
+
+    def test_bounded_submissions(self):
+        site = self._makeSite(nodes=('a', 'b', 'c', 'd', 'e', 'f'))
+        catalog = site['catalog']
+        self._callFUT(catalog, chunk_size=1, output=False)
+        self.assertEqual(self.pool.submitted, 6)
+        self.assertEqual(self.pool.consumed, 6)
+        self.assertEqual(self.pool.outstanding, 4)
+        self.assertEqual(catalog['title'].indexed_count(), 6)
+
+    def test_discards_leftover_fresh_indexes(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        catalog._fresh_indexes = catalog.family.OO.BTree({'title':None})
+        out = []
+        self._callFUT(catalog, path_re=re.compile('/a'), output=out.append)
+        self.assertEqual(catalog._fresh_indexes, None)
+        self.assertEqual(
+            out[0],
+            'catalog discarding the indexes left by an interrupted reindex')
+
+    def test_not_an_sdindex(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        catalog.add('other', DummyIndex(), send_events=False)
+        self.assertRaises(ValueError, self._callFUT, catalog, output=False)
+
+    def test_worker_error_terminates_pool(self):
+        site = self._makeSite()
+        catalog = site['catalog']
+        def title(resource, default):
+            raise ValueError('broken')
+        from zope.interface import Interface
+        from ...interfaces import IIndexView
+        self.config.registry.registerAdapter(
+            title, (Interface,), IIndexView, name='catalog|title')
+        self.assertRaises(ValueError, self._callFUT, catalog, output=False)
+        self.assertTrue(self.pool.terminated)
+        self.assertTrue(self.pool.joined)
+        self.assertFalse(self.pool.closed)
+
+class Test_spawn_pool(unittest.TestCase):
+    def test_it(self):
+        from .. import parallel
+        class DummyContext(object):
+            def Pool(self, *arg):
+                self.arg = arg
+                return 'pool'
+        context = DummyContext()
+        orig = parallel.multiprocessing
+        class DummyMultiprocessing(object):
+            def get_context(self, method):
+                self.method = method
+                return context
+        multiprocessing = parallel.multiprocessing = DummyMultiprocessing()
+        try:
+            result = parallel.spawn_pool(2, 'init', ('a',))
+        finally:
+            parallel.multiprocessing = orig
+        self.assertEqual(result, 'pool')
+        self.assertEqual(multiprocessing.method, 'spawn')
+        self.assertEqual(context.arg, (2, 'init', ('a',)))
+
+class DummyPool(object):
+    closed = joined = terminated = False
+
+    def __init__(self, workers, initializer, initargs):
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+
+    submitted = consumed = outstanding = 0
+
+    def apply_async(self, func, args):
+        self.submitted += 1
+        self.outstanding = max(
+            self.outstanding, self.submitted - self.consumed)
+        return DummyAsyncResult(self, func(*args))
+
+    def close(self):
+        self.closed = True
+
+    def terminate(self):
+        self.terminated = True
+
+    def join(self):
+        self.joined = True
+
+class DummyAsyncResult(object):
+    def __init__(self, pool, result):
+        self.pool = pool
+        self.result = result
+
+    def get(self):
+        self.pool.consumed += 1
+        return self.result
+
+class DummyIndex(object):
+    pass
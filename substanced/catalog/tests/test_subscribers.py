@@ -114,6 +114,196 @@ class Test_object_added(unittest.TestCase):
         self.assertEqual(reindexed[1][0], model1)
         self.assertEqual(reindexed[1][1], 1)
 
+    def test_moving_rename_no_location_dependent_indexes(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['title'] = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        objectmap = DummyObjectMap()
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry(
+            [('system', 'title', False)]
+            )
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(catalog.reindexed, [(model1, 1)])
+        self.assertEqual(catalog['title'].reindexed, [])
+
+    def test_moving_rename_some_location_dependent_indexes(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['title'] = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        catalog['where'] = DummyIndex(IndexViewDiscriminator('system', 'where'))
+        objectmap = DummyObjectMap()
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry(
+            [('system', 'title', False), ('system', 'where', True)]
+            )
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(catalog.reindexed, [(model1, 1)])
+        self.assertEqual(catalog['title'].reindexed, [])
+        self.assertEqual(catalog['where'].reindexed, [(model2, 2)])
+
+    def test_moving_rename_descendant_without_oid(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['where'] = DummyIndex(IndexViewDiscriminator('system', 'where'))
+        objectmap = DummyObjectMap()
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model3 = testing.DummyResource()
+        model1['model2'] = model2
+        model1['model3'] = model3
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([('system', 'where', True)])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(catalog.reindexed, [(model1, 1)])
+        self.assertEqual(catalog['where'].reindexed, [(model2, 2)])
+
+    def test_moving_rename_descendants_added_to_objectids(self):
+        from ...interfaces import IFolder
+        from substanced.interfaces import MODE_IMMEDIATE
+        from .. import Catalog
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import FieldIndex
+        catalog = Catalog()
+        catalog['where'] = FieldIndex(
+            IndexViewDiscriminator('system', 'where'),
+            action_mode=MODE_IMMEDIATE,
+            )
+        objectmap = DummyObjectMap()
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([('system', 'where', True)])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(sorted(catalog.objectids), [1, 2])
+
+    def test_moving_rename_materialized_allowed_index(self):
+        from ...interfaces import IFolder
+        from substanced.interfaces import MODE_IMMEDIATE
+        from .. import Catalog
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import (
+            AllowedIndex,
+            FieldIndex,
+            )
+        catalog = Catalog()
+        catalog['where'] = FieldIndex(
+            IndexViewDiscriminator('system', 'where'),
+            action_mode=MODE_IMMEDIATE,
+            )
+        index = AllowedIndex(None, materialized=[('a', 'view')])
+        recomputed = []
+        index.recompute = lambda oids: recomputed.append(list(oids))
+        catalog['allowed'] = index
+        objectmap = DummyObjectMap(result=[1, 2, 3])
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([('system', 'where', True)])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(sorted(catalog.objectids), [1, 2])
+        self.assertEqual(recomputed, [[1, 2]])
+
+    def test_moving_rename_only_materialized_allowed_index(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import AllowedIndex
+        catalog = DummyCatalog()
+        catalog.objectids.update([1, 2])
+        index = AllowedIndex(None, materialized=[('a', 'view')])
+        recomputed = []
+        index.recompute = lambda oids: recomputed.append(list(oids))
+        catalog['allowed'] = index
+        catalog['title'] = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        objectmap = DummyObjectMap(result=[1, 2])
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([('system', 'title', False)])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(catalog['title'].reindexed, [(model1, 1)])
+        self.assertEqual(recomputed, [[1, 2]])
+
+    def test_moving_rename_materialized_allowed_index_no_introspection(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import AllowedIndex
+        catalog = DummyCatalog()
+        catalog.objectids.update([1, 2])
+        index = AllowedIndex(None, materialized=[('a', 'view')])
+        recomputed = []
+        index.recompute = lambda oids: recomputed.append(list(oids))
+        catalog['allowed'] = index
+        catalog['title'] = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        objectmap = DummyObjectMap(result=[1, 2])
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(
+            catalog['title'].reindexed, [(model2, 2), (model1, 1)])
+        self.assertEqual(recomputed, [[1, 2]])
+
+    def test_moving_rename_no_introspection(self):
+        from ...interfaces import IFolder
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['title'] = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        objectmap = DummyObjectMap()
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model1 = testing.DummyResource(__provides__=(IFolder,))
+        model1.__oid__ = 1
+        model2 = testing.DummyResource()
+        model2.__oid__ = 2
+        model1['model2'] = model2
+        site['model1'] = model1
+        registry = DummyIntrospectorRegistry([])
+        event = DummyEvent(model1, site, registry=registry, moving=site)
+        self._callFUT(event)
+        self.assertEqual(catalog.reindexed, [(model2, 2), (model1, 1)])
+
     def test_moving_not_rename_same_catalogs(self):
         from ...interfaces import IFolder
         catalog = DummyCatalog()
@@ -157,6 +347,149 @@ class Test_object_added(unittest.TestCase):
         self.assertEqual(indexed[1][0], model1)
         self.assertEqual(indexed[1][1], 1)
 
+class Test_location_dependent_indexes(unittest.TestCase):
+    def _callFUT(self, catalog, registry):
+        from ..subscribers import location_dependent_indexes
+        return location_dependent_indexes(catalog, registry)
+
+    def test_no_registry(self):
+        catalog = DummyCatalog()
+        self.assertEqual(self._callFUT(catalog, None), None)
+
+    def test_no_index_views_introspected(self):
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        registry = DummyIntrospectorRegistry([])
+        self.assertEqual(self._callFUT(catalog, registry), None)
+
+    def test_fake_index(self):
+        from ..indexes import PathIndex
+        catalog = DummyCatalog()
+        catalog['path'] = PathIndex()
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(self._callFUT(catalog, registry), [])
+
+    def test_materialized_allowed_index(self):
+        from ..indexes import AllowedIndex
+        catalog = DummyCatalog()
+        catalog['allowed'] = AllowedIndex(None, materialized=[('a', 'view')])
+        catalog['other'] = AllowedIndex(None)
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(self._callFUT(catalog, registry), ['allowed'])
+
+    def test_non_indexview_discriminator(self):
+        catalog = DummyCatalog()
+        catalog['other'] = DummyIndex(object())
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(self._callFUT(catalog, registry), ['other'])
+
+    def test_indexview_registered_without_introspectable(self):
+        from zope.interface import Interface
+        from ...interfaces import IIndexView
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        catalog['b'] = DummyIndex(IndexViewDiscriminator('system', 'b'))
+        registry = DummyIntrospectorRegistry(
+            [('other', 'a', True)],
+            [DummyAdapterRegistration(IIndexView, 'system|a'),
+             DummyAdapterRegistration(Interface, 'system|b')],
+            )
+        self.assertEqual(self._callFUT(catalog, registry), ['a'])
+
+    def test_indexview_discriminator(self):
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        catalog['b'] = DummyIndex(IndexViewDiscriminator('system', 'b'))
+        catalog['c'] = DummyIndex(IndexViewDiscriminator('system', 'c'))
+        registry = DummyIntrospectorRegistry(
+            [('system', 'a', False),
+             ('system', 'b', False),
+             ('system', 'b', True)]
+            )
+        self.assertEqual(sorted(self._callFUT(catalog, registry)), ['b'])
+
+    def test_declarations_cached_until_invalidated(self):
+        from ..discriminators import (
+            IndexViewDiscriminator,
+            invalidate_index_view_cache,
+            )
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        registry = DummyIntrospectorRegistry([('system', 'a', False)])
+        self.assertEqual(self._callFUT(catalog, registry), [])
+        registry.introspector.intrs[0]['location_dependent'] = True
+        self.assertEqual(self._callFUT(catalog, registry), [])
+        invalidate_index_view_cache(registry)
+        self.assertEqual(self._callFUT(catalog, registry), ['a'])
+
+class Test_affected_indexes(unittest.TestCase):
+    def _callFUT(self, catalog, registry, changed):
+        from ..subscribers import affected_indexes
+        return affected_indexes(catalog, registry, changed)
+
+    def test_no_registry(self):
+        catalog = DummyCatalog()
+        self.assertEqual(self._callFUT(catalog, None, {'title'}), None)
+
+    def test_changed_unknown(self):
+        catalog = DummyCatalog()
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(self._callFUT(catalog, registry, None), None)
+
+    def test_no_index_views_introspected(self):
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        registry = DummyIntrospectorRegistry([])
+        self.assertEqual(self._callFUT(catalog, registry, {'title'}), None)
+
+    def test_fake_index(self):
+        from ..indexes import PathIndex
+        catalog = DummyCatalog()
+        catalog['path'] = PathIndex()
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(self._callFUT(catalog, registry, {'title'}), [])
+
+    def test_non_indexview_discriminator(self):
+        catalog = DummyCatalog()
+        catalog['other'] = DummyIndex(object())
+        registry = DummyIntrospectorRegistry([('other', 'a', True)])
+        self.assertEqual(
+            self._callFUT(catalog, registry, {'title'}), ['other'])
+
+    def test_indexview_discriminator(self):
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            catalog[name] = DummyIndex(IndexViewDiscriminator('system', name))
+        registry = DummyIntrospectorRegistry(
+            [('system', 'a', True, frozenset(['title'])),
+             ('system', 'b', True, frozenset(['body'])),
+             ('system', 'b', True, frozenset(['title'])),
+             ('system', 'c', True, frozenset(['body'])),
+             ('system', 'd', True, frozenset(['body'])),
+             ('system', 'd', True, None)]
+            )
+        self.assertEqual(
+            sorted(self._callFUT(catalog, registry, {'title'})),
+            ['a', 'b', 'd'])
+
+    def test_indexview_registered_without_introspectable(self):
+        from ...interfaces import IIndexView
+        from ..discriminators import IndexViewDiscriminator
+        catalog = DummyCatalog()
+        catalog['a'] = DummyIndex(IndexViewDiscriminator('system', 'a'))
+        catalog['b'] = DummyIndex(IndexViewDiscriminator('system', 'b'))
+        registry = DummyIntrospectorRegistry(
+            [('system', 'b', True, frozenset(['body']))],
+            [DummyAdapterRegistration(IIndexView, 'system|a'),
+             DummyAdapterRegistration(IIndexView, 'system|b')],
+            )
+        self.assertEqual(self._callFUT(catalog, registry, {'title'}), ['a'])
+
 class Test_object_removed(unittest.TestCase):
     def _callFUT(self, event):
         from ..subscribers import object_removed
@@ -271,6 +604,82 @@ class Test_object_modified(unittest.TestCase):
         self.assertEqual(reindexed[0][0], model)
         self.assertEqual(reindexed[0][1], 1)
 
+    def test_changed_names(self):
+        from ..discriminators import IndexViewDiscriminator
+        objectmap = DummyObjectMap()
+        catalog = DummyCatalog()
+        title = DummyIndex(IndexViewDiscriminator('system', 'title'))
+        body = DummyIndex(IndexViewDiscriminator('system', 'body'))
+        catalog['title'] = title
+        catalog['body'] = body
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model = testing.DummyResource()
+        model.__oid__ = 1
+        site['model'] = model
+        event = DummyEvent(model, site)
+        event.changed = frozenset(['title'])
+        event.registry = DummyIntrospectorRegistry(
+            [('system', 'title', True, frozenset(['title'])),
+             ('system', 'body', True, frozenset(['body']))]
+            )
+        self._callFUT(event)
+        self.assertEqual(catalog.reindexed, [])
+        self.assertEqual(title.reindexed, [(model, 1)])
+        self.assertEqual(body.reindexed, [])
+
+    def test_changed_names_adds_to_objectids(self):
+        from substanced.interfaces import MODE_IMMEDIATE
+        from .. import Catalog
+        from ..discriminators import IndexViewDiscriminator
+        from ..indexes import FieldIndex
+        objectmap = DummyObjectMap()
+        catalog = Catalog()
+        catalog['title'] = FieldIndex(
+            IndexViewDiscriminator('system', 'title'),
+            action_mode=MODE_IMMEDIATE,
+            )
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        model = testing.DummyResource()
+        model.__oid__ = 1
+        site['model'] = model
+        event = DummyEvent(model, site)
+        event.changed = frozenset(['body'])
+        event.registry = DummyIntrospectorRegistry(
+            [('system', 'title', True, frozenset(['title']))]
+            )
+        self._callFUT(event)
+        self.assertEqual(list(catalog.objectids), [1])
+        self.assertEqual(list(catalog['title'].not_indexed()), [])
+
+    def test_changed_names_introspection_disabled(self):
+        from .. import add_indexview
+        from ..discriminators import IndexViewDiscriminator
+        config = testing.setUp()
+        try:
+            config.introspection = False
+            add_indexview(
+                config,
+                lambda resource, default: resource.title,
+                'system',
+                'title',
+                depends_on=('title',),
+                )
+            config.commit()
+            objectmap = DummyObjectMap()
+            catalog = DummyCatalog()
+            catalog['title'] = DummyIndex(
+                IndexViewDiscriminator('system', 'title'))
+            site = _makeSite(objectmap=objectmap, catalog=catalog)
+            model = testing.DummyResource()
+            model.__oid__ = 1
+            site['model'] = model
+            event = DummyEvent(model, site, registry=config.registry)
+            event.changed = frozenset(['title'])
+            self._callFUT(event)
+            self.assertEqual(catalog.reindexed, [(model, 1)])
+        finally:
+            testing.tearDown()
+
     def test_multiple_catalogs(self):
         objectmap = DummyObjectMap()
         catalog1 = DummyCatalog()
@@ -294,6 +703,42 @@ class Test_object_modified(unittest.TestCase):
             self.assertEqual(reindexed[0][0], model)
             self.assertEqual(reindexed[0][1], 1)
 
+class Test_acl_modified(unittest.TestCase):
+    def _callFUT(self, event):
+        from ..subscribers import acl_modified
+        return acl_modified(event)
+
+    def test_no_objectmap(self):
+        model = testing.DummyResource()
+        event = DummyEvent(model, None)
+        self._callFUT(event) # doesnt blow up
+
+    def test_no_materialized_index(self):
+        from ..indexes import AllowedIndex
+        objectmap = DummyObjectMap()
+        catalog = DummyCatalog()
+        catalog['allowed'] = AllowedIndex(None)
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        event = DummyEvent(site, None)
+        self._callFUT(event)
+        self.assertFalse(hasattr(objectmap, 'acl'))
+
+    def test_recomputes_subtree(self):
+        from ..indexes import AllowedIndex
+        objectmap = DummyObjectMap(result=[1, 2, 3])
+        catalog = DummyCatalog()
+        catalog.objectids.update([1, 2])
+        index = AllowedIndex(None, materialized=[('a', 'view')])
+        recomputed = []
+        index.recompute = lambda oids: recomputed.append(list(oids))
+        catalog['allowed'] = index
+        site = _makeSite(objectmap=objectmap, catalog=catalog)
+        event = DummyEvent(site, None)
+        event.new_acl = [('Allow', 'a', 'view')]
+        self._callFUT(event)
+        self.assertEqual(objectmap.acl, (site, [('Allow', 'a', 'view')]))
+        self.assertEqual(recomputed, [[1, 2]])
+
 class Test_on_startup(unittest.TestCase):
     def setUp(self):
         self.config = testing.setUp()
@@ -462,8 +907,12 @@ class DummyCatalog(dict):
     def unindex_resource(self, resource_or_oid):
         self.unindexed.append(resource_or_oid)
 
-    def reindex_resource(self, resource, oid=None):
-        self.reindexed.append((resource, oid))
+    def reindex_resource(self, resource, oid=None, indexes=None):
+        if indexes is None:
+            self.reindexed.append((resource, oid))
+        else:
+            for name in indexes:
+                self[name].reindex_resource(resource, oid=oid)
 
     def update_indexes(self, *arg, **kw):
         if self.raises:
@@ -483,7 +932,13 @@ class DummyObjectMap:
 
     def object_for(self, oid):
         return self.object_result
-    
+
+    def set_acl(self, obj, acl):
+        self.acl = (obj, acl)
+
+    def pathlookup(self, obj):
+        return self.family.IF.Set(self.result)
+
 class DummyEvent(object):
     removed_oids = None
     def __init__(self, object, parent, registry=None, moving=None):
@@ -495,6 +950,44 @@ class DummyEvent(object):
 class DummyContent(object):
     pass
 
+class DummyIndex(object):
+    def __init__(self, discriminator):
+        self.discriminator = discriminator
+        self.reindexed = []
+
+    def reindex_resource(self, resource, oid=None):
+        self.reindexed.append((resource, oid))
+
+class DummyIntrospector(object):
+    def __init__(self, intrs):
+        self.intrs = intrs
+
+    def get_category(self, name, default=None):
+        return [{'introspectable':intr} for intr in self.intrs]
+
+class DummyIntrospectorRegistry(object):
+    def __init__(self, views, registrations=()):
+        intrs = []
+        for view in views:
+            catalog_name, index_name, location_dependent = view[:3]
+            intr = {'catalog_name':catalog_name,
+                    'index_name':index_name,
+                    'name':'%s|%s' % (catalog_name, index_name),
+                    'location_dependent':location_dependent}
+            if len(view) > 3:
+                intr['depends_on'] = view[3]
+            intrs.append(intr)
+        self.introspector = DummyIntrospector(intrs)
+        self.registrations = list(registrations)
+
+    def registeredAdapters(self):
+        return iter(self.registrations)
+
+class DummyAdapterRegistration(object):
+    def __init__(self, provided, name):
+        self.provided = provided
+        self.name = name
+
 class DummyRegistry(object):
     def __init__(self, content):
         self.content = content
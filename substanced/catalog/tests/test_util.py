@@ -19,3 +19,58 @@ class Test_oid_from_resource(unittest.TestCase):
         resource.__oid__ = 1
         self.assertEqual(self._callFUT(resource), 1)
 
+
+class TestObjectMapResolver(unittest.TestCase):
+    def _makeOne(self, objectmap):
+        from ..util import ObjectMapResolver
+        return ObjectMapResolver(objectmap)
+
+    def test___call__(self):
+        inst = self._makeOne(DummyObjectMap())
+        self.assertEqual(inst(1), ('one', 1))
+
+    def test_resolve_many(self):
+        objectmap = DummyObjectMap()
+        inst = self._makeOne(objectmap)
+        self.assertEqual(list(inst.resolve_many([1, 2])), [('many', 1),
+                                                           ('many', 2)])
+
+class TestResultSet(unittest.TestCase):
+    def _makeOne(self, ids, resolver):
+        from ..util import ResultSet
+        return ResultSet(ids, len(ids), resolver)
+
+    def test_all_with_resolve_many(self):
+        from ..util import ObjectMapResolver
+        resolver = ObjectMapResolver(DummyObjectMap())
+        inst = self._makeOne([1, 2], resolver)
+        self.assertEqual(list(inst.all()), [('many', 1), ('many', 2)])
+        self.assertEqual(list(inst), [('many', 1), ('many', 2)])
+        self.assertEqual(inst.first(), ('one', 1))
+
+    def test_all_without_resolve_many(self):
+        inst = self._makeOne([1, 2], lambda oid: oid * 10)
+        self.assertEqual(list(inst.all()), [10, 20])
+
+    def test_all_resolve_False(self):
+        inst = self._makeOne([1, 2], lambda oid: oid * 10)
+        self.assertEqual(list(inst.all(resolve=False)), [1, 2])
+
+    def test_sort_preserves_class(self):
+        from ..util import ResultSet
+        inst = self._makeOne([2, 1], None)
+        result = inst.sort(DummyIndex())
+        self.assertEqual(result.__class__, ResultSet)
+        self.assertEqual(list(result.ids), [1, 2])
+
+class DummyObjectMap(object):
+    def object_for(self, oid):
+        return ('one', oid)
+
+    def object_for_many(self, oids):
+        for oid in oids:
+            yield ('many', oid)
+
+class DummyIndex(object):
+    def sort(self, ids, **kw):
+        return sorted(ids)
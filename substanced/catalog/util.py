@@ -1,3 +1,5 @@
+import hypatia.util
+
 from ..util import get_oid
 
 def oid_from_resource(resource):
@@ -7,3 +9,25 @@ def oid_from_resource(resource):
             'Resource must be an object with an integer __oid__ attribute'
             )
     return oid
+
+class ObjectMapResolver(object):
+    """ A resultset resolver which resolves oids using an objectmap.  When a
+    :class:`ResultSet` resolves all of its oids, it does so in batches via
+    ``resolve_many``."""
+    def __init__(self, objectmap):
+        self.objectmap = objectmap
+
+    def __call__(self, oid):
+        return self.objectmap.object_for(oid)
+
+    def resolve_many(self, oids):
+        return self.objectmap.object_for_many(oids)
+
+class ResultSet(hypatia.util.ResultSet):
+    """ A hypatia resultset which resolves all of its oids using the
+    ``resolve_many`` method of its resolver, if the resolver has one."""
+    def _resolve_all(self, resolver):
+        resolve_many = getattr(resolver, 'resolve_many', None)
+        if resolve_many is None:
+            return super(ResultSet, self)._resolve_all(resolver)
+        return resolve_many(self.ids)
@@ -482,10 +482,14 @@ class ReferencesDumper(object):
                         targets = d.get('targets', ())
                         sources = d.get('sources', ())
                         if objectmap is not None:
-                            for target in targets:
-                                objectmap.connect(oid, target, reftype)
-                            for source in sources:
-                                objectmap.connect(source, oid, reftype)
+                            objectmap.connect_many(
+                                [ (oid, target) for target in targets ],
+                                reftype
+                                )
+                            objectmap.connect_many(
+                                [ (source, oid) for source in sources ],
+                                reftype
+                                )
             context.add_callback(add_references)
 
 class SDIPropertiesDumper(object):
@@ -941,6 +941,10 @@ class DummyObjectmap(object):
     def connect(self, oid, target, reftype):
         self.connected.append((oid, target, reftype))
 
+    def connect_many(self, pairs, reftype):
+        for oid, target in pairs:
+            self.connect(oid, target, reftype)
+
 class DummyYAMLDumperLoader(object):
     def __init__(self):
         self.constructors = []
@@ -114,9 +114,14 @@ class ObjectWillBeRemoved(object):
 
 @implementer(IObjectModified)
 class ObjectModified(object): # pragma: no cover
-    """ An event sent when an object has been modified."""
-    def __init__(self, object):
+    """ An event sent when an object has been modified.  ``changed``, if
+    passed, should be the names of the attributes of the object which were
+    changed; ``None`` means they are unknown."""
+    def __init__(self, object, changed=None):
         self.object = object
+        if changed is not None:
+            changed = frozenset(changed)
+        self.changed = changed
 
 @implementer(IACLModified)
 class ACLModified(object): # pragma: no cover
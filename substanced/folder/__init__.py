@@ -8,11 +8,9 @@ from persistent import (
     )
 from persistent.interfaces import IPersistent
 from pyramid.location import (
-    lineage,
     inside,
     )
 from pyramid.threadlocal import get_current_registry
-from pyramid.traversal import resource_path_tuple
 from zope.copy.interfaces import (
     ICopyHook,
     ResumeCopy
@@ -36,11 +34,13 @@ from ..interfaces import (
     IService,
     marker,
     )
-from ..objectmap import find_objectmap
+from ..objectmap import (
+    find_objectmap,
+    get_path_tuple,
+    )
 from ..stats import statsd_timer
 from ..util import (
     get_oid,
-    postorder,
     find_service,
     find_services,
     wrap_if_broken,
@@ -433,6 +433,11 @@ class Folder(Persistent):
         ``True``, the ``loading`` attribute of events sent as a result of
         calling this method will be ``True`` too.
 
+        If ``moving`` is not ``None`` and the object is still present in the
+        objectmap (because it was removed from its old folder with a true
+        ``relocating`` flag), its objectmap entries are relocated to the new
+        path rather than being re-added.
+
         This method returns the name used to place the subobject in the
         folder (a derivation of ``name``, usually the result of
         ``self.check_name(name)``).
@@ -456,17 +461,25 @@ class Folder(Persistent):
 
             if objectmap is not None:
 
-                basepath = resource_path_tuple(self)
-
-                for node in postorder(other):
-                    node_path = node_path_tuple(node)
-                    path_tuple = basepath + (name,) + node_path[1:]
-                    # the below gives node an objectid; if the will-be-added
-                    # event is the result of a duplication, replace the oid of
-                    # the node with a new one
-                    objectmap.add(
-                        node,
-                        path_tuple,
+                basepath = get_path_tuple(self, objectmap)
+
+                oid = get_oid(other, None)
+
+                if (
+                    moving is not None and
+                    oid is not None and
+                    objectmap.path_for(oid) is not None
+                    ):
+                    # the object was removed from its old folder by ``move``
+                    # without being removed from the objectmap
+                    objectmap.relocate(oid, basepath + (name,))
+                else:
+                    # the below gives each node an objectid; if the
+                    # will-be-added event is the result of a duplication,
+                    # replace the oid of each node with a new one
+                    objectmap.add_subtree(
+                        other,
+                        basepath + (name,),
                         duplicating=duplicating is not None,
                         moving=moving is not None,
                         )
@@ -554,7 +567,7 @@ class Folder(Persistent):
         return self.remove(name)
 
     def remove(self, name, send_events=True, moving=None, loading=False,
-               registry=None):
+               registry=None, relocating=False):
         """ Same thing as ``__delitem__``.
 
         If ``send_events`` is false, suppress the sending of folder events.
@@ -565,6 +578,11 @@ class Folder(Persistent):
         result of this action.  If ``loading`` is ``True``, the ``loading``
         attribute of events sent as a result of calling this method will be
         ``True`` too.
+
+        If ``relocating`` is ``True``, ``moving`` must also be passed and the
+        folder it names must share this folder's objectmap.  The object and
+        its descendants are then left in the objectmap, to be relocated by
+        the ``add`` into ``moving`` which must follow.
         """
         other = wrap_if_broken(self.data[name])
         oid = get_oid(other, None)
@@ -612,7 +630,11 @@ class Folder(Persistent):
             removed_oids = set([oid])
 
             if objectmap is not None and oid is not None:
-                removed_oids = objectmap.remove(oid, moving=moving is not None)
+                if relocating:
+                    removed_oids = objectmap.pathlookup(oid)
+                else:
+                    removed_oids = objectmap.remove(
+                        oid, moving=moving is not None)
 
             if send_events:
                 event = ObjectRemoved(other, self, name, removed_oids,
@@ -651,15 +673,25 @@ class Folder(Persistent):
         This operation is done in terms of a remove and an add.  The Removed
         and WillBeRemoved events as well as the Added and WillBeAdded events
         sent will indicate that the object is moving.
+
+        If both folders share an objectmap, the object and its descendants
+        are relocated within the objectmap instead of being removed from it
+        and re-added: their oids, extents and references stay in place and
+        only their paths are rewritten.
         """
         if newname is None:
             newname = name
         if registry is None:
             registry = get_current_registry()
+        objectmap = find_objectmap(self)
+        relocating = (
+            objectmap is not None and find_objectmap(other) is objectmap
+            )
         ob = self.remove(
             name,
             moving=other,
-            registry=registry
+            registry=registry,
+            relocating=relocating,
             )
         other.add(
             newname,
@@ -886,12 +918,6 @@ class RandomAutoNamingFolder(Folder, _AutoNamingFolder):
             if not name in self:
                 return name
 
-def node_path_tuple(resource):
-    # cant use resource_path_tuple from pyramid, it wants everything to 
-    # have a __name__
-    return tuple(reversed([getattr(loc, '__name__', '') for 
-                           loc in lineage(resource)]))
-
 class CopyHook(object):
     def __init__(self, context):
         self.context = context
@@ -633,6 +633,24 @@ class TestFolder(unittest.TestCase):
         self.assertEqual(objectmap.removed, [1])
         self.assertTrue(objectmap.moving)
 
+    def test_remove_with_objectmap_relocating(self):
+        from substanced.interfaces import IObjectRemoved
+        events = []
+        def listener(event, obj, container):
+            events.append(event)
+        self._registerEventListener(listener, IObjectRemoved)
+        dummy = DummyModel()
+        dummy.__parent__ = None
+        dummy.__name__ = None
+        dummy.__oid__ = 1
+        folder = self._makeOne({'a': dummy})
+        objectmap = DummyObjectMap()
+        folder.__objectmap__ = objectmap
+        folder.remove("a", moving=True, relocating=True)
+        self.assertEqual(objectmap.removed, [])
+        self.assertEqual(objectmap.looked_up, [1])
+        self.assertEqual(events[0].removed_oids, [1])
+
     def test_move_no_newname(self):
         folder = self._makeOne()
         other = self._makeOne()
@@ -656,6 +674,38 @@ class TestFolder(unittest.TestCase):
         self.assertFalse('a' in other)
         self.assertFalse('a' in folder)
 
+    def test_move_with_shared_objectmap(self):
+        from ...objectmap import ObjectMap
+        root = self._makeOne()
+        root.__objectmap__ = ObjectMap(root)
+        root['folder'] = self._makeOne()
+        root['other'] = self._makeOne()
+        folder = root['folder']
+        model = self._makeOne()
+        folder['a'] = model
+        child = model['child'] = testing.DummyResource()
+        objectmap = root.__objectmap__
+        oid = objectmap.objectid_for(model)
+        childoid = objectmap.objectid_for(child)
+        extents = objectmap.extentmap.extent_to_oids
+        extents_before = dict((k, list(v)) for k, v in extents.items())
+        folder.move('a', root['other'], 'b')
+        self.assertEqual(objectmap.objectid_for(('', 'other', 'b')), oid)
+        self.assertEqual(
+            objectmap.objectid_for(('', 'other', 'b', 'child')), childoid)
+        self.assertEqual(objectmap.objectid_for(('', 'folder', 'a')), None)
+        self.assertEqual(
+            dict((k, list(v)) for k, v in extents.items()), extents_before)
+
+    def test_add_moving_relocates(self):
+        folder = self._makeOne()
+        folder.__objectmap__ = objectmap = DummyObjectMap()
+        objectmap.paths[1] = ('', 'old')
+        model = DummyModel()
+        folder.add('a', model, moving=self._makeOne())
+        self.assertEqual(objectmap.relocated, [(1, ('', 'a'))])
+        self.assertEqual(objectmap.added, [])
+
     def test_move_is_service(self):
         from ...interfaces import IService
         folder = self._makeOne()
@@ -1232,8 +1282,21 @@ class DummyObjectMap(object):
     def __init__(self):
         self.added = []
         self.removed = []
+        self.looked_up = []
+        self.relocated = []
+        self.paths = {}
         self.moving = False
 
+    def path_for(self, objectid):
+        return self.paths.get(objectid)
+
+    def pathlookup(self, objectid):
+        self.looked_up.append(objectid)
+        return [objectid]
+
+    def relocate(self, objectid, path_tuple):
+        self.relocated.append((objectid, path_tuple))
+
     def add(self, obj, path, duplicating=False, moving=False):
         self.added.append((obj, path))
         objectid = getattr(obj, '__oid__', None)
@@ -1242,6 +1305,18 @@ class DummyObjectMap(object):
             obj.__oid__ = objectid
         return objectid
 
+    def add_subtree(self, obj, path, duplicating=False, moving=False):
+        from ...util import is_folder
+        def visit(node, node_path):
+            if is_folder(node):
+                for name, child in sorted(node.items()):
+                    for result in visit(child, node_path + (name,)):
+                        yield result
+            yield node, node_path
+        for node, node_path in visit(obj, path):
+            objectid = self.add(node, node_path, duplicating, moving)
+        return objectid
+
     def remove(self, objectid, moving=False):
         self.moving = moving
         self.removed.append(objectid)
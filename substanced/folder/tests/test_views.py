@@ -2354,6 +2354,8 @@ class DummyObjectMap(object):
         self.result = result
     def object_for(self, oid):
         return self.result
+    def object_for_many(self, oids):
+        return [ self.object_for(oid) for oid in oids ]
 
 class DummyVenusianInfo(object):
     scope = 'notaclass'
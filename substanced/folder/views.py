@@ -603,8 +603,9 @@ class FolderContents(object):
 
         records = []
 
-        for oid in itertools.islice(resultset.ids, start, end):
-            resource = objectmap.object_for(oid)
+        oids = list(itertools.islice(resultset.ids, start, end))
+
+        for resource in objectmap.object_for_many(oids):
             name = getattr(resource, '__name__', '')
             record = dict(
                 # Use the unique name as an id.  (A unique row id is needed
@@ -56,7 +56,7 @@ class ICatalog(Interface):
         :attr:`~substanced.interfaces.MODE_ATCOMMIT` or
         :attr:`~substanced.interfaces.MODE_DEFERRED`."""
 
-    def reindex_resource(resource, oid=None, action_mode=None):
+    def reindex_resource(resource, oid=None, action_mode=None, indexes=None):
         """Register the resource in indexes of this catalog using objectid
         ``oid``.  If ``oid`` is not supplied, the ``__oid__`` of the
         ``resource`` will be used.  ``action_mode``, if supplied, should be one
@@ -65,6 +65,9 @@ class ICatalog(Interface):
         :attr:`~substanced.interfaces.MODE_DEFERRED` indicating when the
         updates should take effect.  The ``action_mode`` value will overrule
         any action mode that a member index has been configured with.
+        ``indexes``, if not ``None``, should be a sequence of the names of the
+        indexes the resource is reindexed in; by default it is reindexed in
+        all of them.
 
         The result of calling this method is logically the same as calling
         ``unindex_resource``, then ``index_resource`` for the same resource/oid
@@ -254,6 +257,9 @@ class IObjectRemoved(IObjectEvent):
 class IObjectModified(IObjectEvent):
     """ May be sent when an object is modified """
     object = Attribute('The object being modified')
+    changed = Attribute('A frozenset of the names of the attributes of the '
+                        'object which were changed, or ``None`` if they are '
+                        'unknown')
 
 class IACLModified(IObjectEvent):
     """ May be sent when an object's ACL is modified """
@@ -690,12 +696,59 @@ class IObjectMap(Interface):
         the object id.
         """
 
+    def object_for_many(objectids_or_path_tuples):
+        """ Returns an iterator of objects (or ``None`` for each value that
+        cannot be resolved) given an iterable of object ids or path tuples,
+        in the same order."""
+
+    def add_subtree(obj, path_tuple, duplicating=False, moving=False):
+        """ Add ``obj`` and all of its descendants to the object map in one
+        pass, as if ``add`` were called for each of them, deepest first.
+        ``path_tuple`` is the path of ``obj``.  Returns the object id of
+        ``obj``."""
+
     def remove(obj_objectid_or_path_tuple):
         """ Removes an object from the object map using the object itself, an
         object id, or a path tuple.  Returns a set of objectids (children,
         inclusive) removed as the result of removing this object from the
         object map."""
 
+    def add_shard(obj, shard=None):
+        """ Make the folder ``obj`` the root of a shard, a separate object map
+        holding ``obj`` and its descendants, which becomes the
+        ``__objectmap__`` of ``obj``.  Lookups made through any object map of
+        the site are routed to the object map which holds the object.
+        Returns the shard."""
+
+    def docid_for(objectid):
+        """ Returns the dense docid of the object with the object id
+        ``objectid`` or ``None`` if the object map keeps no docids or the
+        object has none."""
+
+    def objectid_for_docid(docid):
+        """ Returns the object id of the object whose dense docid is
+        ``docid`` or ``None``."""
+
+    def docids_for(objectids):
+        """ Returns a ``BTrees.family32.IF`` set of the dense docids of the
+        objects with the object ids in ``objectids``."""
+
+    def objectids_for_docids(docids):
+        """ Returns an ``IF`` set of the object ids of the objects whose dense
+        docids are in ``docids``."""
+
+    def verify(output=None):
+        """ Checks that the path maps, the pathindex, the pathcounts and the
+        extent map of the object map agree with each other, reporting each
+        inconsistency to ``output``.  Returns the number of
+        inconsistencies."""
+
+    def rebuild(commit_interval=3000, dry_run=False, output=None):
+        """ Rebuilds the pathindex and pathcounts from ``path_to_objectid``
+        and the extent map from a walk of the resource tree, committing every
+        ``commit_interval`` objects.  Returns the number of objects which
+        could not be rebuilt."""
+
     def pathlookup(obj_or_path_tuple, depth=None, include_origin=True):
         """ Returns an iterator of document ids within
         obj_or_path_tuple (a traversable object or a path tuple).  If depth
@@ -704,6 +757,18 @@ class IObjectMap(Interface):
         passed as ``obj_or_path_tuple`` in the returned set, otherwise it
         omits it."""
 
+    def navchildren(obj_or_path_tuple, limit=None, after=None, ordered=False,
+                    counts=True, expand=()):
+        """ Returns a generator of dictionaries describing the children of
+        ``obj_or_path_tuple`` (a traversable object or a path tuple), each
+        with the keys ``path``, ``name``, ``oid``, ``count`` and
+        ``children``.  At most ``limit`` children are produced, starting
+        after the child named ``after``.  If ``ordered`` is true, ordered
+        folders produce their children in folder order.  ``count`` is the
+        number of children of each child (or ``None`` if ``counts`` is
+        false).  ``children`` is a similar generator for the children whose
+        paths are in ``expand``, ``None`` otherwise."""
+
     def connect(src, target, reftype):
         """Connect ``src_object`` to ``target_object`` using the reference
         type ``reftype``.  ``src`` and ``target`` may be objects or object
@@ -714,6 +779,18 @@ class IObjectMap(Interface):
         reference type ``reftype``. ``src`` and ``target`` may be objects or
         object identifiers"""
 
+    def connect_many(pairs, reftype, ignore_missing=False):
+        """ Connect each ``(source, target)`` pair of objects or objectids in
+        ``pairs`` using reference type ``reftype``.  If an object is missing
+        from the object map, raise a :exc:`ValueError` without connecting
+        anything unless ``ignore_missing`` is true, in which case pairs
+        involving missing objects are skipped."""
+
+    def disconnect_many(pairs, reftype, ignore_missing=False):
+        """ Disconnect each ``(source, target)`` pair of objects or objectids
+        in ``pairs`` using reference type ``reftype``.  ``ignore_missing``
+        has the same meaning as for ``connect_many``."""
+
     def sources(obj, reftype):
         """ Return a generator consisting of objects which have ``obj`` as a
         relationship source using ``reftype``.  ``obj`` can be an object or
@@ -732,6 +809,18 @@ class IObjectMap(Interface):
         """ Return a set of objectids which have ``obj`` as a relationship
         source using ``reftype``.  ``obj`` can be an object or an object id."""
 
+    def traverse(objs, reftypes, direction='targets', depth=None):
+        """ Walk the reference graph breadth-first from the objects or
+        objectids in ``objs`` following references of one or more reference
+        types in ``direction`` (``targets``, ``sources`` or ``both``).
+        Return a generator of sets of objectids, one per hop, each holding
+        the objectids first reached by that hop."""
+
+    def closure(objs, reftypes, direction='targets', depth=None,
+                include_origin=False):
+        """ Return a set of all the objectids reachable from the objects or
+        objectids in ``objs``, as described by ``traverse``."""
+
 #
 # subtanced.prinicpal APIs
 #
@@ -817,7 +906,9 @@ class IPropertySheet(Interface):
         ``changed`` into the ``after_set`` method.  It should be ``False`` if
         your ``set`` implementation *did not* change any persistent data.  Any
         other return value will be conventionally interpreted as the
-        implementation having changed persistent data.
+        implementation having changed persistent data.  The default
+        implementation returns a frozenset of the names of the attributes it
+        changed.
         """
 
     def after_set(changed):
@@ -825,7 +916,8 @@ class IPropertySheet(Interface):
         value returned from the ``set`` method.
 
         The default propertysheet implementation sends an ObjectModified event
-        if the ``changed`` value is not ``False.``
+        if the ``changed`` value is not ``False.``  If ``changed`` is a set of
+        attribute names, the event carries it as its ``changed`` attribute.
         """
 
 #
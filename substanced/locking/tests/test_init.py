@@ -778,7 +778,7 @@ class DummyObjectMap(object):
         return self.result
     def targets(self, resource, type):
         return self.result
-    def add(self, *arg, **kw):
+    def add_subtree(self, *arg, **kw):
         self.added = True
 
 class DummyContentRegistry(object):
@@ -1,14 +1,24 @@
+import heapq
+import itertools
+from logging import getLogger
 import random
+import sys
 
 from persistent.list import PersistentList
 import BTrees
+from BTrees.Length import Length
 import colander
 from persistent import Persistent
+from pyramid.interfaces import IResourceURL
 from pyramid.security import Allow
+from pyramid.threadlocal import get_current_request
 from pyramid.traversal import (
     resource_path_tuple,
     find_resource,
+    quote_path_segment,
+    VH_ROOT_KEY,
     )
+import transaction
 from zope.interface import implementer
 from zope.interface.interfaces import IInterface
 
@@ -21,6 +31,7 @@ from ..util import (
     set_oid,
     find_objectmap,
     wrap_if_broken,
+    is_folder,
     is_nonstr_iter,
     )
 
@@ -81,9 +92,151 @@ references to the objectid represented by '/a' *and* any children
 {('',):      {1: set([3])},
  ('', 'z'):  {0: set([3])}}
 
+Alongside the pathindex, ``pathcounts`` maps each path to a
+``BTrees.Length.Length`` per level, counting the oids in the level set, and
+one more (keyed by ``-1``) counting the whole subtree.  ``pathcount`` reads
+these rather than counting the members of level sets, and being Length
+objects, concurrent changes to them don't conflict.
+
+Range-scan mode
+---------------
+
+An object map created with ``pathindex=False`` (or one that has had the
+``rangescan_objectmap_pathindex`` evolve step run against it) keeps no
+pathindex at all.  Its ``pathindex`` attribute is ``None`` and path queries
+are answered using the sorted order of ``path_to_objectid`` instead.  Path
+tuples sort lexicographically, so every path under ``('', 'a')`` lives in the
+contiguous key range starting at ``('', 'a')`` and ending just before
+``('', 'a\\x00')``:
+
+('',)                 1
+('', 'a')             2
+('', 'a', 'b')        4      <- subtree of ('', 'a')
+('', 'a', 'b', 'c')   5      <-
+('', 'z')             3
+
+Adding or removing an object in this mode touches only the buckets of
+``path_to_objectid`` and ``objectid_to_path`` which hold the object's own
+path, rather than a level set for each of its ancestors.  Depth-limited
+queries skip over any subtree deeper than the requested depth, so looking up
+the children of a folder costs one tree probe per child rather than a scan of
+every descendant.
+
+Compact path keys
+-----------------
+
+An object map created with ``compact_paths=True`` (or one that has had the
+``compact_objectmap_paths`` evolve step run against it) stores the keys of
+``path_to_objectid`` and the values of ``objectid_to_path`` as a single
+bytestring per path rather than as a tuple of strings.  Each path segment is
+encoded as UTF-8 and terminated by a NUL byte:
+
+('',)                 b'\x00'
+('', 'a')             b'\x00a\x00'
+('', 'a', 'b')        b'\x00a\x00b\x00'
+('', 'a!')            b'\x00a!\x00'
+
+UTF-8 preserves the code point order of strings and NUL sorts before every
+other byte, so encoded paths sort exactly like the tuples they encode, and
+range scans work unchanged.  Bytestring keys pickle to a fraction of the size
+of tuples and compare with a single ``memcmp``.  Path segments decoded from
+the map are interned, so the tuples returned by ``path_for`` and friends
+share their segment strings.  ``pathindex`` and ``path_to_acl`` are still
+keyed by path tuples.
+
+Shards
+------
+
+``add_shard`` makes a folder the root of a shard: an object map of its own,
+which may live in another database, holding the folder and everything
+beneath it.  The shard is the folder's ``__objectmap__``, so
+``find_objectmap`` (which acquires that attribute) returns it for any object
+in the subtree, and adding or removing objects there writes only to the
+shard.  The object map of the site keeps the root folder of each shard, and
+``shards`` maps its path to the shard:
+
+('',)                 site
+('', 't1')            site, shard 1
+('', 't1', 'a')       shard 1
+('', 't2')            site
+
+Every object map of the site routes what it can't answer itself: a path is
+held by the shard whose root is the path or one of its ancestors, and
+queries for paths above the roots of shards (``pathlookup``, ``pathcount``,
+``pathscan``, ``get_extent``) merge in the results of those shards.  An
+oid allocated by a shard carries the shard's number in its low
+``_SHARD_BITS`` bits, so finding the map which holds an oid takes one
+probe; oids which came to a shard some other way (e.g. an object moved from
+another shard) are recorded in ``shard_oids``.  Allocating an oid checks
+every map which might hold it, so oids stay unique across the site.  Shards
+share the reference map of the site, so references may cross shards.
+
+Dense docids
+------------
+
+Oids are random 64-bit integers, so sets of them are sparse.  An object map
+created with ``docids=True`` (or one that has had the
+``add_docids_to_objectmap`` evolve step run against it) also gives each
+object a docid: a small integer handed out in order by a
+``DocidAllocator``, so the docids of a site form a nearly contiguous range
+starting at 1 and fit in 32 bits.  ``oid_to_docid`` and ``docid_to_oid``
+map between the two; an object keeps its docid when it is moved or
+relocated, and a removed object's docid is not reused.  ``docids_for`` and
+``objectids_for_docids`` convert whole sets, so structures which want
+compact keys (e.g. ``family32`` sets or bitmaps) can be keyed by docid
+while the public API deals in oids.  Shards share the docids of their site.
 """
 
+logger = getLogger(__name__)
+
 _marker = object()
+_NUL = '\x00'
+_BLANK = ''
+_SLASH = '/'
+_ALL_LEVELS = -1 # pathcounts key of the count of a whole subtree
+# the low bits of each oid allocated by a shard hold the shard's number
+_SHARD_BITS = 16
+_SHARD_MASK = (1 << _SHARD_BITS) - 1
+
+def _collect_levels(levels, path_tuple, objectid):
+    # note ``objectid`` in the level sets of ``path_tuple`` and its ancestors
+    pathlen = len(path_tuple)
+    for x in range(pathlen):
+        els = path_tuple[:x+1]
+        level = pathlen - x - 1
+        levels.setdefault(els, {}).setdefault(level, []).append(objectid)
+
+def _subtree_max(path_tuple):
+    # The smallest path tuple that sorts after every path tuple which has
+    # ``path_tuple`` as a prefix.  No string sorts between ``name`` and
+    # ``name + '\x00'``, so this is an exclusive upper bound for a range
+    # scan of the subtree rooted at ``path_tuple``.
+    return path_tuple[:-1] + (path_tuple[-1] + _NUL,)
+
+_SEP = b'\x00'
+
+def encode_path(path_tuple):
+    """ Encode a path tuple as a bytestring which sorts like the tuple (see
+    the "Compact path keys" notes at the top of this module).  Raise a
+    :exc:`ValueError` if a path segment contains a NUL character."""
+    segments = []
+    for segment in path_tuple:
+        if _NUL in segment:
+            raise ValueError(
+                'path segment %r contains a NUL character' % (segment,))
+        segments.append(segment.encode('utf-8'))
+        segments.append(_SEP)
+    return b''.join(segments)
+
+def decode_path(key):
+    """ Return the path tuple encoded in ``key`` by :func:`encode_path`. """
+    segments = key.decode('utf-8').split(_NUL)
+    return tuple([ sys.intern(segment) for segment in segments[:-1] ])
+
+def _key_subtree_max(key):
+    # the encoded analogue of _subtree_max: every key of the subtree rooted
+    # at ``key`` starts with ``key``, which ends with a separator
+    return key[:-1] + b'\x01'
 
 @implementer(IObjectMap)
 class ObjectMap(Persistent):
@@ -91,26 +244,79 @@ class ObjectMap(Persistent):
     _v_nextid = None
     _randrange = random.randrange
     path_to_acl = None # b/c
+    compact_paths = False # b/c
+    objectid_to_object = None # b/c
+    # path tuple -> IO BTree mapping each pathindex level (and _ALL_LEVELS)
+    # to a Length counting the oids in the level set
+    pathcounts = None # b/c
+    # path tuple -> shard objectmap (see the "Shards" notes)
+    shards = None # b/c
+    # shard number -> shard objectmap
+    shard_ids = None # b/c
+    # oid -> shard number, for each oid held by a shard other than the one
+    # whose number is in its low bits
+    shard_oids = None # b/c
+    # oid <-> dense docid mappings (see the "Dense docids" notes)
+    docid_allocator = None # b/c
+    oid_to_docid = None # b/c
+    docid_to_oid = None # b/c
+    # set on a shard: its site objectmap, the path of its root and its number
+    parent_map = None
+    shard_path = None
+    shard_id = 0
+    # (pathindex, pathcounts, extentmap) being built by ``rebuild``
+    _rebuilt = None
 
     family = BTrees.family64
-
-    def __init__(self, root, family=None):
+    transaction = transaction # for testing
+
+    def __init__(self, root, family=None, pathindex=True,
+                 compact_paths=False, objectrefs=False, docids=False):
+        """ If ``pathindex`` is ``False``, no pathindex will be maintained;
+        path lookups will instead be answered by range scans over
+        ``path_to_objectid`` (see the "Range-scan mode" notes at the top of
+        this module).  If ``compact_paths`` is ``True``, paths are stored
+        in ``path_to_objectid`` and ``objectid_to_path`` as bytestrings (see
+        the "Compact path keys" notes).  If ``objectrefs`` is ``True``, a
+        reference to each persistent object added is kept in
+        ``objectid_to_object``, which ``object_for`` uses instead of
+        traversal.  If ``docids`` is ``True``, each object added is also
+        given a dense docid (see the "Dense docids" notes)."""
         if family is not None:
             self.family = family
+        if compact_paths:
+            self.compact_paths = True
         self.objectid_to_path = self.family.OO.BTree()
         self.path_to_objectid = self.family.OO.BTree()
         self.path_to_acl = self.family.OO.BTree()
-        self.pathindex = self.family.OO.BTree()
+        if pathindex:
+            self.pathindex = self.family.OO.BTree()
+            self.pathcounts = self.family.OO.BTree()
+        else:
+            self.pathindex = None
+        if objectrefs:
+            self.objectid_to_object = self.family.IO.BTree()
+        if docids:
+            self.docid_allocator = DocidAllocator()
+            self.oid_to_docid = self.family.II.BTree()
+            self.docid_to_oid = self.family.II.BTree()
         self.referencemap = ReferenceMap()
         self.extentmap = ExtentMap()
         self.root = root
 
     def new_objectid(self):
         """ Obtain an unused integer object identifier """
+        step = 1
+        if self.parent_map is not None:
+            # a shard's oids carry its number in their low bits
+            step = _SHARD_MASK + 1
         while True:
             if self._v_nextid is None:
-                self._v_nextid = self._randrange(self.family.minint,
-                                                 self.family.maxint)
+                nextid = self._randrange(self.family.minint,
+                                         self.family.maxint)
+                if self.parent_map is not None:
+                    nextid = (nextid & ~_SHARD_MASK) | self.shard_id
+                self._v_nextid = nextid
 
             objectid = self._v_nextid
 
@@ -118,20 +324,37 @@ class ObjectMap(Persistent):
                 self._v_nextid = None
                 continue
 
-            self._v_nextid += 1
+            self._v_nextid += step
 
             # object id zero is reserved as "irresolveable"
-            if objectid != 0 and not objectid in self.objectid_to_path:
+            if objectid != 0 and self._map_for_oid(objectid) is None:
                 return objectid
 
             self._v_nextid = None
 
+    def _path_key(self, path_tuple):
+        # the key under which ``path_tuple`` is stored in path_to_objectid
+        if self.compact_paths:
+            return encode_path(path_tuple)
+        return path_tuple
+
+    def _key_path(self, key):
+        # the inverse of _path_key
+        if self.compact_paths and key is not None:
+            return decode_path(key)
+        return key
+
+    def _subtree_max_key(self, path_tuple):
+        if self.compact_paths:
+            return _key_subtree_max(encode_path(path_tuple))
+        return _subtree_max(path_tuple)
+
     def _get_path_tuple(self, obj_objectid_or_path_tuple):
         path_tuple = None
         if hasattr(obj_objectid_or_path_tuple, '__parent__'):
             path_tuple = resource_path_tuple(obj_objectid_or_path_tuple)
         elif isinstance(obj_objectid_or_path_tuple, int):
-            path_tuple = self.objectid_to_path.get(obj_objectid_or_path_tuple)
+            path_tuple = self.path_for(obj_objectid_or_path_tuple)
         elif isinstance(obj_objectid_or_path_tuple, tuple):
             path_tuple = obj_objectid_or_path_tuple
         return path_tuple
@@ -143,14 +366,36 @@ class ObjectMap(Persistent):
             raise ValueError(
                 'objectid_for accepts a traversable object or a path tuple, '
                 'got %s' % (obj_or_path_tuple,))
-        return self.path_to_objectid.get(path_tuple)
+        if self._in_family():
+            omap = self._map_for_path(path_tuple)
+            if omap is not self:
+                return omap.objectid_for(path_tuple)
+        return self.path_to_objectid.get(self._path_key(path_tuple))
 
     def path_for(self, objectid):
         """ Returns an path or ``None`` given an object id """
-        return self.objectid_to_path.get(objectid)
+        path_key = self.objectid_to_path.get(objectid)
+        if path_key is None and self._in_family():
+            omap = self._map_for_oid(objectid)
+            if omap is not None:
+                return omap.path_for(objectid)
+        return self._key_path(path_key)
 
     def object_for(self, objectid_or_path_tuple, context=None):
-        """ Returns an object or ``None`` given an object id or a path tuple"""
+        """ Returns an object or ``None`` given an object id or a path tuple.
+
+        If the object map keeps object references, the object is fetched
+        from ``objectid_to_object`` directly; objects which have no
+        reference there (e.g. because they were added before references were
+        kept or because they aren't persistent) are found by traversal."""
+        if self._in_family():
+            omap = self._owner(objectid_or_path_tuple)
+            if omap is not self:
+                return omap.object_for(objectid_or_path_tuple, context)
+        if self.objectid_to_object is not None:
+            obj = self._referenced_object(objectid_or_path_tuple)
+            if obj is not None:
+                return obj
         path_tuple = self._get_path_tuple(objectid_or_path_tuple)
         if path_tuple is None:
             return None
@@ -159,12 +404,296 @@ class ObjectMap(Persistent):
         except KeyError:
             return None
 
+    def object_for_many(self, objectids_or_path_tuples, batch_size=100):
+        """ Returns an iterator of objects (or ``None`` for each value that
+        cannot be resolved) given an iterable of object ids or path tuples,
+        in the same order.
+
+        The iterable is consumed ``batch_size`` values at a time.  If the
+        object map keeps object references, the objects of each batch which
+        are not yet loaded are prefetched from the database in one request
+        (via ``Connection.prefetch``) before any of them is returned."""
+        values = iter(objectids_or_path_tuples)
+        while True:
+            batch = list(itertools.islice(values, batch_size))
+            if not batch:
+                return
+            self._prefetch(batch)
+            for value in batch:
+                yield self.object_for(value)
+
+    def _prefetch(self, objectids_or_path_tuples):
+        if self.objectid_to_object is None:
+            return
+        ghosts = {}
+        for objectid in objectids_or_path_tuples:
+            if isinstance(objectid, tuple):
+                objectid = self.path_to_objectid.get(self._path_key(objectid))
+            elif not isinstance(objectid, int):
+                continue
+            obj = self.objectid_to_object.get(objectid)
+            # _p_changed is None only for ghosts
+            if obj is None or getattr(obj, '_p_changed', False) is not None:
+                continue
+            jar = obj._p_jar
+            ghosts.setdefault(id(jar), (jar, []))[1].append(obj)
+        for jar, objs in ghosts.values():
+            prefetch = getattr(jar, 'prefetch', None)
+            if prefetch is not None:
+                prefetch(objs)
+
+    def _referenced_object(self, objectid_or_path_tuple):
+        objectid = objectid_or_path_tuple
+        if isinstance(objectid, tuple):
+            objectid = self.path_to_objectid.get(self._path_key(objectid))
+        elif not isinstance(objectid, int):
+            return None
+        obj = self.objectid_to_object.get(objectid)
+        if obj is None:
+            return None
+        obj = wrap_if_broken(obj)
+        # guard against a stale reference
+        if get_oid(obj, None) != objectid:
+            return None
+        return obj
+
+    def _add_reference(self, objectid, obj):
+        if self.objectid_to_object is not None:
+            if isinstance(obj, Persistent):
+                self.objectid_to_object[objectid] = obj
+
+    def _remove_reference(self, objectid):
+        if self.objectid_to_object is not None:
+            self.objectid_to_object.pop(objectid, None)
+
+    def _add_docids(self, objectids):
+        if self.docid_allocator is None:
+            return
+        for objectid in objectids:
+            if objectid in self.oid_to_docid: # e.g. a moved object
+                continue
+            docid = self.docid_allocator.allocate()
+            while docid in self.docid_to_oid:
+                docid = self.docid_allocator.allocate()
+            self.oid_to_docid[objectid] = docid
+            self.docid_to_oid[docid] = objectid
+
+    def _remove_docids(self, objectids):
+        if self.docid_allocator is None:
+            return
+        for objectid in objectids:
+            docid = self.oid_to_docid.pop(objectid, None)
+            if docid is not None:
+                self.docid_to_oid.pop(docid, None)
+
+    def docid_for(self, objectid):
+        """ Return the dense docid of the object whose object id is
+        ``objectid``, or ``None`` if it has none (e.g. because the object map
+        doesn't keep docids)."""
+        if self.oid_to_docid is None:
+            return None
+        return self.oid_to_docid.get(objectid)
+
+    def objectid_for_docid(self, docid):
+        """ Return the object id of the object whose dense docid is ``docid``
+        or ``None``."""
+        if self.docid_to_oid is None:
+            return None
+        return self.docid_to_oid.get(docid)
+
+    def docids_for(self, objectids):
+        """ Return a ``BTrees.family32.IF`` set of the dense docids of the
+        object ids in ``objectids``.  Object ids without a docid are left
+        out."""
+        result = BTrees.family32.IF.Set()
+        if self.oid_to_docid is not None:
+            get = self.oid_to_docid.get
+            for objectid in objectids:
+                docid = get(objectid)
+                if docid is not None:
+                    result.insert(docid)
+        return result
+
+    def objectids_for_docids(self, docids):
+        """ Return an ``IF`` set of the object ids of the objects whose dense
+        docids are in ``docids``.  Unknown docids are left out."""
+        result = self.family.IF.Set()
+        if self.docid_to_oid is not None:
+            get = self.docid_to_oid.get
+            for docid in docids:
+                objectid = get(docid)
+                if objectid is not None:
+                    result.insert(objectid)
+        return result
+
     def _find_resource(self, context, path_tuple): # replaced in tests
         if context is None:
             context = self.root
         resource = find_resource(context, path_tuple)
         return wrap_if_broken(resource)
 
+    def add_shard(self, obj, shard=None):
+        """ Make the folder ``obj`` (which must be in this object map) the
+        root of a shard: a separate object map which holds ``obj`` and every
+        object beneath it.  ``shard`` may be an empty object map, e.g. one
+        already stored in another database; if it is ``None``, a new one
+        like this one is created.  The objects under ``obj`` are moved from
+        this object map to the shard, and the shard is set as the
+        ``__objectmap__`` attribute of ``obj``, so ``find_objectmap`` finds
+        it for any object in the subtree.
+
+        Only the object map of a site may have shards, and shards may not
+        contain other shards.  Return the shard."""
+        if self.parent_map is not None:
+            raise ValueError('shards may not contain other shards')
+        path_tuple = resource_path_tuple(obj)
+        if len(path_tuple) < 2:
+            raise ValueError('the root cannot be the root of a shard')
+        if not self._path_key(path_tuple) in self.path_to_objectid:
+            raise ValueError('path %s is not in objectmap' % (path_tuple,))
+        if (
+            self._map_for_path(path_tuple) is not self or
+            self._shards_under(path_tuple)
+            ):
+            raise ValueError('shards may not contain other shards')
+        if shard is None:
+            shard = self._make_shard()
+        elif shard.objectid_to_path:
+            raise ValueError('shard is not empty')
+        removed = []
+        for child_path, oid in list(self._pathscan(path_tuple, 1, False)):
+            removed.extend(self._remove(child_path, True))
+        self.extentmap.remove(removed)
+        self._attach_shard(path_tuple, shard)
+        shard.add_subtree(obj, path_tuple, moving=True)
+        obj.__objectmap__ = shard
+        return shard
+
+    def _make_shard(self):
+        return ObjectMap(
+            self.root,
+            family=self.family,
+            pathindex=self.pathindex is not None,
+            compact_paths=self.compact_paths,
+            objectrefs=self.objectid_to_object is not None,
+            )
+
+    def _attach_shard(self, path_tuple, shard):
+        if self.shards is None:
+            self.shards = self.family.OO.BTree()
+            self.shard_ids = self.family.IO.BTree()
+            self.shard_oids = self.family.II.BTree()
+        shard_id = shard.shard_id
+        if not shard_id or self.shard_ids.get(shard_id, shard) is not shard:
+            shard_id = 1
+            if self.shard_ids:
+                shard_id = self.shard_ids.maxKey() + 1
+            if shard_id > _SHARD_MASK:
+                raise ValueError('too many shards')
+        self.shards[path_tuple] = shard
+        self.shard_ids[shard_id] = shard
+        shard.parent_map = self
+        shard.shard_path = path_tuple
+        shard.shard_id = shard_id
+        shard.referencemap = self.referencemap
+        if self.docid_allocator is not None:
+            shard.docid_allocator = self.docid_allocator
+            shard.oid_to_docid = self.oid_to_docid
+            shard.docid_to_oid = self.docid_to_oid
+        shard._v_nextid = None
+
+    def _detach_shard(self, path_tuple):
+        shard = self.shards.pop(path_tuple)
+        if self.shard_ids.get(shard.shard_id) is shard:
+            del self.shard_ids[shard.shard_id]
+
+    def _foreign_shard(self, node):
+        # the shard whose root is ``node`` if it is not this object map
+        shard = getattr(node, '__objectmap__', None)
+        if (
+            isinstance(shard, ObjectMap) and
+            shard.shard_path is not None and
+            shard is not self
+            ):
+            return shard
+
+    def _in_family(self):
+        # true if this object map is a shard or has shards
+        return self.parent_map is not None or bool(self.shards)
+
+    def _top_map(self):
+        if self.parent_map is None:
+            return self
+        return self.parent_map
+
+    def _map_for_path(self, path_tuple):
+        # the object map of the family which holds ``path_tuple``; the root
+        # of a shard is held by the shard as well as by its site object map
+        top = self._top_map()
+        shards = top.shards
+        if shards:
+            for idx in range(len(path_tuple), 1, -1):
+                shard = shards.get(path_tuple[:idx])
+                if shard is not None:
+                    return shard
+        return top
+
+    def _map_for_oid(self, objectid):
+        # the object map of the family which holds ``objectid`` or ``None``
+        if objectid in self.objectid_to_path:
+            return self
+        top = self._top_map()
+        if not top.shard_ids:
+            return None
+        if top is not self and objectid in top.objectid_to_path:
+            return top
+        shard_id = top.shard_oids.get(objectid)
+        if shard_id is None:
+            shard_id = objectid & _SHARD_MASK
+        shard = top.shard_ids.get(shard_id)
+        if shard is not None and objectid in shard.objectid_to_path:
+            return shard
+
+    def _owner(self, objectid_or_path_tuple):
+        if isinstance(objectid_or_path_tuple, tuple):
+            return self._map_for_path(objectid_or_path_tuple)
+        if isinstance(objectid_or_path_tuple, int):
+            omap = self._map_for_oid(objectid_or_path_tuple)
+            if omap is not None:
+                return omap
+        return self
+
+    def _shards_under(self, path_tuple, include_origin=False):
+        # (path, shard) pairs of the shards of this object map whose roots
+        # are beneath ``path_tuple``
+        if not self.shards:
+            return []
+        return [
+            (shard_path, shard) for shard_path, shard in self.shards.items(
+                min=path_tuple,
+                max=_subtree_max(path_tuple),
+                excludemax=True,
+                )
+            if include_origin or shard_path != path_tuple
+            ]
+
+    def _note_shard_oids(self, objectids):
+        # record the oids held by this shard which name another one
+        if self.parent_map is None:
+            return
+        shard_oids = self.parent_map.shard_oids
+        for objectid in objectids:
+            if objectid & _SHARD_MASK != self.shard_id:
+                shard_oids[objectid] = self.shard_id
+
+    def _forget_shard_oids(self, objectids):
+        if self.parent_map is None:
+            return
+        shard_oids = self.parent_map.shard_oids
+        for objectid in objectids:
+            if objectid & _SHARD_MASK != self.shard_id:
+                shard_oids.pop(objectid, None)
+
     def add(self, obj, path_tuple, duplicating=False, moving=False):
         """ Add a new object to the object map at the location specified by
         ``path_tuple`` (must be the path of the object in the object graph as
@@ -184,6 +713,11 @@ class ObjectMap(Persistent):
         if moving and duplicating:
             raise ValueError('Cannot be both moving and duplicating')
 
+        if self._in_family():
+            omap = self._map_for_path(path_tuple)
+            if omap is not self:
+                return omap.add(obj, path_tuple, duplicating, moving)
+
         objectid = get_oid(obj, _marker)
 
         if objectid is _marker or duplicating:
@@ -193,23 +727,32 @@ class ObjectMap(Persistent):
         elif objectid in self.objectid_to_path:
             raise ValueError('objectid %s already exists' % (objectid,))
 
-        if path_tuple in self.path_to_objectid:
+        path_key = self._path_key(path_tuple)
+
+        if path_key in self.path_to_objectid:
             raise ValueError('path %s already exists' % (path_tuple,))
 
-        if (not moving) or duplicating:
+        # an object moved between the object maps of a site with shards
+        # takes its extents along
+        if (not moving) or duplicating or self._in_family():
             self.extentmap.add(obj, objectid)
 
-        self.path_to_objectid[path_tuple] = objectid
-        self.objectid_to_path[objectid] = path_tuple
+        self.path_to_objectid[path_key] = objectid
+        self.objectid_to_path[objectid] = path_key
+        self._add_reference(objectid, obj)
+        self._note_shard_oids((objectid,))
+        self._add_docids((objectid,))
 
-        pathlen = len(path_tuple)
+        if self.pathindex is not None:
+            pathlen = len(path_tuple)
 
-        for x in range(pathlen):
-            els = path_tuple[:x+1]
-            omap = self.pathindex.setdefault(els, self.family.IO.BTree())
-            level = pathlen - len(els)
-            oidset = omap.setdefault(level, self.family.IF.TreeSet())
-            oidset.add(objectid)
+            for x in range(pathlen):
+                els = path_tuple[:x+1]
+                omap = self.pathindex.setdefault(els, self.family.IO.BTree())
+                level = pathlen - len(els)
+                oidset = omap.setdefault(level, self.family.IF.TreeSet())
+                oidset.add(objectid)
+                self._count(els, level, 1)
 
         acl = get_acl(obj, None)
 
@@ -218,6 +761,143 @@ class ObjectMap(Persistent):
 
         return objectid
 
+    def add_subtree(self, obj, path_tuple, duplicating=False, moving=False):
+        """ Add ``obj`` and every object beneath it to the object map in one
+        pass.  ``path_tuple`` is the path ``obj`` will have in the object
+        graph; the paths of its descendants are derived from it and from
+        the names under which they are stored in their folders.  Objects are
+        visited deepest first, like :func:`substanced.util.postorder` does.
+
+        ``duplicating`` and ``moving`` have the same meaning as for
+        :meth:`~substanced.objectmap.ObjectMap.add`, and the same errors are
+        raised; they are raised before anything is written to the object
+        map.
+
+        The result is identical to calling ``add`` once for each object, but
+        pathindex level sets and extents are each updated once for the whole
+        subtree rather than once for each object added.
+
+        A folder in the subtree which is the root of a shard of a site (e.g.
+        one moved along with the subtree) has its own subtree added to its
+        shard, which is attached to this object map; if this object map is
+        itself a shard, the folder's subtree is added to it instead and the
+        folder stops being the root of a shard.
+
+        Return the object id of ``obj``."""
+        if not isinstance(path_tuple, tuple):
+            raise ValueError('path_tuple argument must be a tuple')
+
+        if moving and duplicating:
+            raise ValueError('Cannot be both moving and duplicating')
+
+        if self._in_family():
+            omap = self._map_for_path(path_tuple)
+            if omap is not self:
+                return omap.add_subtree(obj, path_tuple, duplicating, moving)
+
+        attach = []
+        dissolve = []
+
+        def visit(node, node_path):
+            shard = self._foreign_shard(node)
+            if shard is not None:
+                if self.parent_map is None:
+                    # the shard holds the subtree; this map holds the node
+                    attach.append((node, node_path, shard))
+                    yield node, node_path
+                    return
+                dissolve.append(node)
+            if is_folder(node):
+                for name, child in sorted(node.items()):
+                    for result in visit(child, node_path + (name,)):
+                        yield result
+            yield node, node_path
+
+        entries = []
+        seen_oids = set()
+
+        for node, node_path in visit(obj, path_tuple):
+            objectid = get_oid(node, _marker)
+            if objectid is _marker or duplicating:
+                objectid = None
+            elif objectid in self.objectid_to_path or objectid in seen_oids:
+                raise ValueError('objectid %s already exists' % (objectid,))
+            else:
+                seen_oids.add(objectid)
+            path_key = self._path_key(node_path)
+            if path_key in self.path_to_objectid:
+                raise ValueError('path %s already exists' % (node_path,))
+            entries.append((node, node_path, path_key, objectid))
+
+        for node in dissolve:
+            del node.__objectmap__
+
+        shard_root_oids = {}
+
+        for node, node_path, shard in attach:
+            if self.shards and self.shards.get(shard.shard_path) is shard:
+                # e.g. a copy of the root of a shard which is still attached
+                shard = node.__objectmap__ = self._make_shard()
+            self._attach_shard(node_path, shard)
+            shard_root_oids[node_path] = shard.add_subtree(
+                node, node_path, duplicating=duplicating, moving=moving)
+
+        carry_extents = (not moving) or duplicating or self._in_family()
+        added = []
+        extents = {}
+        levels = {}
+        result = None
+
+        for node, node_path, path_key, objectid in entries:
+            if node_path in shard_root_oids:
+                objectid = shard_root_oids[node_path]
+            elif objectid is None:
+                objectid = self.new_objectid()
+                set_oid(node, objectid)
+
+            if carry_extents:
+                extents.setdefault(
+                    get_factory_type(node), []).append(objectid)
+
+            self.path_to_objectid[path_key] = objectid
+            self.objectid_to_path[objectid] = path_key
+            self._add_reference(objectid, node)
+            self._note_shard_oids((objectid,))
+            added.append(objectid)
+
+            if self.pathindex is not None:
+                _collect_levels(levels, node_path, objectid)
+
+            acl = get_acl(node, None)
+
+            if acl is not None:
+                self.set_acl(node_path, acl)
+
+            result = objectid
+
+        if extents:
+            self.extentmap.add_many(extents)
+
+        self._add_docids(added)
+        self._add_levels(levels)
+
+        return result
+
+    def _add_levels(self, levels, pathindex=None, pathcounts=_marker):
+        # ``levels`` maps paths to dictionaries mapping levels to oids to be
+        # added to the level sets of the pathindex, see _collect_levels; the
+        # pathindex and pathcounts of this object map are updated unless
+        # others are passed
+        if pathindex is None:
+            pathindex = self.pathindex
+        if pathcounts is _marker:
+            pathcounts = self.pathcounts
+        for els, oids_by_level in levels.items():
+            omap = pathindex.setdefault(els, self.family.IO.BTree())
+            for level, oids in oids_by_level.items():
+                oidset = omap.setdefault(level, self.family.IF.TreeSet())
+                self._count(els, level, oidset.update(oids), pathcounts)
+
     def remove(self, obj_objectid_or_path_tuple, moving=False):
         """ Remove an object from the object map give an object, an object id
         or a path tuple.  If ``moving`` is ``False``, also remove any
@@ -234,6 +914,28 @@ class ObjectMap(Persistent):
                 'object, an object id, or a path tuple, got %s' % (
                     (obj_objectid_or_path_tuple,)))
 
+        if not self._in_family():
+            return self._remove(path_tuple, moving)
+
+        omap = self._map_for_path(path_tuple)
+        if omap is not self and path_tuple != omap.shard_path:
+            return omap.remove(path_tuple, moving)
+
+        # removing the root of a shard removes the shard's objects and
+        # detaches it
+        shards = self._shards_under(path_tuple, True)
+        removed = self._remove(path_tuple, moving)
+        if shards:
+            removed = self.family.IF.Set(removed)
+            for shard_path, shard in shards:
+                removed.update(shard.remove(shard_path, moving))
+                self._detach_shard(shard_path)
+        return removed
+
+    def _remove(self, path_tuple, moving):
+        if self.pathindex is None:
+            return self._remove_range(path_tuple, moving)
+
         pathlen = len(path_tuple)
 
         omap = self.pathindex.get(path_tuple)
@@ -255,6 +957,7 @@ class ObjectMap(Persistent):
                             p = self.objectid_to_path[oid]
                             del self.objectid_to_path[oid]
                             del self.path_to_objectid[p]
+                            self._remove_reference(oid)
                 # dont mutate while iterating
                 removepaths.append(k)
             else:
@@ -262,9 +965,12 @@ class ObjectMap(Persistent):
 
         for k in removepaths:
             del self.pathindex[k]
+            if self.pathcounts is not None: # bw compat
+                self.pathcounts.pop(k, None)
             if self.path_to_acl is not None: # bw compat
                 if k in self.path_to_acl:
                     del self.path_to_acl[k]
+                    self._acls_changed()
 
         for x in range(pathlen-1):
 
@@ -275,10 +981,12 @@ class ObjectMap(Persistent):
 
                 i = level + offset
                 oidset2 = omap2[i]
+                count = 0
 
                 for oid in oidset:
                     if oid in oidset2:
                         oidset2.remove(oid)
+                        count += 1
                         # adding to removed and removing from
                         # objectid_to_path and path_to_objectid should have
                         # been taken care of above in the for k, dm in
@@ -286,16 +994,398 @@ class ObjectMap(Persistent):
                         assert oid in removed, oid
                         assert not oid in self.objectid_to_path, oid
 
+                self._count(els, i, -count)
+
                 if not oidset2:
                     del omap2[i]
 
         if not moving:
             self.referencemap.remove(removed)
             self.extentmap.remove(removed)
+            self._remove_docids(removed)
+        elif self._in_family():
+            self.extentmap.remove(removed)
+
+        self._forget_shard_oids(removed)
+
+        return removed
+
+    def relocate(self, obj_objectid_or_path_tuple, path_tuple):
+        """ Move the object implied by ``obj_objectid_or_path_tuple`` (an
+        object, an object id or a path tuple), and every object beneath it,
+        to the location specified by ``path_tuple`` without removing and
+        re-adding them.
+
+        Object ids, extents and references of the relocated objects are left
+        intact; only path-derived state (``path_to_objectid``,
+        ``objectid_to_path``, ``path_to_acl`` and the pathindex) is
+        rewritten.  Pathindex level sets of ancestors which are common to the
+        old and the new location at the same distance (e.g. every ancestor
+        during a rename) are not touched at all.
+
+        It is an error to relocate an object to a path that already exists in
+        the object map or to a location inside itself.
+
+        Return the set of relocated oids."""
+        if not isinstance(path_tuple, tuple):
+            raise ValueError('path_tuple argument must be a tuple')
+
+        old_path_tuple = self._get_path_tuple(obj_objectid_or_path_tuple)
+        if old_path_tuple is None:
+            raise ValueError(
+                'Value passed to relocate must be a traversable '
+                'object, an object id, or a path tuple, got %s' % (
+                    (obj_objectid_or_path_tuple,)))
+
+        if path_tuple == old_path_tuple:
+            return self.pathlookup(path_tuple)
+
+        if not self._in_family():
+            return self._relocate(old_path_tuple, path_tuple)
+
+        omap = self._map_for_path(old_path_tuple)
+        if omap is not self and old_path_tuple != omap.shard_path:
+            if self._map_for_path(path_tuple) is not omap:
+                raise ValueError(
+                    'cannot relocate %s to another objectmap' % (
+                        old_path_tuple,))
+            return omap.relocate(old_path_tuple, path_tuple)
+
+        if (
+            old_path_tuple != self.shard_path and
+            self._map_for_path(path_tuple) is not self
+            ):
+            raise ValueError(
+                'cannot relocate %s to another objectmap' % (old_path_tuple,))
+
+        # relocating the root of a shard relocates the shard's objects
+        shards = self._shards_under(old_path_tuple, True)
+        relocated = self._relocate(old_path_tuple, path_tuple)
+        oldlen = len(old_path_tuple)
+        for shard_path, shard in shards:
+            new_shard_path = path_tuple + shard_path[oldlen:]
+            relocated.update(shard.relocate(shard_path, new_shard_path))
+            del self.shards[shard_path]
+            self.shards[new_shard_path] = shard
+            shard.shard_path = new_shard_path
+        return relocated
+
+    def _relocate(self, old_path_tuple, path_tuple):
+        oldlen = len(old_path_tuple)
+
+        if path_tuple[:oldlen] == old_path_tuple:
+            raise ValueError(
+                'cannot relocate %s inside itself' % (old_path_tuple,))
+
+        items = list(self._pathscan(old_path_tuple, None, True))
+
+        if not items:
+            raise ValueError('path %s is not in objectmap' % (old_path_tuple,))
+
+        if next(self._pathscan(path_tuple, None, True), None) is not None:
+            raise ValueError('path %s already exists' % (path_tuple,))
+
+        relocated = self.family.IF.Set()
+
+        for path, oid in items:
+            del self.path_to_objectid[self._path_key(path)]
+
+        for path, oid in items:
+            newkey = self._path_key(path_tuple + path[oldlen:])
+            self.path_to_objectid[newkey] = oid
+            self.objectid_to_path[oid] = newkey
+            relocated.add(oid)
+
+        if self.path_to_acl is not None: # bw compat
+            acl_items = list(
+                self.path_to_acl.items(
+                    min=old_path_tuple,
+                    max=_subtree_max(old_path_tuple),
+                    excludemax=True,
+                    )
+                )
+            for path, acl in acl_items:
+                del self.path_to_acl[path]
+            for path, acl in acl_items:
+                self.path_to_acl[path_tuple + path[oldlen:]] = acl
+            self._acls_changed()
+
+        if self.pathindex is not None:
+            self._relocate_pathindex(old_path_tuple, path_tuple)
+
+        return relocated
+
+    def _relocate_pathindex(self, old_path_tuple, path_tuple):
+        pathindex = self.pathindex
+        oldlen = len(old_path_tuple)
+        newlen = len(path_tuple)
+
+        # copy the level sets before any of them are mutated below
+        items = [
+            (level, self.family.IF.Set(oidset)) for level, oidset in
+            pathindex[old_path_tuple].items()
+            ]
+
+        # entries for the relocated subtree itself store levels relative to
+        # their own path, so they can simply be moved to their new keys
+        keys = list(
+            pathindex.keys(
+                min=old_path_tuple,
+                max=_subtree_max(old_path_tuple),
+                excludemax=True,
+                )
+            )
+        for k in keys:
+            pathindex[path_tuple + k[oldlen:]] = pathindex.pop(k)
+            if self.pathcounts is not None: # bw compat
+                counts = self.pathcounts.pop(k, None)
+                if counts is not None:
+                    self.pathcounts[path_tuple + k[oldlen:]] = counts
+
+        old_ancestors = dict(
+            (old_path_tuple[:x], oldlen - x) for x in range(1, oldlen)
+            )
+        new_ancestors = dict(
+            (path_tuple[:x], newlen - x) for x in range(1, newlen)
+            )
+
+        for els, offset in old_ancestors.items():
+            if new_ancestors.get(els) == offset:
+                continue
+            omap = pathindex[els]
+            for level, oidset in items:
+                i = level + offset
+                oidset2 = omap[i]
+                count = 0
+                for oid in oidset:
+                    if oid in oidset2:
+                        oidset2.remove(oid)
+                        count += 1
+                self._count(els, i, -count)
+                if not oidset2:
+                    del omap[i]
+
+        for els, offset in new_ancestors.items():
+            if old_ancestors.get(els) == offset:
+                continue
+            omap = pathindex.setdefault(els, self.family.IO.BTree())
+            for level, oidset in items:
+                i = level + offset
+                oidset2 = omap.setdefault(i, self.family.IF.TreeSet())
+                self._count(els, i, oidset2.update(oidset))
+
+    def _count(self, path_tuple, level, delta, pathcounts=_marker):
+        # keep the pathcounts of ``path_tuple`` in step with a change of
+        # ``delta`` oids in its pathindex level set ``level``
+        if pathcounts is _marker:
+            pathcounts = self.pathcounts
+        if pathcounts is None or not delta: # bw compat
+            return
+        counts = pathcounts.get(path_tuple)
+        if counts is None:
+            counts = pathcounts[path_tuple] = self.family.IO.BTree()
+        for key in (level, _ALL_LEVELS):
+            length = counts.get(key)
+            if length is None:
+                length = counts[key] = Length()
+            length.change(delta)
+
+    def _remove_range(self, path_tuple, moving):
+        # range-scan mode analogue of the pathindex-based logic in ``remove``
+        items = list(self._pathscan(path_tuple, None, True))
+
+        if not items:
+            return set()
+
+        removed = self.family.IF.Set()
+
+        for path, oid in items:
+            removed.add(oid)
+            path_key = self._path_key(path)
+            del self.path_to_objectid[path_key]
+            if self.objectid_to_path.get(oid) == path_key:
+                del self.objectid_to_path[oid]
+                self._remove_reference(oid)
+
+        if self.path_to_acl is not None: # bw compat
+            maxkey = _subtree_max(path_tuple)
+            acl_paths = list(
+                self.path_to_acl.keys(
+                    min=path_tuple, max=maxkey, excludemax=True
+                    )
+                )
+            for k in acl_paths:
+                del self.path_to_acl[k]
+            if acl_paths:
+                self._acls_changed()
+
+        if not moving:
+            self.referencemap.remove(removed)
+            self.extentmap.remove(removed)
+            self._remove_docids(removed)
+        elif self._in_family():
+            self.extentmap.remove(removed)
+
+        self._forget_shard_oids(removed)
 
         return removed
 
+    def pathscan(self, obj_or_path_tuple, depth=None, include_origin=True):
+        """ Return an iterator of ``(path_tuple, objectid)`` pairs for each
+        object under a given path, in path order, given an object or a path
+        tuple.  ``depth`` and ``include_origin`` have the same meaning as they
+        do for :meth:`substanced.objectmap.ObjectMap.pathlookup`.
+
+        The pairs are produced by a range scan over ``path_to_objectid``;
+        when ``depth`` is an integer, subtrees deeper than ``depth`` are
+        skipped over rather than visited, so finding the children of a path
+        costs one tree probe per child.  This method works whether or not the
+        object map maintains a pathindex."""
+        path_tuple = self._get_path_tuple(obj_or_path_tuple)
+        if path_tuple is None:
+            raise ValueError(
+                'must provide a traversable object or a '
+                'path tuple, got %s' % (obj_or_path_tuple,))
+        if not self._in_family():
+            return self._pathscan(path_tuple, depth, include_origin)
+        omap = self._map_for_path(path_tuple)
+        if omap is not self:
+            return omap.pathscan(path_tuple, depth, include_origin)
+        scans = [ self._pathscan(path_tuple, depth, include_origin) ]
+        for shard_path, shard, shard_depth in self._shard_queries(
+            path_tuple, depth):
+            scans.append(shard._pathscan(shard_path, shard_depth, False))
+        return heapq.merge(*scans)
+
+    def _shard_queries(self, path_tuple, depth):
+        # (path, shard, depth) for each shard whose root is beneath
+        # ``path_tuple`` and which holds objects within ``depth`` of it
+        result = []
+        for shard_path, shard in self._shards_under(path_tuple):
+            shard_depth = None
+            if depth is not None:
+                shard_depth = depth - (len(shard_path) - len(path_tuple))
+                if shard_depth < 1:
+                    continue
+            result.append((shard_path, shard, shard_depth))
+        return result
+
+    def _pathscan(self, path_tuple, depth, include_origin, after=None):
+        # if ``after`` is not None, start just past the subtree of the child
+        # of ``path_tuple`` named ``after``
+        tree = self.path_to_objectid
+        pathlen = len(path_tuple)
+        if after is None:
+            minkey = self._path_key(path_tuple)
+        else:
+            minkey = self._subtree_max_key(path_tuple + (after,))
+        maxkey = self._subtree_max_key(path_tuple)
+
+        while True:
+            for k, oid in tree.items(min=minkey, max=maxkey, excludemax=True):
+                k = self._key_path(k)
+                level = len(k) - pathlen
+
+                if depth is None or level < depth:
+                    if level or include_origin:
+                        yield k, oid
+                    continue
+
+                if level == depth:
+                    if level or include_origin:
+                        yield k, oid
+                    # restart the scan just past this path's subtree
+                    minkey = self._subtree_max_key(k)
+                else:
+                    # an intermediate path is not in the map; skip past the
+                    # subtree of its ancestor at the requested depth
+                    minkey = self._subtree_max_key(k[:pathlen+depth])
+                break
+
+            else:
+                return
+
+    def navchildren(self, obj_or_path_tuple, limit=None, after=None,
+                    ordered=False, counts=True, expand=()):
+        """ Return a generator of dictionaries describing the children of an
+        object, given the object or its path tuple.  Each dictionary has the
+        keys ``path`` (the child's path tuple), ``name``, ``oid``, ``count``
+        (the number of children the child itself has, or ``None`` if
+        ``counts`` is false) and ``children``.
+
+        Children are produced in name order, or, if ``ordered`` is true and
+        the object is a folder with a set order, in folder order.  If
+        ``limit`` is not ``None``, at most ``limit`` children are produced.
+        If ``after`` is not ``None``, it should be the name of a child, e.g.
+        the last one of the previous page; only the children which follow it
+        are produced.
+
+        ``expand`` is a collection of path tuples.  The ``children`` value of
+        a child whose path is in ``expand`` is another such generator (with
+        the same ``limit``, ``ordered``, ``counts`` and ``expand``); for
+        every other child it is ``None``.  Nothing is looked up for a page or
+        a branch until the generator producing it is iterated."""
+        path_tuple = self._get_path_tuple(obj_or_path_tuple)
+        if path_tuple is None:
+            raise ValueError(
+                'must provide a traversable object or a '
+                'path tuple, got %s' % (obj_or_path_tuple,))
+        return self._navchildren(
+            path_tuple, limit, after, ordered, counts, frozenset(expand))
+
+    def _navchildren(self, path_tuple, limit, after, ordered, counts, expand):
+        if self._in_family():
+            omap = self._map_for_path(path_tuple)
+            if omap is not self:
+                for node in omap._navchildren(
+                    path_tuple, limit, after, ordered, counts, expand):
+                    yield node
+                return
+        names = None
+        if ordered:
+            names = self._folder_order(path_tuple)
+        if names is None:
+            children = self._pathscan(path_tuple, 1, False, after)
+        else:
+            start = 0
+            if after is not None:
+                if not after in names:
+                    raise ValueError('no child named %r' % (after,))
+                start = list(names).index(after) + 1
+            children = self._ordered_children(path_tuple, names[start:])
+        for child_path, oid in itertools.islice(children, limit):
+            count = None
+            if counts:
+                count = self.pathcount(child_path, 1, False)
+            branch = None
+            if child_path in expand:
+                branch = self._navchildren(
+                    child_path, limit, None, ordered, counts, expand)
+            yield {'path':child_path,
+                   'name':child_path[-1],
+                   'oid':oid,
+                   'count':count,
+                   'children':branch,
+                   }
+
+    def _folder_order(self, path_tuple):
+        folder = self.object_for(path_tuple)
+        is_ordered = getattr(folder, 'is_ordered', None)
+        if is_ordered is not None and is_ordered():
+            return folder.keys()
+
+    def _ordered_children(self, path_tuple, names):
+        for name in names:
+            child_path = path_tuple + (name,)
+            oid = self.path_to_objectid.get(self._path_key(child_path))
+            if oid is not None:
+                yield child_path, oid
+
     def navgen(self, obj_or_path_tuple, depth=1):
+        """ Return a list of dictionaries describing the children of an object
+        (given the object or its path tuple) to ``depth`` levels, each with
+        the keys ``path``, ``name`` and ``children``.  Every child of every
+        level is included; see ``navchildren`` for a paged, lazy variant."""
         path_tuple = self._get_path_tuple(obj_or_path_tuple)
         if path_tuple is None:
             raise ValueError(
@@ -304,6 +1394,12 @@ class ObjectMap(Persistent):
         return self._navgen(path_tuple, depth)
 
     def _navgen(self, path_tuple, depth):
+        if self._in_family():
+            omap = self._map_for_path(path_tuple)
+            if omap is not self:
+                return omap._navgen(path_tuple, depth)
+        if self.pathindex is None:
+            return self._navgen_range(path_tuple, depth)
         omap = self.pathindex.get(path_tuple)
         if omap is None:
             return []
@@ -314,7 +1410,7 @@ class ObjectMap(Persistent):
         newdepth = depth-1
         if newdepth > -1:
             for oid in oidset:
-                pt = self.objectid_to_path[oid]
+                pt = self._key_path(self.objectid_to_path[oid])
                 result.append(
                     {'path':pt,
                      'children':self._navgen(pt, newdepth),
@@ -323,6 +1419,19 @@ class ObjectMap(Persistent):
                     )
         return result
 
+    def _navgen_range(self, path_tuple, depth):
+        result = []
+        newdepth = depth-1
+        if newdepth > -1:
+            for pt, oid in self._pathscan(path_tuple, 1, False):
+                result.append(
+                    {'path':pt,
+                     'children':self._navgen_range(pt, newdepth),
+                     'name':pt[-1],
+                     }
+                    )
+        return result
+
     def pathcount(self, obj_or_path_tuple, depth=None, include_origin=True):
         """ Return the total number of objectids under a given path given an
         object or a path tuple.  If ``depth`` is None, count all object ids
@@ -335,6 +1444,29 @@ class ObjectMap(Persistent):
                 'must provide a traversable object or a '
                 'path tuple, got %s' % (obj_or_path_tuple,))
 
+        if not self._in_family():
+            return self._local_pathcount(path_tuple, depth, include_origin)
+
+        omap = self._map_for_path(path_tuple)
+        if omap is not self:
+            return omap.pathcount(path_tuple, depth, include_origin)
+
+        result = self._local_pathcount(path_tuple, depth, include_origin)
+        for shard_path, shard, shard_depth in self._shard_queries(
+            path_tuple, depth):
+            result += shard.pathcount(shard_path, shard_depth, False)
+        return result
+
+    def _local_pathcount(self, path_tuple, depth, include_origin):
+        if self.pathindex is None:
+            result = 0
+            for item in self._pathscan(path_tuple, depth, include_origin):
+                result += 1
+            return result
+
+        if self.pathcounts is not None: # bw compat
+            return self._pathcount(path_tuple, depth, include_origin)
+
         omap = self.pathindex.get(path_tuple)
 
         result = 0
@@ -365,6 +1497,23 @@ class ObjectMap(Persistent):
 
         return result
 
+    def _pathcount(self, path_tuple, depth, include_origin):
+        # read the counters rather than len() the level sets
+        counts = self.pathcounts.get(path_tuple)
+        if counts is None:
+            return 0
+        origin = counts.get(0)
+        origin = origin() if origin is not None else 0
+        if depth is None or depth >= counts.maxKey():
+            result = counts[_ALL_LEVELS]()
+        else:
+            result = 0
+            for level, length in counts.items(min=0, max=depth):
+                result += length()
+        if not include_origin and (depth is None or depth >= 0):
+            result -= origin
+        return result
+
     def pathlookup(self, obj_or_path_tuple, depth=None, include_origin=True):
         """ Return a set of objectids under a given path given an object or a
         path tuple.  If ``depth`` is None, return all object ids under the
@@ -377,6 +1526,26 @@ class ObjectMap(Persistent):
                 'must provide a traversable object or a '
                 'path tuple, got %s' % (obj_or_path_tuple,))
 
+        if not self._in_family():
+            return self._local_pathlookup(path_tuple, depth, include_origin)
+
+        omap = self._map_for_path(path_tuple)
+        if omap is not self:
+            return omap.pathlookup(path_tuple, depth, include_origin)
+
+        result = self._local_pathlookup(path_tuple, depth, include_origin)
+        for shard_path, shard, shard_depth in self._shard_queries(
+            path_tuple, depth):
+            result.update(shard.pathlookup(shard_path, shard_depth, False))
+        return result
+
+    def _local_pathlookup(self, path_tuple, depth, include_origin):
+        if self.pathindex is None:
+            return self.family.IF.Set(
+                [ oid for k, oid in
+                  self._pathscan(path_tuple, depth, include_origin) ]
+                )
+
         omap = self.pathindex.get(path_tuple)
 
         result = self.family.IF.Set()
@@ -409,15 +1578,15 @@ class ObjectMap(Persistent):
 
     def _refids_for(self, source, target):
         sourceid, targetid = get_oid(source, source), get_oid(target, target)
-        if not sourceid in self.objectid_to_path:
+        if self._map_for_oid(sourceid) is None:
             raise ValueError('source %s is not in objectmap' % (source,))
-        if not targetid in self.objectid_to_path:
+        if self._map_for_oid(targetid) is None:
             raise ValueError('target %s is not in objectmap' % (target,))
         return sourceid, targetid
 
     def _refid_for(self, obj):
         oid = get_oid(obj, obj)
-        if not oid in self.objectid_to_path:
+        if self._map_for_oid(oid) is None:
             raise ValueError('oid %s is not in objectmap' % (obj,))
         return oid
 
@@ -456,6 +1625,47 @@ class ObjectMap(Persistent):
         sourceid, targetid = self._refids_for(source, target)
         self.referencemap.disconnect(sourceid, targetid, reftype)
 
+    def _refid_pairs_for(self, pairs, ignore_missing):
+        pairs = [ (get_oid(s, s), get_oid(t, t)) for s, t in pairs ]
+        oids = self.family.OO.Set()
+        for sourceid, targetid in pairs:
+            oids.insert(sourceid)
+            oids.insert(targetid)
+        missing = self.family.OO.difference(oids, self.objectid_to_path)
+        if missing and self._in_family():
+            missing = self.family.OO.Set(
+                [ oid for oid in missing if self._map_for_oid(oid) is None ])
+        if missing:
+            if not ignore_missing:
+                raise ValueError(
+                    'oids %s are not in objectmap' % (list(missing),))
+            pairs = [
+                (sourceid, targetid) for sourceid, targetid in pairs
+                if not (sourceid in missing or targetid in missing)
+                ]
+        return pairs
+
+    def connect_many(self, pairs, reftype, ignore_missing=False):
+        """ Connect each source object or objectid to its target object or
+        objectid in ``pairs`` (a sequence of ``(source, target)`` tuples)
+        using reference type ``reftype``.  The result is the same as calling
+        ``connect`` for each pair in order (an ordered reference keeps the
+        order of the pairs), but each affected set of oids is written once.
+
+        If any object is not in the object map, a :exc:`ValueError` is raised
+        and no references are made, unless ``ignore_missing`` is true, in
+        which case pairs involving such objects are skipped."""
+        pairs = self._refid_pairs_for(pairs, ignore_missing)
+        self.referencemap.connect_many(pairs, reftype)
+
+    def disconnect_many(self, pairs, reftype, ignore_missing=False):
+        """ Disconnect each source object or objectid from its target object
+        or objectid in ``pairs`` (a sequence of ``(source, target)`` tuples)
+        using reference type ``reftype``.  ``ignore_missing`` has the same
+        meaning as for ``connect_many``."""
+        pairs = self._refid_pairs_for(pairs, ignore_missing)
+        self.referencemap.disconnect_many(pairs, reftype)
+
     # We make a copy of the set returned by ``targetids`` and ``sourceids``
     # because it's not atypical for callers to want to modify the
     # underlying bucket while iterating over the returned set.  For example:
@@ -470,7 +1680,7 @@ class ObjectMap(Persistent):
     # RuntimeError: the bucket being iterated changed size
 
     def _oidset(self, maybe_set):
-        if isinstance(maybe_set, ListSet):
+        if _is_ordered(maybe_set):
             return ListSet(maybe_set)
         return self.family.OO.Set(maybe_set)
 
@@ -489,14 +1699,49 @@ class ObjectMap(Persistent):
     def sources(self, obj, reftype):
         """ Return a generator which will return the objects connected to
         ``obj`` as a source using reference type ``reftype``"""
-        for oid in self.sourceids(obj, reftype):
-            yield self.object_for(oid)
+        for obj in self.object_for_many(self.sourceids(obj, reftype)):
+            yield obj
 
     def targets(self, obj, reftype):
         """ Return a generator which will return the objects connected to
         ``obj`` as a target using reference type ``reftype``"""
-        for oid in self.targetids(obj, reftype):
-            yield self.object_for(oid)
+        for obj in self.object_for_many(self.targetids(obj, reftype)):
+            yield obj
+
+    def _traversal_args(self, objs, reftypes):
+        oids = [ self._refid_for(obj) for obj in objs ]
+        if not isinstance(reftypes, (list, tuple)):
+            reftypes = (reftypes,)
+        return oids, reftypes
+
+    def traverse(self, objs, reftypes, direction='targets', depth=None):
+        """ Walk the reference graph breadth-first from the objects or
+        objectids in the sequence ``objs``, following references of reference
+        type ``reftypes`` (or of any of them, if ``reftypes`` is a list or
+        tuple).  ``direction`` may be ``targets`` (follow references from
+        source to target), ``sources`` (from target to source) or ``both``.
+        Return a generator which yields, for each hop, a set of the
+        objectids first reached by that hop.  Objects reached more than once,
+        e.g. through a cycle, are only yielded the first time, and the
+        starting objects are never yielded.  If ``depth`` is not ``None``,
+        the walk stops after that many hops.
+
+        Unlike ``targetids`` and ``sourceids``, the sets are not copies of
+        reference map data but new ``IF`` sets, which can be intersected
+        with catalog query results directly."""
+        oids, reftypes = self._traversal_args(objs, reftypes)
+        return self.referencemap.traverse(oids, reftypes, direction, depth)
+
+    def closure(self, objs, reftypes, direction='targets', depth=None,
+                include_origin=False):
+        """ Return an ``IF`` set of all the objectids reachable from the
+        objects or objectids in ``objs`` (the transitive closure, limited to
+        ``depth`` hops if it is not ``None``).  The arguments have the same
+        meaning as for ``traverse``.  The starting objectids are part of the
+        result only if ``include_origin`` is true."""
+        oids, reftypes = self._traversal_args(objs, reftypes)
+        return self.referencemap.closure(
+            oids, reftypes, direction, depth, include_origin)
 
     def has_references(self, obj, reftype=None):
         """ Return true if the object participates in any reference as a source
@@ -512,8 +1757,43 @@ class ObjectMap(Persistent):
         """ Return the extent for ``name`` (typically a factory name, e.g. the
         dotted name of the content class).  It will be a TreeSet composed
         entirely of oids.  If no extent exist by this name, this will return
-        the value of ``default``."""
-        return self.extentmap.get(name, default)
+        the value of ``default``.
+
+        The extents of the object map of a site with shards include the
+        objects held by its shards; those of a shard include only its
+        own."""
+        extent = self.extentmap.get(name, default)
+        if not self.shards:
+            return extent
+        extents = [
+            shard.extentmap.get(name) for shard in self.shards.values()
+            ]
+        extents = [ x for x in [ extent ] + extents if x and x is not default ]
+        if not extents:
+            return default
+        return self.family.II.TreeSet(self.family.II.multiunion(extents))
+
+    def extent_count(self, name):
+        """ Return the number of objects in the extent ``name`` from the
+        counters kept by the extent map, without loading the extent.  The
+        count of the object map of a site with shards includes the objects
+        held by its shards."""
+        count = self.extentmap.count(name)
+        if self.shards:
+            extent = self.extentmap.get(name, ())
+            for path_tuple, shard in self.shards.items():
+                count += shard.extentmap.count(name)
+                # the root of a shard is held by both object maps
+                if self.objectid_for(path_tuple) in extent:
+                    count -= 1
+        return count
+
+    def _acl_for(self, path_tuple):
+        # the cached ACL of ``path_tuple`` from whichever object map holds it
+        omap = self._map_for_path(path_tuple)
+        if omap.path_to_acl is None: # bw compat
+            return None
+        return omap.path_to_acl.get(path_tuple)
 
     def set_acl(self, obj_objectid_or_path_tuple, acl):
         """ For the resource implied by ``obj_objectid_or_path_tuple``, set the
@@ -521,49 +1801,426 @@ class ObjectMap(Persistent):
         passed as ``acl``"""
         if self.path_to_acl is not None: # bw compat
             path_tuple = self._get_path_tuple(obj_objectid_or_path_tuple)
+            if self._in_family():
+                omap = self._map_for_path(path_tuple)
+                if omap is not self:
+                    return omap.set_acl(path_tuple, acl)
             self.path_to_acl[path_tuple] = tuple(acl)
+            self._acls_changed()
 
-    def allowed(self, oids, principals, permission):
+    def _acls_changed(self):
+        # invalidates what the AllowedCaches used with this objectmap (or,
+        # for a shard, with its site's objectmap) hold
+        self._v_acl_token = object()
+        if self.parent_map is not None:
+            self.parent_map._acls_changed()
+
+    def allowed(self, oids, principals, permission, cache=None):
         """ For the set of oids present in ``oids``, return a sequence of oids
         that are permitted ``permission`` against each oid if the implied user
         is a member of the set of principals implied by ``principals``.  This
         method uses the data collected via the ``set_acl`` method of this
-        class."""
+        class.
+
+        The decision made for each path is memoized, so an ACL shared by
+        many oids (e.g. that of their common parent) is evaluated only once.
+        To reuse those decisions across calls, pass the same
+        :class:`AllowedCache` as ``cache`` to each of them."""
         if self.path_to_acl is None: # bw compat
             return
 
+        if cache is None:
+            cache = AllowedCache()
+        if not is_nonstr_iter(principals):
+            principals = (principals,)
+        principals = frozenset(principals)
+        # decisions don't depend on which object map of a site makes them
+        compiled, decisions = cache.for_objectmap(self._top_map())
+        decisions = decisions.setdefault((principals, permission), {})
+
         for oid in oids:
-            path_tuple = self.objectid_to_path.get(oid)
+            path_tuple = self.path_for(oid)
             if path_tuple is None:
                 continue
+            if self._decide(
+                path_tuple, principals, permission, decisions, compiled):
+                yield oid
+
+    def _decide(self, path_tuple, principals, permission, decisions,
+                compiled):
+        # walk up the lineage of ``path_tuple`` until an ACL makes a decision
+        # or a path whose decision is already known is found, then remember
+        # the decision for every path visited on the way
+        undecided = []
+        decision = False
+        for idx in range(len(path_tuple), 0, -1):
+            prefix = path_tuple[:idx]
+            known = decisions.get(prefix)
+            if known is not None:
+                decision = known
+                break
+            undecided.append(prefix)
+            acl = compiled.get(prefix, _marker)
+            if acl is _marker:
+                acl = self._acl_for(prefix)
+                if acl is not None:
+                    acl = CompiledACL(acl)
+                compiled[prefix] = acl
+            if acl is not None:
+                allowed = acl.allows(principals, permission)
+                if allowed is not None:
+                    decision = allowed
+                    break
+        for prefix in undecided:
+            decisions[prefix] = decision
+        return decision
+
+    def verify(self, output=None):
+        """ Check that ``objectid_to_path`` and ``path_to_objectid`` mirror
+        each other and that the pathindex, the pathcounts and the extent map
+        agree with them, without loading any content object.  Return the
+        number of inconsistencies found.
+
+        Each inconsistency is reported via ``output``, which has the same
+        meaning as it does for :meth:`substanced.catalog.Catalog.reindex`,
+        except that the default is the ``substanced.objectmap`` logger."""
+        if output is None: # pragma: no cover
+            output = logger.info
+
+        problems = []
+
+        def report(msg):
+            problems.append(msg)
+            output and output('error: %s' % msg)
+
+        IF = self.family.IF
+        oids = IF.Set(self.objectid_to_path.keys())
+        path_oids = IF.Set(self.path_to_objectid.values())
+
+        for oid in IF.difference(oids, path_oids):
+            report('objectid %s is missing from path_to_objectid' % oid)
+        for oid in IF.difference(path_oids, oids):
+            report('objectid %s is missing from objectid_to_path' % oid)
+        for path_key, oid in self.path_to_objectid.items():
+            other = self.objectid_to_path.get(oid)
+            if other is not None and other != path_key:
+                report('path %s is mapped to objectid %s, which is mapped to '
+                       'path %s' % (self._key_path(path_key), oid,
+                                    self._key_path(other)))
+
+        if self.pathindex is not None:
+            self._verify_pathindex(report)
+
+        self._verify_extentmap(oids, report)
+
+        output and output('%s inconsistencies found' % len(problems))
+        return len(problems)
+
+    def _verify_pathindex(self, report):
+        IF = self.family.IF
+        for path_key in self.path_to_objectid.keys():
+            path_tuple = self._key_path(path_key)
+            if not path_tuple in self.pathindex:
+                report('path %s is missing from the pathindex' % (
+                    path_tuple,))
+        for path_tuple, omap in self.pathindex.items():
+            pathlen = len(path_tuple)
+            expected = {}
+            for path, oid in self._pathscan(path_tuple, None, True):
+                expected.setdefault(len(path) - pathlen, []).append(oid)
+            counts = None
+            if self.pathcounts is not None: # bw compat
+                counts = self.pathcounts.get(path_tuple)
+            total = 0
+            for level in sorted(set(omap.keys()) | set(expected)):
+                actual = omap.get(level, IF.Set())
+                wanted = IF.Set(expected.get(level, ()))
+                stale = IF.difference(actual, wanted)
+                if stale:
+                    report('pathindex level %s of path %s holds the stale '
+                           'objectids %s' % (level, path_tuple, list(stale)))
+                missing = IF.difference(wanted, actual)
+                if missing:
+                    report('pathindex level %s of path %s lacks the objectids '
+                           '%s' % (level, path_tuple, list(missing)))
+                total += len(actual)
+                if counts is not None:
+                    length = counts.get(level)
+                    count = length() if length is not None else 0
+                    if count != len(actual):
+                        report('pathcount of level %s of path %s is %s rather '
+                               'than %s' % (level, path_tuple, count,
+                                            len(actual)))
+            if self.pathcounts is not None: # bw compat
+                length = counts and counts.get(_ALL_LEVELS)
+                count = length() if length else 0
+                if count != total:
+                    report('pathcount of path %s is %s rather than %s' % (
+                        path_tuple, count, total))
+
+    def _verify_extentmap(self, oids, report):
+        IF = self.family.IF
+        extent_to_oids = self.extentmap.extent_to_oids
+        oid_to_extents = self.extentmap.oid_to_extents
+        extent_oids = IF.Set(
+            self.family.II.multiunion(list(extent_to_oids.values())))
+        for oid in IF.difference(extent_oids, oids):
+            report('objectid %s is in an extent but not in the objectmap' % (
+                oid,))
+        for oid in IF.difference(oids, extent_oids):
+            report('objectid %s is in no extent' % oid)
+        for name, eoids in extent_to_oids.items():
+            for oid in eoids:
+                if not name in oid_to_extents.get(oid, ()):
+                    report('extent %s of objectid %s is missing from '
+                           'oid_to_extents' % (name, oid))
+        for oid, names in oid_to_extents.items():
+            for name in names:
+                if not oid in extent_to_oids.get(name, ()):
+                    report('objectid %s is missing from extent %s' % (
+                        oid, name))
+        extent_lengths = self.extentmap.extent_lengths
+        if extent_lengths is not None: # bw compat
+            names = self.family.OO.union(
+                self.family.OO.Set(extent_to_oids.keys()),
+                self.family.OO.Set(extent_lengths.keys()))
+            for name in names:
+                count = self.extentmap.count(name)
+                actual = len(extent_to_oids.get(name, ()))
+                if count != actual:
+                    report('count of extent %s is %s rather than %s' % (
+                        name, count, actual))
+
+    def rebuild(self, commit_interval=3000, output=None):
+        """ Replace the pathindex (and the pathcounts) and the extent map of
+        this object map with new ones.  The pathindex is built from the
+        paths in ``path_to_objectid``, in path order; the extent map from a
+        walk of the resource tree below the root of this object map (which
+        doesn't descend into the subtrees of shards).  No events are sent.
+
+        The objects of the tree which aren't in this object map under their
+        path, and the objects of the object map which weren't found in the
+        tree, are reported; they are left as they are.  Return the number of
+        such objects.
+
+        ``commit_interval`` controls the number of objects processed between
+        each call to ``transaction.commit()``.  The new trees are only
+        swapped in by the last commit: until then, the object map keeps
+        using the old ones.  Use :meth:`verify` to find out whether a rebuild
+        is needed without changing anything.  ``output`` has the same
+        meaning as it does for ``verify``.
+
+        The object map must not be changed by anything else while it is
+        being rebuilt."""
+        if output is None: # pragma: no cover
+            output = logger.info
+
+        def commit():
+            output and output('*** committing ***')
+            self.transaction.commit()
+
+        problems = 0
+
+        pathindex = pathcounts = None
+        if self.pathindex is not None:
+            pathindex = self.family.OO.BTree()
+            pathcounts = self.family.OO.BTree()
+        extentmap = ExtentMap()
+        # the new trees are attached to the object map while they are built,
+        # so that each commit stores the batch just built
+        self._rebuilt = (pathindex, pathcounts, extentmap)
+
+        if pathindex is not None:
+            output and output('rebuilding pathindex')
+            levels = {}
+            i = 0
+            for path_key, oid in self.path_to_objectid.items():
+                _collect_levels(levels, self._key_path(path_key), oid)
+                i += 1
+                if i % commit_interval == 0:
+                    self._add_levels(levels, pathindex, pathcounts)
+                    levels = {}
+                    commit()
+            self._add_levels(levels, pathindex, pathcounts)
+
+        output and output('rebuilding extentmap')
+        seen = self.family.IF.Set()
+        extents = {}
+        i = 0
+        for path_tuple, node in self._walk():
+            oid = get_oid(node, None)
+            path_key = self.objectid_to_path.get(oid)
+            if path_key is None or self._key_path(path_key) != path_tuple:
+                problems += 1
+                output and output(
+                    'error: object at path %s is not in the objectmap' % (
+                        _SLASH.join(path_tuple),))
+                continue
+            seen.insert(oid)
+            extents.setdefault(get_factory_type(node), []).append(oid)
+            i += 1
+            if i % commit_interval == 0:
+                extentmap.add_many(extents)
+                extents = {}
+                commit()
+        extentmap.add_many(extents)
+
+        if pathindex is not None:
+            self.pathindex = pathindex
+            self.pathcounts = pathcounts
+        self.extentmap = extentmap
+        self._rebuilt = None
+        commit()
+
+        unseen = self.family.IF.difference(
+            self.family.IF.Set(self.objectid_to_path.keys()), seen)
+        for oid in unseen:
+            problems += 1
+            output and output(
+                'error: objectid %s (path %s) was not found in the tree' % (
+                    oid, _SLASH.join(
+                        self._key_path(self.objectid_to_path[oid]))))
+
+        output and output('%s objects not rebuilt' % problems)
+        return problems
+
+    def _walk(self):
+        # yield (path tuple, object) for each object below the root of this
+        # object map, parents first, not descending into other object maps
+        if self.shard_path is None:
+            start, start_path = self.root, resource_path_tuple(self.root)
+        else:
+            start_path = self.shard_path
+            start = self._find_resource(None, start_path)
+        yield start_path, start
+        stack = []
+        if is_folder(start):
+            stack.append((start_path, iter(start.items())))
+        while stack:
+            path_tuple, children = stack[-1]
+            for name, child in children:
+                child_path = path_tuple + (name,)
+                yield child_path, child
+                if is_folder(child) and self._foreign_shard(child) is None:
+                    stack.append((child_path, iter(child.items())))
+                break
+            else:
+                stack.pop()
+
+class CompiledACL(object):
+    """ An ACL precompiled for ``ObjectMap.allowed``.  For each permission
+    named by the ACL, it maps each principal to the position and the action
+    of the first ACE which grants or denies the principal that permission,
+    so that deciding whether a set of principals has a permission needs one
+    dictionary lookup per principal instead of a scan of every ACE."""
+
+    def __init__(self, acl):
+        self.by_permission = {}
+        # ACEs whose permissions can't be enumerated (e.g. ALL_PERMISSIONS);
+        # these are tested with ``in`` as a plain ACL scan would do
+        self.opaque = []
+        for idx, (action, principal, permissions) in enumerate(acl):
+            entry = (idx, action == Allow)
+            if not is_nonstr_iter(permissions):
+                permissions = (permissions,)
+            if isinstance(permissions, (list, tuple, set, frozenset)):
+                for permission in permissions:
+                    principals = self.by_permission.setdefault(permission, {})
+                    principals.setdefault(principal, entry)
+            else:
+                self.opaque.append((entry, principal, permissions))
+
+    def allows(self, principals, permission):
+        """ Return ``True`` if the first ACE matching any of ``principals``
+        and ``permission`` allows, ``False`` if it denies and ``None`` if no
+        ACE matches."""
+        first = None
+        table = self.by_permission.get(permission)
+        if table:
+            for principal in principals:
+                entry = table.get(principal)
+                if entry is not None and (first is None or entry < first):
+                    first = entry
+        for entry, principal, permissions in self.opaque:
+            if first is not None and entry > first:
+                break
+            if principal in principals and permission in permissions:
+                first = entry
+                break
+        if first is None:
+            return None
+        return first[1]
 
-            try:
-                for idx in reversed(range(len(path_tuple))):
-                    acl = self.path_to_acl.get(path_tuple[:idx+1])
-                    if acl is None:
-                        continue
-                    for ace in acl:
-                        ace_action, ace_principal, ace_permissions = ace
-                        if ace_principal in principals:
-                            if not is_nonstr_iter(ace_permissions):
-                                ace_permissions = [ace_permissions]
-                            if permission in ace_permissions:
-                                if ace_action == Allow:
-                                    yield oid
-                                raise _Break()
-            except _Break:
-                pass
+class AllowedCache(object):
+    """ Memoizes the compiled ACLs and the decisions made by
+    ``ObjectMap.allowed`` so that they may be reused by later calls (e.g.
+    by each catalog query made while serving a request).  What it holds
+    for an objectmap is dropped when the ACLs of that objectmap are changed
+    via ``set_acl``."""
 
-class _Break(Exception):
-    pass
+    def __init__(self):
+        # id(objectmap) -> (acl token, compiled ACLs, decisions)
+        self._objectmaps = {}
+
+    def for_objectmap(self, objectmap):
+        """ Return a dictionary mapping path tuples to compiled ACLs (or
+        ``None``) and a dictionary mapping ``(principals, permission)`` to
+        dictionaries of decisions keyed by path tuple for ``objectmap``."""
+        token = getattr(objectmap, '_v_acl_token', None)
+        cached = self._objectmaps.get(id(objectmap))
+        if cached is None or cached[0] is not token:
+            cached = (token, {}, {})
+            self._objectmaps[id(objectmap)] = cached
+        return cached[1], cached[2]
+
+class DocidAllocator(Persistent):
+    """ Hands out small, dense integer docids.
+
+    Rather than writing a counter for each docid, a database connection
+    claims a block of ``block_size`` docids at a time by advancing
+    ``next_block``, and hands them out from a volatile attribute; concurrent
+    transactions conflict only when they claim blocks at the same time.  If
+    the transaction which claimed a block is aborted, the allocator is
+    invalidated and the block is forgotten with it.  Docids are never
+    reused; those of a block left unused (e.g. when another connection
+    claims a block) are skipped."""
+
+    block_size = 64
+    _v_block = None # (next docid, end of the block)
+
+    def __init__(self, start=1, block_size=None):
+        self.next_block = start
+        if block_size is not None:
+            self.block_size = block_size
+
+    def allocate(self):
+        """ Return an unused docid """
+        block = self._v_block
+        if block is None or block[0] >= block[1]:
+            start = self.next_block
+            self.next_block = start + self.block_size
+            block = (start, self.next_block)
+        docid = block[0]
+        self._v_block = (docid + 1, block[1])
+        return docid
 
 class ExtentMap(Persistent):
 
     family = BTrees.family64
+    extent_lengths = None # b/c; extent name -> Length
 
     def __init__(self, family=None):
         self.extent_to_oids = self.family.OO.BTree()
         self.oid_to_extents = self.family.OO.BTree()
+        self.extent_lengths = self.family.OO.BTree()
+
+    def _count(self, extent_name, delta):
+        if self.extent_lengths is None or not delta: # bw compat
+            return
+        length = self.extent_lengths.get(extent_name)
+        if length is None:
+            length = self.extent_lengths[extent_name] = Length()
+        length.change(delta)
 
     def add(self, obj, oid):
         # NB: we currently treat only the factory type as an extent
@@ -572,13 +2229,28 @@ class ExtentMap(Persistent):
             factory_type,
             self.family.II.TreeSet()
             )
-        extent.add(oid)
+        self._count(factory_type, extent.add(oid))
         rextent = self.oid_to_extents.setdefault(
             oid,
             self.family.OO.TreeSet()
             )
         rextent.add(factory_type)
 
+    def add_many(self, extents):
+        # ``extents`` maps factory types to sequences of oids
+        for factory_type, oids in extents.items():
+            extent = self.extent_to_oids.setdefault(
+                factory_type,
+                self.family.II.TreeSet()
+                )
+            self._count(factory_type, extent.update(oids))
+            for oid in oids:
+                rextent = self.oid_to_extents.setdefault(
+                    oid,
+                    self.family.OO.TreeSet()
+                    )
+                rextent.add(factory_type)
+
     def remove(self, oids):
         for oid in oids:
             extent_names = self.oid_to_extents.get(oid)
@@ -588,38 +2260,104 @@ class ExtentMap(Persistent):
                     eoids = self.extent_to_oids.get(extent_name, ())
                     if oid in eoids:
                         eoids.remove(oid)
+                        self._count(extent_name, -1)
                         if not eoids:
                             del self.extent_to_oids[extent_name]
+                            if self.extent_lengths is not None: # bw compat
+                                self.extent_lengths.pop(extent_name, None)
 
     def get(self, name, default=None):
         return self.extent_to_oids.get(name, default)
 
+    def count(self, name):
+        """ Return the number of oids in the extent ``name`` without counting
+        them (unless the extent map predates ``extent_lengths``)."""
+        if self.extent_lengths is None: # bw compat
+            return len(self.extent_to_oids.get(name, ()))
+        length = self.extent_lengths.get(name)
+        if length is None:
+            return 0
+        return length()
+
+    def rebuild_lengths(self):
+        """ Rebuild ``extent_lengths`` by counting the oids of each extent."""
+        self.extent_lengths = self.family.OO.BTree()
+        for name, oids in self.extent_to_oids.items():
+            self._count(name, len(oids))
+
 class ReferenceMap(Persistent):
 
     family = BTrees.family64
+    # oid -> set of the reftypes whose reference sets may mention the oid
+    # (it may name reftypes which no longer do, never the other way around)
+    oid_to_reftypes = None # b/c
 
     def __init__(self, refmap=None):
         if refmap is None:
             refmap = self.family.OO.BTree()
+            # a refmap that is passed in may already contain references, so
+            # only an empty one starts out with a (necessarily empty) index
+            self.oid_to_reftypes = self.family.OO.BTree()
         self.refmap = refmap
 
+    def _index(self, oid, reftype):
+        if self.oid_to_reftypes is not None:
+            reftypes = self.oid_to_reftypes.get(oid)
+            if reftypes is None:
+                reftypes = self.oid_to_reftypes[oid] = self.family.OO.TreeSet()
+            reftypes.insert(reftype)
+
+    def rebuild_index(self):
+        """ Rebuild the ``oid_to_reftypes`` index from the reference sets."""
+        self.oid_to_reftypes = self.family.OO.BTree()
+        for reftype, refset in self.refmap.items():
+            for oid in refset.src2target.keys():
+                self._index(oid, reftype)
+            for oid in refset.target2src.keys():
+                self._index(oid, reftype)
+
     def order_sources(self, targetid, reftype, order=_marker):
         refset = self.refmap.setdefault(reftype, ReferenceSet())
-        return refset.order_sources(targetid, order)
+        result = refset.order_sources(targetid, order)
+        if refset.is_target(targetid):
+            self._index(targetid, reftype)
+        return result
 
     def order_targets(self, sourceid, reftype, order=_marker):
         refset = self.refmap.setdefault(reftype, ReferenceSet())
-        return refset.order_targets(sourceid, order)
+        result = refset.order_targets(sourceid, order)
+        if refset.is_source(sourceid):
+            self._index(sourceid, reftype)
+        return result
 
     def connect(self, source, target, reftype):
         refset = self.refmap.setdefault(reftype, ReferenceSet())
         refset.connect(source, target)
+        self._index(source, reftype)
+        self._index(target, reftype)
 
     def disconnect(self, source, target, reftype):
         refset = self.refmap.get(reftype)
         if refset is not None:
             refset.disconnect(source, target)
 
+    def connect_many(self, pairs, reftype):
+        if not pairs:
+            return
+        refset = self.refmap.setdefault(reftype, ReferenceSet())
+        refset.connect_many(pairs)
+        indexed = set()
+        for source, target in pairs:
+            for oid in (source, target):
+                if oid not in indexed:
+                    indexed.add(oid)
+                    self._index(oid, reftype)
+
+    def disconnect_many(self, pairs, reftype):
+        refset = self.refmap.get(reftype)
+        if refset is not None:
+            refset.disconnect_many(pairs)
+
     def targetids(self, oid, reftype):
         refset = self.refmap.get(reftype)
         if refset is not None:
@@ -632,16 +2370,104 @@ class ReferenceMap(Persistent):
             return refset.sourceids(oid)
         return self.family.OO.Set()
 
+    def _traversal_trees(self, reftypes, direction):
+        if direction == 'targets':
+            names = ('src2target',)
+        elif direction == 'sources':
+            names = ('target2src',)
+        elif direction == 'both':
+            names = ('src2target', 'target2src')
+        else:
+            raise ValueError(
+                'direction must be "targets", "sources" or "both", not %r' % (
+                    direction,))
+        trees = []
+        for reftype in reftypes:
+            refset = self.refmap.get(reftype)
+            if refset is not None:
+                trees.extend(getattr(refset, name) for name in names)
+        return trees
+
+    def traverse(self, oids, reftypes, direction='targets', depth=None):
+        """ Walk the reference graph breadth-first from ``oids`` following
+        references of any of ``reftypes`` in ``direction`` (``targets``,
+        ``sources`` or ``both``).  Yield, for each hop, an ``IF`` set of the
+        oids first reached by that hop.  Oids which were already reached
+        (including the starting oids) are never yielded again, so the walk
+        terminates on cyclic graphs.  If ``depth`` is not ``None``, stop
+        after that many hops."""
+        IF = self.family.IF
+        trees = self._traversal_trees(reftypes, direction)
+        frontier = visited = IF.multiunion(list(oids))
+        hops = 0
+        while trees and frontier and (depth is None or hops < depth):
+            hops += 1
+            neighbors = []
+            for tree in trees:
+                for oid in frontier:
+                    oidset = tree.get(oid)
+                    if oidset:
+                        neighbors.extend(oidset)
+            frontier = IF.difference(IF.multiunion(neighbors), visited)
+            if frontier:
+                visited = IF.union(visited, frontier)
+                yield frontier
+
+    def references_among(self, oids, reftype, direction='targets'):
+        """ Yield ``(oid, oidset)`` for each oid in the ``OO`` set ``oids``
+        which has references of type ``reftype``.  ``oidset`` holds the
+        targets of the oid if ``direction`` is ``targets`` and its sources if
+        it is ``sources``.  The oids are found by intersecting ``oids`` with
+        the keys of the reference set, so the cost does not grow with the
+        number of oids that have no references of this type."""
+        for tree in self._traversal_trees((reftype,), direction):
+            for oid in self.family.OO.intersection(oids, tree):
+                yield oid, tree[oid]
+
+    def closure(self, oids, reftypes, direction='targets', depth=None,
+                include_origin=False):
+        """ Return an ``IF`` set of the oids reachable from ``oids`` (see
+        ``traverse``).  The starting oids are part of the result only if
+        ``include_origin`` is true."""
+        levels = list(self.traverse(oids, reftypes, direction, depth))
+        if include_origin:
+            levels.append(self.family.IF.multiunion(list(oids)))
+        return self.family.IF.multiunion(levels)
+
     def remove(self, oids):
-        for refset in self.refmap.values():
-            refset.remove(oids)
+        if self.oid_to_reftypes is None:
+            for refset in self.refmap.values():
+                refset.remove(oids)
+            return
+
+        oids_by_reftype = {}
+        for oid in oids:
+            reftypes = self.oid_to_reftypes.get(oid)
+            if reftypes is not None:
+                del self.oid_to_reftypes[oid]
+                for reftype in reftypes:
+                    oids_by_reftype.setdefault(reftype, []).append(oid)
+
+        for reftype, reftype_oids in oids_by_reftype.items():
+            refset = self.refmap.get(reftype)
+            if refset is not None:
+                refset.remove(reftype_oids)
 
     def get_reftypes(self):
         return self.refmap.keys()
 
     def has_references(self, oid, reftype=None):
         if reftype is None: # any reference type
-            for reftype, refset in self.refmap.items():
+            if self.oid_to_reftypes is None:
+                items = self.refmap.items()
+            else:
+                items = [
+                    (reftype, self.refmap.get(reftype)) for reftype in
+                    self.oid_to_reftypes.get(oid, ())
+                    ]
+            for reftype, refset in items:
+                if refset is None:
+                    continue
                 if refset.is_target(oid) or refset.is_source(oid):
                     return True
             return False
@@ -660,11 +2486,86 @@ class ListSet(PersistentList):
     def __repr__(self):
         return '<ListSet: %s>' % PersistentList.__repr__(self)
 
+class OrderedTreeSet(Persistent):
+    """ An ordered set of oids.  Like a ``ListSet``, its ``insert`` method
+    appends a value unless it is already present, and it supports the
+    Python sequence protocol.  Unlike a ``ListSet``, the values are kept in
+    BTrees: membership tests, insertion and removal take logarithmic time, a
+    change rewrites only the buckets it touches rather than the whole set,
+    and indexing or slicing walks the buckets without building a list of
+    every value."""
+
+    family = BTrees.family64
+
+    def __init__(self, values=()):
+        self._order = self.family.IO.BTree() # position -> value
+        self._positions = self.family.OI.BTree() # value -> position
+        self._length = Length()
+        self.update(values)
+
+    def insert(self, val):
+        if val in self._positions:
+            return False
+        position = self._order.maxKey() + 1 if self._order else 0
+        self._order[position] = val
+        self._positions[val] = position
+        self._length.change(1)
+        return True
+
+    def update(self, values):
+        return len([ val for val in values if self.insert(val) ])
+
+    def remove(self, val):
+        position = self._positions.pop(val) # raises KeyError if missing
+        del self._order[position]
+        self._length.change(-1)
+
+    def __contains__(self, val):
+        return val in self._positions
+
+    def __len__(self):
+        return self._length()
+
+    def __iter__(self):
+        return iter(self._order.values())
+
+    def __getitem__(self, i):
+        values = self._order.values()
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return list(values[start:stop])[::step]
+            return list(values[start:stop])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return values[i]
+
+    def __eq__(self, other):
+        # compares equal to a list or ListSet with the same values, in the
+        # same order, like a ListSet does
+        if isinstance(other, (list, tuple, OrderedTreeSet)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return '<OrderedTreeSet: %s>' % list(self)
+
+def _is_ordered(oids):
+    return isinstance(oids, (ListSet, OrderedTreeSet))
+
 class ReferenceSet(Persistent):
 
     family = BTrees.family64
     oidset_class = BTrees.family64.OO.TreeSet
-    oidlist_class = ListSet
+    oidlist_class = OrderedTreeSet
 
     def __init__(self):
         self.src2target = self.family.OO.BTree()
@@ -691,6 +2592,45 @@ class ReferenceSet(Persistent):
             except KeyError:
                 pass
 
+    def _group(self, pairs):
+        # map each source to its targets and each target to its sources,
+        # keeping the order in which they appear in ``pairs``
+        targets = {}
+        sources = {}
+        for source, target in pairs:
+            targets.setdefault(source, []).append(target)
+            sources.setdefault(target, []).append(source)
+        return targets, sources
+
+    def _insert_many(self, tree, grouped):
+        for oid, values in grouped.items():
+            oids = tree.get(oid)
+            if oids is None:
+                oids = tree[oid] = self.oidset_class()
+            if isinstance(oids, ListSet): # b/c
+                for value in values:
+                    oids.insert(value)
+            else:
+                oids.update(values)
+
+    def _remove_many(self, tree, grouped):
+        for oid, values in grouped.items():
+            oids = tree.get(oid)
+            if oids is not None:
+                for value in values:
+                    if value in oids:
+                        oids.remove(value)
+
+    def connect_many(self, pairs):
+        targets, sources = self._group(pairs)
+        self._insert_many(self.src2target, targets)
+        self._insert_many(self.target2src, sources)
+
+    def disconnect_many(self, pairs):
+        targets, sources = self._group(pairs)
+        self._remove_many(self.src2target, targets)
+        self._remove_many(self.target2src, sources)
+
     def targetids(self, oid):
         return self.src2target.get(oid, self.oidset_class())
 
@@ -704,7 +2644,8 @@ class ReferenceSet(Persistent):
         return oid in self.src2target
 
     def remove(self, oidset):
-        # XXX is there a way to make this less expensive?
+        # NB: ReferenceMap.remove only passes the oids which its
+        # oid_to_reftypes index says may be mentioned by this reference set
         removed = self.family.OO.Set()
         for oid in oidset:
             if oid in self.src2target:
@@ -730,7 +2671,7 @@ class ReferenceSet(Persistent):
             order = []
         oids = self.src2target.get(source, self.oidset_class())
         if order is None:
-            if isinstance(oids, self.oidlist_class):
+            if _is_ordered(oids):
                 # if it's ordered, we unset the order by changing the
                 # class of the oid set to OOTreeSet
                 oids = self.oidset_class(oids)
@@ -745,10 +2686,10 @@ class ReferenceSet(Persistent):
                     'any others.  Order: %s vs. oids %s' % (
                         order, list(oids))
                     )
-            newoids = self.oidlist_class(order)
-            if newoids != oids: # prevent an unnecessary database write
-                self.src2target[source] = newoids
-                oids = newoids
+            # prevent an unnecessary database write
+            if not _is_ordered(oids) or list(oids) != list(order):
+                oids = self.oidlist_class(order)
+                self.src2target[source] = oids
         return oids
 
     def order_sources(self, target, order=_marker):
@@ -756,7 +2697,7 @@ class ReferenceSet(Persistent):
             order = []
         oids = self.target2src.get(target, self.oidset_class())
         if order is None:
-            if isinstance(oids, self.oidlist_class):
+            if _is_ordered(oids):
                 # if it's ordered, we unset the order by changing the
                 # class of the oid set to OOTreeSet
                 oids = self.oidset_class(oids)
@@ -771,10 +2712,10 @@ class ReferenceSet(Persistent):
                     'any others.  Order: %s vs. oids %s' % (
                         order, list(oids))
                     )
-            newoids = self.oidlist_class(order)
-            if newoids != oids: # prevent an unnecessary database write
-                self.target2src[target] = newoids
-                oids = newoids
+            # prevent an unnecessary database write
+            if not _is_ordered(oids) or list(oids) != list(order):
+                oids = self.oidlist_class(order)
+                self.target2src[target] = oids
         return oids
 
 def _reference_property(reftype, resolve, orientation='source'):
@@ -1077,22 +3018,40 @@ class Multireference(object):
         self.orientation = orientation
         self.ordered = ordered
 
-    def get_oids(self):
+    def get_oids(self, copy=True):
+        """ Return the oids of the objects in this multireference.  If
+        ``copy`` is false, return the reference map's own set of oids
+        instead of a copy of it; it must then not be iterated over while the
+        reference is changed."""
+        if copy:
+            if self.orientation == 'source':
+                return self.objectmap.targetids(self.context, self.reftype)
+            return self.objectmap.sourceids(self.context, self.reftype)
+        ctx_oid = get_oid(self.context)
+        referencemap = self.objectmap.referencemap
         if self.orientation == 'source':
-            oids = self.objectmap.targetids(self.context, self.reftype)
-        else:
-            oids = self.objectmap.sourceids(self.context, self.reftype)
-        return oids
+            return referencemap.targetids(ctx_oid, self.reftype)
+        return referencemap.sourceids(ctx_oid, self.reftype)
 
     def __nonzero__(self):
         """ Returns ``True`` if there are oids associated with this
         multireference, ``False`` if the oid list is empty. """
-        return bool(self.get_oids())
+        return bool(self.get_oids(copy=False))
+
+    __bool__ = __nonzero__
 
     def __getitem__(self, i):
-        """ Return the i'th element from the sequence of objects or object
-        ids"""
-        oid = self.get_oids()[i] # will barf if oids is not a ListSet
+        """ Return the i'th element (or, if ``i`` is a slice, a list of the
+        elements) from the sequence of objects or object ids"""
+        oids = self.get_oids(copy=False)
+        if not _is_ordered(oids) and hasattr(oids, 'keys'):
+            oids = oids.keys() # tree sets are indexable through their keys
+        if isinstance(i, slice):
+            oids = list(oids[i])
+            if self.resolve:
+                return list(self.objectmap.object_for_many(oids))
+            return oids
+        oid = oids[i]
         if self.resolve:
             return self.objectmap.object_for(oid)
         return oid
@@ -1101,12 +3060,10 @@ class Multireference(object):
         """ Return ``True`` if ``other`` is a member of the sequence managed
         by this multireference. """
         if self.resolve:
-            object_for = self.objectmap.object_for
-            for oid in self.get_oids():
-                if object_for(oid) == other:
-                    return True
-            return False
-        return other in self.get_oids()
+            other = get_oid(other, None)
+            if other is None:
+                return False
+        return other in self.get_oids(copy=False)
 
     def __iter__(self):
         """ Return an iterable of object ids or objects. """
@@ -1118,7 +3075,7 @@ class Multireference(object):
     def __len__(self):
         """ Return the length of the sequence of objects implied by this
         multireference"""
-        return len(self.get_oids())
+        return len(self.get_oids(copy=False))
 
     def set_ordered(self, ctx_oid):
         # intent: the below logic will be called, but it won't cause a write
@@ -1146,16 +3103,8 @@ class Multireference(object):
             self.set_unordered(ctx_oid)
         if ignore_missing is None:
             ignore_missing = self.ignore_missing
-        for obj in objects:
-            oid = get_oid(obj, obj)
-            try:
-                if self.orientation == 'source':
-                    self.objectmap.connect(ctx_oid, oid, self.reftype)
-                else:
-                    self.objectmap.connect(oid, ctx_oid, self.reftype)
-            except ValueError:
-                if not ignore_missing:
-                    raise
+        self.objectmap.connect_many(
+            self._pairs(ctx_oid, objects), self.reftype, ignore_missing)
 
     def disconnect(self, objects, ignore_missing=None):
         """ Disconnect ``objects`` from this reference's relationship.
@@ -1168,16 +3117,14 @@ class Multireference(object):
             self.set_ordered(ctx_oid)
         else:
             self.set_unordered(ctx_oid)
-        for obj in objects:
-            oid = get_oid(obj, obj)
-            try:
-                if self.orientation == 'source':
-                    self.objectmap.disconnect(ctx_oid, oid, self.reftype)
-                else:
-                    self.objectmap.disconnect(oid, ctx_oid, self.reftype)
-            except ValueError:
-                if not ignore_missing:
-                    raise
+        self.objectmap.disconnect_many(
+            self._pairs(ctx_oid, objects), self.reftype, ignore_missing)
+
+    def _pairs(self, ctx_oid, objects):
+        oids = [ get_oid(obj, obj) for obj in objects ]
+        if self.orientation == 'source':
+            return [ (ctx_oid, oid) for oid in oids ]
+        return [ (oid, ctx_oid) for oid in oids ]
 
     def clear(self):
         """ Clear all references in this relationship. """
@@ -1207,6 +3154,94 @@ class _ReferencedPredicate(object):
     def __call__(self, context, request):
         return self.has_references(context) == self.val
 
+def _request_objectmap(request=None):
+    # the objectmap of the root of ``request`` (or of the current request),
+    # which, unlike ``find_objectmap``, is found without loading a lineage
+    if request is None:
+        request = get_current_request()
+    root = getattr(request, 'root', None)
+    return getattr(root, '__objectmap__', None)
+
+def _seated_path_tuple(objectmap, resource):
+    oid = get_oid(resource, None)
+    parent = getattr(resource, '__parent__', None)
+    if oid is None or parent is None:
+        return None
+    path_tuple = objectmap.path_for(oid)
+    if path_tuple is None or len(path_tuple) < 2:
+        return None
+    # the objectmap may lag behind the tree (e.g. while the resource is being
+    # moved), and a copy of a resource bears the oid of its original until it
+    # is added, so the path is only trusted if the resource sits in the
+    # parent which the objectmap expects under the name it expects
+    if path_tuple[-1] != resource.__name__:
+        return None
+    if get_oid(parent, None) != objectmap.objectid_for(path_tuple[:-1]):
+        return None
+    return path_tuple
+
+def get_path_tuple(resource, objectmap=None):
+    """ Return the path tuple of ``resource``, as
+    :func:`pyramid.traversal.resource_path_tuple` does.  If the resource is
+    seated in ``objectmap``, its path is read from the objectmap rather than
+    computed from its lineage, so no ancestor but its parent is loaded.  If
+    ``objectmap`` is ``None``, the objectmap of the root of the current
+    request (if any) is used."""
+    if objectmap is None:
+        objectmap = _request_objectmap()
+    if objectmap is not None:
+        path_tuple = _seated_path_tuple(objectmap, resource)
+        if path_tuple is not None:
+            return path_tuple
+    return resource_path_tuple(resource)
+
+def _join_path_tuple(path_tuple):
+    return _SLASH.join([ quote_path_segment(x) for x in path_tuple ]) or _SLASH
+
+def get_path(resource, objectmap=None):
+    """ Return the path of ``resource`` as a string, as
+    :func:`pyramid.traversal.resource_path` does, reading it from the
+    objectmap when possible (see :func:`get_path_tuple`)."""
+    return _join_path_tuple(get_path_tuple(resource, objectmap))
+
+@implementer(IResourceURL)
+class ResourceURL(object):
+    """ A Pyramid resource URL adapter which computes the path of a resource
+    with :func:`get_path_tuple`, so generating the URL of a seated resource
+    (e.g. with ``request.resource_url`` or ``request.sdiapi.mgmt_path``)
+    doesn't load all of its ancestors.  It otherwise behaves like
+    :class:`pyramid.traversal.ResourceURL`, including its virtual root
+    handling."""
+    VH_ROOT_KEY = VH_ROOT_KEY
+
+    def __init__(self, resource, request):
+        physical_path_tuple = get_path_tuple(
+            resource, _request_objectmap(request))
+        physical_path = _join_path_tuple(physical_path_tuple)
+
+        if physical_path_tuple != (_BLANK,):
+            physical_path_tuple = physical_path_tuple + (_BLANK,)
+            physical_path = physical_path + _SLASH
+
+        virtual_path = physical_path
+        virtual_path_tuple = physical_path_tuple
+
+        vroot_path = request.environ.get(self.VH_ROOT_KEY)
+
+        # if the physical path starts with the virtual root path, trim it out
+        # of the virtual path
+        if vroot_path is not None:
+            vroot_path = vroot_path.rstrip(_SLASH)
+            if vroot_path and physical_path.startswith(vroot_path):
+                numels = len(vroot_path.split(_SLASH))
+                virtual_path_tuple = (_BLANK,) + physical_path_tuple[numels:]
+                virtual_path = physical_path[len(vroot_path):]
+
+        self.virtual_path = virtual_path
+        self.physical_path = physical_path
+        self.virtual_path_tuple = virtual_path_tuple
+        self.physical_path_tuple = physical_path_tuple
+
 @subscribe_will_be_removed()
 def referential_integrity(event):
     if event.moving is not None: # being moved
@@ -1217,27 +3252,41 @@ def referential_integrity(event):
     if objectmap is None:
         return
 
-    reftypes = list(objectmap.get_reftypes())
-
-    for oid in event.removed_oids:
+    # look up the integrity constraints once per removal rather than once
+    # per removed oid
+    constraints = []
+    for reftype in objectmap.get_reftypes():
+        if IInterface.providedBy(reftype):
+            source_integrity = reftype.queryTaggedValue(
+                'source_integrity', False)
+            target_integrity = reftype.queryTaggedValue(
+                'target_integrity', False)
+            if source_integrity or target_integrity:
+                constraints.append(
+                    (reftype, source_integrity, target_integrity))
+
+    if not constraints:
+        return
 
-        for reftype in reftypes:
+    removed_oids = objectmap.family.OO.Set(event.removed_oids)
 
-            is_iface = IInterface.providedBy(reftype)
+    for reftype, source_integrity, target_integrity in constraints:
 
-            if is_iface and reftype.queryTaggedValue('source_integrity', False):
-                targetids = objectmap.targetids(oid, reftype)
-                if oid in targetids:
-                    targetids.remove(oid) # self-referential
+        if source_integrity:
+            for oid, targetids in objectmap.referencemap.references_among(
+                    removed_oids, reftype, 'targets'):
+                targetids = objectmap.family.OO.Set(
+                    [ x for x in targetids if x != oid ]) # self-referential
                 if targetids:
                     # object is a source
                     obj = objectmap.object_for(oid)
                     raise SourceIntegrityError(obj, reftype, targetids)
 
-            if is_iface and reftype.queryTaggedValue('target_integrity', False):
-                sourceids = objectmap.sourceids(oid, reftype)
-                if oid in sourceids:
-                    sourceids.remove(oid) # self-referential
+        if target_integrity:
+            for oid, sourceids in objectmap.referencemap.references_among(
+                    removed_oids, reftype, 'sources'):
+                sourceids = objectmap.family.OO.Set(
+                    [ x for x in sourceids if x != oid ]) # self-referential
                 if sourceids:
                     # object is a target
                     obj = objectmap.object_for(oid)
@@ -1287,5 +3336,6 @@ class TargetIntegrityError(ReferentialIntegrityError):
 
 def includeme(config): # pragma: no cover
     config.add_view_predicate('referenced', _ReferencedPredicate)
+    config.add_resource_url_adapter(ResourceURL)
     config.include('.evolve')
 
@@ -1,11 +1,17 @@
 from logging import getLogger
 
 import BTrees
+from pyramid.settings import asbool
 
 from ..util import (
     get_acl,
     postorder,
     )
+from . import (
+    DocidAllocator,
+    ListSet,
+    encode_path,
+    )
 
 _SLASH = '/'
 
@@ -28,6 +34,8 @@ def treesetify_objectmap_pathindex(root, registry): # pragma: no cover
     # to avoid having huge pickles
     objectmap = root.__objectmap__
     pathindex = objectmap.pathindex
+    if pathindex is None: # range-scan objectmap
+        return
     for path, not_treesets in list(pathindex.items()):
         for d, not_treeset in list(not_treesets.items()):
             treeset = objectmap.family.IF.TreeSet(not_treeset)
@@ -60,10 +68,130 @@ def add_path_to_acl_to_objectmap(root, registry):
             suffix = '(indexed acl)'
         logger.info('%s %s' % (upath, suffix))
 
+def add_oid_to_reftypes_to_referencemap(root, registry):
+    """ Build the ``oid_to_reftypes`` index of the objectmap's reference
+    map, which lets ``remove`` and ``has_references`` skip the reference
+    types an oid takes no part in."""
+    objectmap = root.__objectmap__
+    referencemap = objectmap.referencemap
+    logger.info('Building oid_to_reftypes index of objectmap referencemap')
+    referencemap.rebuild_index()
+
+def treeify_ordered_referencesets(root, registry):
+    """ Convert the ``ListSet`` values of ordered references into
+    ``OrderedTreeSet`` values, so that changing a large ordered reference no
+    longer rewrites every oid in it."""
+    objectmap = root.__objectmap__
+    refmap = objectmap.referencemap.refmap
+    logger.info('Converting ordered objectmap references to OrderedTreeSets')
+    for refset in refmap.values():
+        for tree in (refset.src2target, refset.target2src):
+            for oid, oidset in list(tree.items()):
+                if isinstance(oidset, ListSet):
+                    tree[oid] = refset.oidlist_class(oidset)
+
+def add_pathcounts_to_objectmap(root, registry):
+    """ Count the oids in each level set of the objectmap's pathindex into
+    ``pathcounts``, which ``pathcount`` then reads instead of counting the
+    level sets."""
+    objectmap = root.__objectmap__
+    if objectmap.pathindex is None or objectmap.pathcounts is not None:
+        return
+    logger.info('Populating pathcounts in objectmap')
+    objectmap.pathcounts = objectmap.family.OO.BTree()
+    for path_tuple, omap in objectmap.pathindex.items():
+        for level, oidset in omap.items():
+            objectmap._count(path_tuple, level, len(oidset))
+
+def add_extent_lengths_to_extentmap(root, registry):
+    """ Count the oids of each extent of the objectmap (and of its shards)
+    into ``extent_lengths``, which ``extent_count`` then reads instead of
+    counting the extents."""
+    objectmap = root.__objectmap__
+    objectmaps = [ objectmap ] + list((objectmap.shards or {}).values())
+    for omap in objectmaps:
+        if omap.extentmap.extent_lengths is None:
+            logger.info('Populating extent_lengths in objectmap extentmap')
+            omap.extentmap.rebuild_lengths()
+
+def rangescan_objectmap_pathindex(root, registry):
+    """ Drop the objectmap's pathindex; path lookups will thereafter be
+    answered by range scans over ``path_to_objectid``.  Only registered when
+    the ``substanced.objectmap.rangescan`` setting is true."""
+    objectmap = root.__objectmap__
+    if objectmap.pathindex is not None:
+        logger.info('Dropping objectmap pathindex in favor of range scans')
+        objectmap.pathindex = None
+        objectmap.pathcounts = None
+
+def compact_objectmap_paths(root, registry):
+    """ Rewrite the keys of ``path_to_objectid`` and the values of
+    ``objectid_to_path`` as compact bytestrings.  Only registered when the
+    ``substanced.objectmap.compact_paths`` setting is true."""
+    objectmap = root.__objectmap__
+    if objectmap.compact_paths:
+        return
+    logger.info('Compacting objectmap paths')
+    oobtree = objectmap.family.OO.BTree
+    path_to_objectid = oobtree()
+    objectid_to_path = oobtree()
+    for path_tuple, oid in objectmap.path_to_objectid.items():
+        key = encode_path(path_tuple)
+        path_to_objectid[key] = oid
+        objectid_to_path[oid] = key
+    objectmap.path_to_objectid = path_to_objectid
+    objectmap.objectid_to_path = objectid_to_path
+    objectmap.compact_paths = True
+
+def add_objectid_to_object_to_objectmap(root, registry):
+    """ Keep a reference to every persistent object in the objectmap so that
+    ``object_for`` needn't traverse.  Only registered when the
+    ``substanced.objectmap.objectrefs`` setting is true."""
+    objectmap = root.__objectmap__
+    if objectmap.objectid_to_object is not None:
+        return
+    objectmap.objectid_to_object = objectmap.family.IO.BTree()
+    logger.info('Populating objectid_to_object in objectmap')
+    for obj in postorder(root):
+        oid = objectmap.objectid_for(obj)
+        if oid is not None:
+            objectmap._add_reference(oid, obj)
+
+def add_docids_to_objectmap(root, registry):
+    """ Give every object in the objectmap (and in its shards) a dense
+    docid.  Only registered when the ``substanced.objectmap.docids`` setting
+    is true."""
+    objectmap = root.__objectmap__
+    if objectmap.docid_allocator is not None:
+        return
+    logger.info('Allocating dense docids in objectmap')
+    objectmap.docid_allocator = DocidAllocator()
+    objectmap.oid_to_docid = objectmap.family.II.BTree()
+    objectmap.docid_to_oid = objectmap.family.II.BTree()
+    objectmap._add_docids(objectmap.objectid_to_path.keys())
+    for shard in (objectmap.shards or {}).values():
+        shard.docid_allocator = objectmap.docid_allocator
+        shard.oid_to_docid = objectmap.oid_to_docid
+        shard.docid_to_oid = objectmap.docid_to_oid
+        shard._add_docids(shard.objectid_to_path.keys())
+
 def includeme(config): # pragma: no cover
     config.add_evolution_step(oobtreeify_referencemap)
     config.add_evolution_step(oobtreeify_object_to_path)
     config.add_evolution_step(treesetify_objectmap_pathindex)
     config.add_evolution_step(treesetify_referencesets)
     config.add_evolution_step(add_path_to_acl_to_objectmap)
+    config.add_evolution_step(add_oid_to_reftypes_to_referencemap)
+    config.add_evolution_step(treeify_ordered_referencesets)
+    config.add_evolution_step(add_pathcounts_to_objectmap)
+    config.add_evolution_step(add_extent_lengths_to_extentmap)
+    settings = config.registry.settings or {}
+    if asbool(settings.get('substanced.objectmap.rangescan')):
+        config.add_evolution_step(rangescan_objectmap_pathindex)
+    if asbool(settings.get('substanced.objectmap.compact_paths')):
+        config.add_evolution_step(compact_objectmap_paths)
+    if asbool(settings.get('substanced.objectmap.objectrefs')):
+        config.add_evolution_step(add_objectid_to_object_to_objectmap)
+    if asbool(settings.get('substanced.objectmap.docids')):
+        config.add_evolution_step(add_docids_to_objectmap)
     
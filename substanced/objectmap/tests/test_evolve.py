@@ -0,0 +1,262 @@
+import unittest
+
+from persistent import Persistent
+from pyramid import testing
+
+class Test_rangescan_objectmap_pathindex(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import rangescan_objectmap_pathindex
+        return rangescan_objectmap_pathindex(root, registry)
+
+    def test_drops_pathindex(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        objectmap.add(root, ('',))
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(objectmap.pathindex, None)
+        self.assertEqual(objectmap.pathcounts, None)
+        self.assertEqual(list(objectmap.pathlookup(('',))), [root.__oid__])
+
+    def test_already_dropped(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root, pathindex=False)
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(objectmap.pathindex, None)
+
+class Test_compact_objectmap_paths(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import compact_objectmap_paths
+        return compact_objectmap_paths(root, registry)
+
+    def test_compacts_paths(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        objectmap._v_nextid = 1
+        objectmap.add(root, ('',))
+        objectmap.add(testing.DummyResource(), ('', 'a'))
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertTrue(objectmap.compact_paths)
+        self.assertEqual(
+            dict(objectmap.path_to_objectid),
+            {b'\x00':1, b'\x00a\x00':2}
+            )
+        self.assertEqual(
+            dict(objectmap.objectid_to_path),
+            {1:b'\x00', 2:b'\x00a\x00'}
+            )
+        self.assertEqual(objectmap.path_for(2), ('', 'a'))
+        self.assertEqual(objectmap.objectid_for(('', 'a')), 2)
+
+    def test_already_compact(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root, compact_paths=True)
+        objectmap._v_nextid = 1
+        objectmap.add(root, ('',))
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(dict(objectmap.path_to_objectid), {b'\x00':1})
+
+class Test_add_objectid_to_object_to_objectmap(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import add_objectid_to_object_to_objectmap
+        return add_objectid_to_object_to_objectmap(root, registry)
+
+    def test_populates(self):
+        from .. import ObjectMap
+        from ...interfaces import IFolder
+        root = testing.DummyResource(__provides__=IFolder)
+        objectmap = ObjectMap(root)
+        objectmap._v_nextid = 1
+        objectmap.add(root, ('',))
+        persistent = DummyPersistent()
+        persistent.__parent__ = root
+        persistent.__name__ = 'a'
+        root['a'] = persistent
+        objectmap.add(persistent, ('', 'a'))
+        root['b'] = testing.DummyResource()
+        objectmap.add(root['b'], ('', 'b'))
+        root['c'] = testing.DummyResource()
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(
+            dict(objectmap.objectid_to_object), {2:persistent})
+
+    def test_already_populated(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root, objectrefs=True)
+        refs = objectmap.objectid_to_object
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertTrue(objectmap.objectid_to_object is refs)
+
+class Test_add_oid_to_reftypes_to_referencemap(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import add_oid_to_reftypes_to_referencemap
+        return add_oid_to_reftypes_to_referencemap(root, registry)
+
+    def test_builds_index(self):
+        from .. import (
+            ObjectMap,
+            ReferenceMap,
+            ReferenceSet,
+            )
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        refset = ReferenceSet()
+        refset.connect(1, 2)
+        objectmap.referencemap = ReferenceMap({'reftype':refset})
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        index = objectmap.referencemap.oid_to_reftypes
+        self.assertEqual(sorted(index.keys()), [1, 2])
+        self.assertEqual(list(index[1]), ['reftype'])
+
+class Test_treeify_ordered_referencesets(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import treeify_ordered_referencesets
+        return treeify_ordered_referencesets(root, registry)
+
+    def test_converts_listsets(self):
+        from .. import (
+            ListSet,
+            ObjectMap,
+            OrderedTreeSet,
+            ReferenceMap,
+            ReferenceSet,
+            )
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        refset = ReferenceSet()
+        refset.connect(1, 2)
+        refset.src2target[3] = ListSet([5, 4])
+        refset.target2src[4] = ListSet([3])
+        objectmap.referencemap = ReferenceMap({'reftype':refset})
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(refset.src2target[3].__class__, OrderedTreeSet)
+        self.assertEqual(list(refset.src2target[3]), [5, 4])
+        self.assertEqual(refset.target2src[4].__class__, OrderedTreeSet)
+        self.assertEqual(refset.src2target[1].__class__,
+                         refset.oidset_class)
+
+class Test_add_extent_lengths_to_extentmap(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import add_extent_lengths_to_extentmap
+        return add_extent_lengths_to_extentmap(root, registry)
+
+    def test_populates(self):
+        from ...interfaces import IFolder
+        from ...util import get_factory_type
+        from .. import ObjectMap
+        root = testing.DummyResource(__provides__=IFolder)
+        root['a'] = testing.DummyResource(__provides__=IFolder)
+        root['a']['b'] = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add_subtree(root, ('',))
+        shard = objectmap.add_shard(root['a'])
+        objectmap.extentmap.extent_lengths = None
+        shard.extentmap.extent_lengths = None
+        self._callFUT(root, None)
+        self.assertEqual(objectmap.extent_count(get_factory_type(root)), 3)
+        self.assertEqual(shard.extent_count(get_factory_type(root)), 2)
+
+    def test_already_populated(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        lengths = objectmap.extentmap.extent_lengths
+        self._callFUT(root, None)
+        self.assertTrue(objectmap.extentmap.extent_lengths is lengths)
+
+class Test_add_pathcounts_to_objectmap(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import add_pathcounts_to_objectmap
+        return add_pathcounts_to_objectmap(root, registry)
+
+    def test_populates(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add(root, ('',))
+        objectmap.add(testing.DummyResource(), ('', 'a'))
+        objectmap.pathcounts = None
+        self._callFUT(root, None)
+        self.assertEqual(objectmap.pathcount(('',)), 2)
+        self.assertEqual(objectmap.pathcount(('',), 0), 1)
+        self.assertEqual(sorted(objectmap.pathcounts.keys()),
+                         [('',), ('', 'a')])
+
+    def test_already_populated(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        counts = objectmap.pathcounts
+        self._callFUT(root, None)
+        self.assertTrue(objectmap.pathcounts is counts)
+
+    def test_rangescan(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root, pathindex=False)
+        root.__objectmap__ = objectmap
+        self._callFUT(root, None)
+        self.assertEqual(objectmap.pathcounts, None)
+
+class Test_add_docids_to_objectmap(unittest.TestCase):
+    def _callFUT(self, root, registry):
+        from ..evolve import add_docids_to_objectmap
+        return add_docids_to_objectmap(root, registry)
+
+    def test_populates(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add(root, ('',))
+        a = testing.DummyResource()
+        objectmap.add(a, ('', 'a'))
+        self._callFUT(root, None)
+        self.assertEqual(
+            sorted(objectmap.docid_to_oid.keys()), [1, 2])
+        self.assertEqual(
+            objectmap.objectid_for_docid(objectmap.docid_for(a.__oid__)),
+            a.__oid__)
+
+    def test_populates_shards(self):
+        from .. import ObjectMap
+        from ...interfaces import IFolder
+        root = testing.DummyResource()
+        root['t'] = testing.DummyResource(__provides__=IFolder)
+        root['t']['x'] = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add(root, ('',))
+        objectmap.add_subtree(root['t'], ('', 't'))
+        shard = objectmap.add_shard(root['t'])
+        self._callFUT(root, None)
+        self.assertTrue(shard.oid_to_docid is objectmap.oid_to_docid)
+        self.assertEqual(len(objectmap.docid_to_oid), 3)
+
+    def test_already_populated(self):
+        from .. import ObjectMap
+        root = testing.DummyResource()
+        objectmap = ObjectMap(root, docids=True)
+        root.__objectmap__ = objectmap
+        allocator = objectmap.docid_allocator
+        self._callFUT(root, None)
+        self.assertTrue(objectmap.docid_allocator is allocator)
+
+class DummyPersistent(Persistent):
+    pass
@@ -1,6 +1,11 @@
 import sys
 import unittest
-from zope.interface import implementer
+import BTrees
+from persistent import Persistent
+from zope.interface import (
+    alsoProvides,
+    implementer,
+    )
 
 from pyramid import testing
 
@@ -13,6 +18,17 @@ _B = 'b'
 _C = 'c'
 _Z = 'z'
 
+class ObjectMapFactory(object):
+    # ``_makeOne`` for the test cases of an object map: the keyword arguments
+    # update the ``objectmap_options`` of the test case, see make_objectmap
+    objectmap_options = {}
+    nextid = 1
+
+    def _makeOne(self, root=None, **kw):
+        options = dict(self.objectmap_options)
+        options.update(kw)
+        return make_objectmap(root, nextid=self.nextid, **options)
+
 class TestObjectMap(unittest.TestCase):
     def setUp(self):
         self.config = testing.setUp()
@@ -200,6 +216,130 @@ class TestObjectMap(unittest.TestCase):
         inst = self._makeOne()
         self.assertRaises(AttributeError, inst.add, 'a', (_BLANK,))
 
+    def _makeTree(self):
+        from ...interfaces import IFolder
+        top = testing.DummyResource(__provides__=IFolder)
+        sub = top['sub'] = testing.DummyResource(__provides__=IFolder)
+        sub['leaf'] = testing.DummyResource()
+        sub['leaf'].__acl__ = [('Allow', 'fred', 'view')]
+        top['other'] = testing.DummyResource()
+        top['other'].__factory_type__ = 'other'
+        return top
+
+    def _dump(self, inst):
+        pathindex = dict(
+            (path, dict((level, list(oids)) for level, oids in omap.items()))
+            for path, omap in inst.pathindex.items()
+            )
+        extents = dict(
+            (name, list(oids))
+            for name, oids in inst.extentmap.extent_to_oids.items()
+            )
+        rextents = dict(
+            (oid, list(names))
+            for oid, names in inst.extentmap.oid_to_extents.items()
+            )
+        return (
+            dict(inst.path_to_objectid),
+            dict(inst.objectid_to_path),
+            dict(inst.path_to_acl),
+            pathindex,
+            extents,
+            rextents,
+            )
+
+    def test_add_subtree_not_a_path_tuple(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.add_subtree, None, None)
+
+    def test_add_subtree_moving_and_duplicating(self):
+        inst = self._makeOne()
+        obj = testing.DummyResource()
+        self.assertRaises(ValueError, inst.add_subtree,
+                          obj, (_BLANK,), True, True)
+
+    def test_add_subtree_same_as_add(self):
+        inst = self._makeOne()
+        inst._v_nextid = 1
+        inst.add(testing.DummyResource(), (_BLANK,))
+        top = self._makeTree()
+        inst.add(top['other'], (_BLANK, _A, 'other'))
+        inst.add(top['sub']['leaf'], (_BLANK, _A, 'sub', 'leaf'))
+        inst.add(top['sub'], (_BLANK, _A, 'sub'))
+        inst.add(top, (_BLANK, _A))
+        expected = self._dump(inst)
+
+        inst2 = self._makeOne()
+        inst2._v_nextid = 1
+        inst2.add(testing.DummyResource(), (_BLANK,))
+        result = inst2.add_subtree(self._makeTree(), (_BLANK, _A))
+        self.assertEqual(result, inst2.objectid_for((_BLANK, _A)))
+        self.assertEqual(self._dump(inst2), expected)
+
+    def test_add_subtree_existing_oids(self):
+        inst = self._makeOne()
+        top = self._makeTree()
+        top.__oid__ = 10
+        top['sub'].__oid__ = 11
+        inst._v_nextid = 1
+        inst.add_subtree(top, (_BLANK,))
+        self.assertEqual(inst.objectid_for((_BLANK,)), 10)
+        self.assertEqual(inst.objectid_for((_BLANK, 'sub')), 11)
+        self.assertEqual(inst.objectid_for((_BLANK, 'other')), 1)
+        self.assertEqual(inst.objectid_for((_BLANK, 'sub', 'leaf')), 2)
+
+    def test_add_subtree_duplicating(self):
+        inst = self._makeOne()
+        top = self._makeTree()
+        top.__oid__ = 10
+        inst.objectid_to_path[10] = (_BLANK, _Z)
+        inst._v_nextid = 1
+        inst.add_subtree(top, (_BLANK,), duplicating=True)
+        self.assertEqual(top.__oid__, 4)
+        self.assertEqual(inst.objectid_for((_BLANK, 'sub', 'leaf')), 2)
+
+    def test_add_subtree_moving(self):
+        inst = self._makeOne()
+        inst._v_nextid = 1
+        inst.add_subtree(self._makeTree(), (_BLANK,), moving=True)
+        self.assertEqual(len(inst.path_to_objectid), 4)
+        self.assertEqual(dict(inst.extentmap.extent_to_oids), {})
+
+    def test_add_subtree_oid_already_in_objectid_to_path(self):
+        inst = self._makeOne()
+        top = self._makeTree()
+        top['sub']['leaf'].__oid__ = 1
+        top.__oid__ = 2
+        inst.objectid_to_path[2] = True
+        inst._v_nextid = 5
+        self.assertRaises(ValueError, inst.add_subtree, top, (_BLANK,))
+        self.assertEqual(dict(inst.path_to_objectid), {})
+        self.assertFalse(hasattr(top['other'], '__oid__'))
+
+    def test_add_subtree_oid_repeated_in_subtree(self):
+        inst = self._makeOne()
+        top = self._makeTree()
+        top['sub'].__oid__ = 1
+        top['other'].__oid__ = 1
+        self.assertRaises(ValueError, inst.add_subtree, top, (_BLANK,))
+
+    def test_add_subtree_path_already_in_path_to_objectid(self):
+        inst = self._makeOne()
+        inst.path_to_objectid[(_BLANK, 'sub')] = 1
+        self.assertRaises(
+            ValueError, inst.add_subtree, self._makeTree(), (_BLANK,))
+
+    def test_add_subtree_rangescan(self):
+        from .. import ObjectMap
+        inst = ObjectMap(DummyRoot(), pathindex=False)
+        inst._v_nextid = 1
+        inst.add_subtree(self._makeTree(), (_BLANK,))
+        self.assertEqual(inst.pathindex, None)
+        self.assertEqual(
+            sorted(inst.pathlookup((_BLANK,), include_origin=False)),
+            [1, 2, 3]
+            )
+
     def test_remove_not_an_int_or_tuple(self):
         inst = self._makeOne()
         self.assertRaises(ValueError, inst.remove, 'a')
@@ -373,6 +513,98 @@ class TestObjectMap(unittest.TestCase):
         result = inst.navgen(a, 0)
         self.assertEqual(result, [])
 
+    def _populate_nav(self, inst):
+        for path in '/', '/a', '/a/b', '/a/b/c', '/a/d', '/z':
+            thing = resource(path)
+            inst.add(thing, thing.path_tuple)
+
+    def test_navchildren_bad_obj_or_path_tuple(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.navchildren, None)
+
+    def test_navchildren_notexist(self):
+        inst = self._makeOne()
+        self.assertEqual(list(inst.navchildren((_BLANK,))), [])
+
+    def test_navchildren(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        result = list(inst.navchildren((_BLANK,)))
+        self.assertEqual(
+            result,
+            [{'path': (_BLANK, _A),
+              'name':_A,
+              'oid':inst.objectid_for((_BLANK, _A)),
+              'count':2,
+              'children':None},
+             {'path': (_BLANK, _Z),
+              'name':_Z,
+              'oid':inst.objectid_for((_BLANK, _Z)),
+              'count':0,
+              'children':None}]
+            )
+
+    def test_navchildren_nocounts(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        result = list(inst.navchildren((_BLANK,), counts=False))
+        self.assertEqual([x['count'] for x in result], [None, None])
+
+    def test_navchildren_limit_and_after(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        result = list(inst.navchildren((_BLANK,), limit=1))
+        self.assertEqual([x['name'] for x in result], [_A])
+        result = list(inst.navchildren((_BLANK,), limit=1, after=_A))
+        self.assertEqual([x['name'] for x in result], [_Z])
+        result = list(inst.navchildren((_BLANK,), limit=1, after=_Z))
+        self.assertEqual(result, [])
+
+    def test_navchildren_expand(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        result = list(
+            inst.navchildren((_BLANK,), expand=[(_BLANK, _A, _B), (_BLANK, _A)])
+            )
+        self.assertEqual(result[1]['children'], None)
+        a_children = list(result[0]['children'])
+        self.assertEqual([x['name'] for x in a_children], [_B, 'd'])
+        b_children = list(a_children[0]['children'])
+        self.assertEqual([x['path'] for x in b_children], [(_BLANK, _A, _B, _C)])
+        self.assertEqual(a_children[1]['children'], None)
+
+    def test_navchildren_is_lazy(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        result = inst.navchildren((_BLANK,))
+        inst.remove((_BLANK, _Z))
+        self.assertEqual([x['name'] for x in result], [_A])
+
+    def test_navchildren_ordered(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        folder = Dummy()
+        folder.is_ordered = lambda: True
+        folder.keys = lambda: ('d', 'missing', _B)
+        inst.object_for = lambda path_tuple: folder
+        result = list(inst.navchildren((_BLANK, _A), ordered=True))
+        self.assertEqual([x['name'] for x in result], ['d', _B])
+        self.assertEqual(result[1]['oid'], inst.objectid_for((_BLANK, _A, _B)))
+        result = list(inst.navchildren((_BLANK, _A), ordered=True, after='d'))
+        self.assertEqual([x['name'] for x in result], [_B])
+        self.assertRaises(
+            ValueError, list,
+            inst.navchildren((_BLANK, _A), ordered=True, after='nope'))
+
+    def test_navchildren_ordered_folder_not_ordered(self):
+        inst = self._makeOne()
+        self._populate_nav(inst)
+        folder = Dummy()
+        folder.is_ordered = lambda: False
+        inst.object_for = lambda path_tuple: folder
+        result = list(inst.navchildren((_BLANK, _A), ordered=True))
+        self.assertEqual([x['name'] for x in result], [_B, 'd'])
+
     def test_get_extent(self):
         inst = self._makeOne()
         root = resource('/')
@@ -395,6 +627,13 @@ class TestObjectMap(unittest.TestCase):
         result = inst.get_extent('pyramid.testing.DummyResource', None)
         self.assertEqual(result, None)
 
+    def test_extent_count(self):
+        inst = self._makeOne()
+        for thing in resource('/'), resource('/a'):
+            inst.add(thing, thing.path_tuple)
+        self.assertEqual(inst.extent_count('pyramid.testing.DummyResource'), 2)
+        self.assertEqual(inst.extent_count('nope'), 0)
+
     def test_set_acl(self):
         inst = self._makeOne()
         inst.set_acl((_BLANK,), [('Allow', 'fred', 'view')])
@@ -469,7 +708,62 @@ class TestObjectMap(unittest.TestCase):
         inst.path_to_acl[(_BLANK,)] = (('Allow', 'fred', 'read'),)
         result = inst.allowed(oids, 'fred', 'view')
         self.assertEqual(list(result), [])
-        
+
+    def test_allowed_first_matching_principal_wins(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.path_to_acl[(_BLANK,)] = (
+            ('Deny', 'group:b', 'view'),
+            ('Allow', 'fred', 'view'),
+            )
+        result = inst.allowed([1], ['fred', 'group:b'], 'view')
+        self.assertEqual(list(result), [])
+        result = inst.allowed([1], ['fred'], 'view')
+        self.assertEqual(list(result), [1])
+
+    def test_allowed_all_permissions(self):
+        from pyramid.security import ALL_PERMISSIONS
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK, '1')
+        inst.objectid_to_path[2] = (_BLANK, '2')
+        inst.path_to_acl[(_BLANK, '1')] = (('Deny', 'fred', ALL_PERMISSIONS),)
+        inst.path_to_acl[(_BLANK,)] = (('Allow', 'fred', ALL_PERMISSIONS),)
+        result = inst.allowed([1, 2], ('fred',), 'view')
+        self.assertEqual(list(result), [2])
+
+    def test_allowed_memoizes_ancestor_decisions(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK, _A)
+        for oid in range(2, 12):
+            inst.objectid_to_path[oid] = (_BLANK, _A, str(oid))
+        inst.path_to_acl[(_BLANK,)] = (('Allow', 'fred', 'view'),)
+        inst.path_to_acl[(_BLANK, _A, '5')] = (('Deny', 'fred', 'view'),)
+        lookups = []
+        path_to_acl = inst.path_to_acl
+        class Recorder(object):
+            def get(self, path_tuple):
+                lookups.append(path_tuple)
+                return path_to_acl.get(path_tuple)
+        inst.path_to_acl = Recorder()
+        result = list(inst.allowed(range(1, 12), ('fred',), 'view'))
+        self.assertEqual(result, [1, 2, 3, 4, 6, 7, 8, 9, 10, 11])
+        self.assertEqual(lookups.count((_BLANK, _A)), 1)
+        self.assertEqual(lookups.count((_BLANK,)), 1)
+
+    def test_allowed_with_cache(self):
+        from .. import AllowedCache
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK, _A)
+        inst.path_to_acl[(_BLANK,)] = (('Allow', 'fred', 'view'),)
+        cache = AllowedCache()
+        self.assertEqual(list(inst.allowed([1], 'fred', 'view', cache)), [1])
+        # a stale cache entry is used...
+        inst.path_to_acl[(_BLANK,)] = (('Deny', 'fred', 'view'),)
+        self.assertEqual(list(inst.allowed([1], 'fred', 'view', cache)), [1])
+        # ...until set_acl is called
+        inst.set_acl((_BLANK,), (('Deny', 'fred', 'view'),))
+        self.assertEqual(list(inst.allowed([1], 'fred', 'view', cache)), [])
+
     def test_functional(self):
 
         def l(path, depth=None, include_origin=True):
@@ -694,6 +988,49 @@ class TestObjectMap(unittest.TestCase):
         inst.disconnect(one, two, 'ref')
         self.assertTrue('ref' not in inst.referencemap)
 
+    def test_connect_many(self):
+        one = testing.DummyResource(__oid__=1)
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_path[2] = (_BLANK, _A)
+        inst.objectid_to_path[3] = (_BLANK, _B)
+        inst.connect_many([(one, 2), (1, 3), (3, 2)], 'ref')
+        self.assertEqual(sorted(inst.targetids(1, 'ref')), [2, 3])
+        self.assertEqual(sorted(inst.sourceids(2, 'ref')), [1, 3])
+
+    def test_connect_many_missing(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_path[2] = (_BLANK, _A)
+        self.assertRaises(
+            ValueError, inst.connect_many, [(1, 2), (1, 3)], 'ref')
+        self.assertEqual(list(inst.targetids(1, 'ref')), [])
+
+    def test_connect_many_missing_ignore_missing(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_path[2] = (_BLANK, _A)
+        inst.connect_many([(1, 2), (1, 3), (4, 2)], 'ref', ignore_missing=True)
+        self.assertEqual(list(inst.targetids(1, 'ref')), [2])
+        self.assertEqual(list(inst.sourceids(2, 'ref')), [1])
+
+    def test_disconnect_many(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_path[2] = (_BLANK, _A)
+        inst.objectid_to_path[3] = (_BLANK, _B)
+        inst.connect_many([(1, 2), (1, 3)], 'ref')
+        inst.disconnect_many([(1, 2), (3, 2)], 'ref')
+        self.assertEqual(list(inst.targetids(1, 'ref')), [3])
+        self.assertEqual(list(inst.sourceids(2, 'ref')), [])
+
+    def test_disconnect_many_missing(self):
+        inst = self._makeOne()
+        inst.objectid_to_path[1] = (_BLANK,)
+        self.assertRaises(
+            ValueError, inst.disconnect_many, [(1, 2)], 'ref')
+        inst.disconnect_many([(1, 2)], 'ref', ignore_missing=True)
+
     def test__oidset_not_listset(self):
         inst = self._makeOne()
         oidset = inst._oidset([1,2,3])
@@ -733,123 +1070,1556 @@ class TestObjectMap(unittest.TestCase):
         
     def test_targets(self):
         inst = self._makeOne()
-        inst.objectid_to_path[1] = (_BLANK,)
-        inst.objectid_to_path[2] = (_BLANK, _A)
-        inst.objectid_to_path[3] = (_BLANK, _B)
-        inst.referencemap = DummyReferenceMap(targetids=[2, 3])
-        obj = object()
-        inst._find_resource = lambda *arg: obj
-        self.assertEqual(list(inst.targets(1, 'ref')), [obj, obj])
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_path[2] = (_BLANK, _A)
+        inst.objectid_to_path[3] = (_BLANK, _B)
+        inst.referencemap = DummyReferenceMap(targetids=[2, 3])
+        obj = object()
+        inst._find_resource = lambda *arg: obj
+        self.assertEqual(list(inst.targets(1, 'ref')), [obj, obj])
+
+    def _makeGraph(self):
+        from .. import ReferenceMap
+        inst = self._makeOne()
+        inst.referencemap = ReferenceMap()
+        for oid, name in ((1, _A), (2, _B), (3, _C)):
+            inst.objectid_to_path[oid] = (_BLANK, name)
+        inst.connect_many([(1, 2), (2, 3)], 'ref')
+        inst.connect(3, 1, 'other')
+        return inst
+
+    def test_traverse(self):
+        inst = self._makeGraph()
+        one = testing.DummyResource(__oid__=1)
+        levels = list(inst.traverse([one], 'ref'))
+        self.assertEqual([list(x) for x in levels], [[2], [3]])
+
+    def test_traverse_reftypes_sequence(self):
+        inst = self._makeGraph()
+        levels = list(inst.traverse([2], ('ref', 'other'), depth=1))
+        self.assertEqual([list(x) for x in levels], [[3]])
+        levels = list(inst.traverse([2], ['ref', 'other'], 'sources'))
+        self.assertEqual([list(x) for x in levels], [[1], [3]])
+
+    def test_traverse_missing(self):
+        inst = self._makeGraph()
+        self.assertRaises(ValueError, inst.traverse, [4], 'ref')
+
+    def test_closure(self):
+        inst = self._makeGraph()
+        self.assertEqual(list(inst.closure([1], ['ref', 'other'])), [2, 3])
+        self.assertEqual(
+            list(inst.closure([3], 'ref', 'sources', include_origin=True)),
+            [1, 2, 3])
+
+    def test_has_references_obj(self):
+        inst = self._makeOne()
+        inst.referencemap = DummyReferenceMap(has_references=True)
+        inst.objectid_to_path[1] = (_BLANK,)
+        obj = testing.DummyResource()
+        obj.__oid__ = 1
+        self.assertTrue(inst.has_references(obj))
+        self.assertEqual(inst.referencemap.oid_arg, 1)
+        self.assertEqual(inst.referencemap.reftype_arg, None)
+
+    def test_has_references_oid(self):
+        inst = self._makeOne()
+        inst.referencemap = DummyReferenceMap(has_references=True)
+        inst.objectid_to_path[1] = (_BLANK,)
+        self.assertTrue(inst.has_references(1))
+        self.assertEqual(inst.referencemap.oid_arg, 1)
+        self.assertEqual(inst.referencemap.reftype_arg, None)
+
+    def test_has_references_with_reftype(self):
+        inst = self._makeOne()
+        inst.referencemap = DummyReferenceMap(has_references=True)
+        inst.objectid_to_path[1] = (_BLANK,)
+        self.assertTrue(inst.has_references(1, 'abc'))
+        self.assertEqual(inst.referencemap.oid_arg, 1)
+        self.assertEqual(inst.referencemap.reftype_arg, 'abc')
+
+    def test_get_reftypes(self):
+        inst = self._makeOne()
+        inst.referencemap = DummyReferenceMap(reftypes=(1,2))
+        self.assertTrue(inst.get_reftypes(), (1,2))
+
+    def test_order_sources_order_is_None(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        result = inst.order_sources(1, 'reftype', None)
+        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', None)])
+        self.assertEqual(result, None)
+
+    def test_order_sources_order_is__marker(self):
+        from substanced.objectmap import _marker
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        result = inst.order_sources(1, 'reftype', _marker)
+        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', _marker)])
+        self.assertEqual(result, _marker)
+
+    def test_order_sources_order_is_oidlist(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        inst.objectid_to_path = {2:True, 3:True}
+        result = inst.order_sources(1, 'reftype', [2,3])
+        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', [2,3])])
+        self.assertEqual(result, [2,3])
+
+    def test_order_sources_order_is_objectlist(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        one = testing.DummyResource()
+        one.__oid__ = 1
+        two = testing.DummyResource()
+        two.__oid__ = 2
+        inst.objectid_to_path = {1:True, 2:True}
+        result = inst.order_sources(1, 'reftype', [one, two])
+        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', [1,2])])
+        self.assertEqual(result, [1,2])
+
+    def test_order_targets_order_is_None(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        result = inst.order_targets(1, 'reftype', None)
+        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', None)])
+        self.assertEqual(result, None)
+
+    def test_order_targets_order_is__marker(self):
+        from substanced.objectmap import _marker
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        result = inst.order_targets(1, 'reftype', _marker)
+        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', _marker)])
+        self.assertEqual(result, _marker)
+
+    def test_order_targets_order_is_oidlist(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        inst.objectid_to_path = {2:True, 3:True}
+        result = inst.order_targets(1, 'reftype', [2,3])
+        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', [2,3])])
+        self.assertEqual(result, [2,3])
+
+    def test_order_targets_order_is_objectlist(self):
+        inst = self._makeOne()
+        refmap = DummyReferenceMap()
+        inst.referencemap = refmap
+        one = testing.DummyResource()
+        one.__oid__ = 1
+        two = testing.DummyResource()
+        two.__oid__ = 2
+        inst.objectid_to_path = {1:True, 2:True}
+        result = inst.order_targets(1, 'reftype', [one, two])
+        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', [1,2])])
+        self.assertEqual(result, [1,2])
+        
+class TestObjectMapRangeScan(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    objectmap_options = {'pathindex':False}
+
+    def test_ctor(self):
+        inst = self._makeOne()
+        self.assertEqual(inst.pathindex, None)
+
+    def test_add_writes_no_pathindex(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b')
+        self.assertEqual(inst.pathindex, None)
+        self.assertEqual(
+            list(inst.path_to_objectid.keys()),
+            [(_BLANK,), (_BLANK, _A), (_BLANK, _A, _B)]
+            )
+
+    def test_pathscan_not_valid(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.pathscan, 1)
+
+    def test_pathscan_excludes_sibling_with_common_prefix(self):
+        inst = self._makeOne()
+        root, a, ab, a_bang, a_nul = populate(
+            inst, '/', '/a', '/a/b', '/a!', '/a\x00')
+        result = list(inst.pathscan((_BLANK, _A)))
+        self.assertEqual(
+            result,
+            [((_BLANK, _A), a), ((_BLANK, _A, _B), ab)]
+            )
+
+    def test_pathscan_depth_skips_deeper_subtrees(self):
+        inst = self._makeOne()
+        populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/a/d', '/z', '/z/y')
+        result = [ x[0] for x in inst.pathscan((_BLANK,), 1) ]
+        self.assertEqual(result, [(_BLANK,), (_BLANK, _A), (_BLANK, _Z)])
+
+    def test_pathscan_depth_missing_intermediate(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a/b/c', '/a/b/d', '/z')
+        result = [ x[0] for x in inst.pathscan((_BLANK,), 1, False) ]
+        self.assertEqual(result, [(_BLANK, _Z)])
+        result = [ x[0] for x in inst.pathscan((_BLANK,), 2, False) ]
+        self.assertEqual(result, [(_BLANK, _Z)])
+        result = [ x[0] for x in inst.pathscan((_BLANK,), 3, False) ]
+        self.assertEqual(
+            result,
+            [(_BLANK, _A, _B, _C), (_BLANK, _A, _B, 'd'), (_BLANK, _Z)]
+            )
+
+    def test_pathscan_traversable_object(self):
+        inst = self._makeOne()
+        oid, = populate(inst, '/')
+        obj = testing.DummyResource()
+        self.assertEqual(list(inst.pathscan(obj)), [((_BLANK,), oid)])
+
+    def test_pathlookup_pathcount(self):
+        inst = self._makeOne()
+        root, a, ab, abc, z = populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        def l(path, depth=None, include_origin=True):
+            path_tuple = split(path)
+            oids = sorted(inst.pathlookup(path_tuple, depth, include_origin))
+            count = inst.pathcount(path_tuple, depth, include_origin)
+            return oids, count
+        self.assertEqual(l('/'), ([root, a, ab, abc, z], 5))
+        self.assertEqual(l('/', depth=0), ([root], 1))
+        self.assertEqual(l('/', depth=1), ([root, a, z], 3))
+        self.assertEqual(l('/', depth=2), ([root, a, ab, z], 4))
+        self.assertEqual(l('/', include_origin=False), ([a, ab, abc, z], 4))
+        self.assertEqual(l('/', 0, include_origin=False), ([], 0))
+        self.assertEqual(l('/a'), ([a, ab, abc], 3))
+        self.assertEqual(l('/a', depth=1), ([a, ab], 2))
+        self.assertEqual(l('/a/b/c', depth=1), ([abc], 1))
+        self.assertEqual(l('/nope'), ([], 0))
+
+    def test_remove(self):
+        inst = self._makeOne()
+        root, a, ab, abc, z = populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.set_acl((_BLANK,), [('Allow', 'fred', 'view')])
+        inst.set_acl((_BLANK, _A, _B), [('Allow', 'fred', 'view')])
+        removed = inst.remove(ab)
+        self.assertEqual(set(removed), set([ab, abc]))
+        self.assertEqual(
+            dict(inst.objectid_to_path),
+            {root: (_BLANK,), a: (_BLANK, _A), z: (_BLANK, _Z)}
+            )
+        self.assertEqual(
+            dict(inst.path_to_objectid),
+            {(_BLANK,): root, (_BLANK, _A): a, (_BLANK, _Z): z}
+            )
+        self.assertEqual(list(inst.path_to_acl.keys()), [(_BLANK,)])
+
+    def test_remove_not_present(self):
+        inst = self._makeOne()
+        populate(inst, '/')
+        self.assertEqual(inst.remove((_BLANK, _A)), set())
+
+    def test_remove_removes_references_and_extents(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        inst.connect(root, a, 'ref')
+        inst.remove((_BLANK, _A))
+        self.assertEqual(list(inst.targetids(root, 'ref')), [])
+        self.assertEqual(
+            list(inst.get_extent('pyramid.testing.DummyResource')),
+            [root]
+            )
+
+    def test_remove_moving(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        inst.remove((_BLANK, _A), moving=True)
+        self.assertEqual(
+            sorted(inst.get_extent('pyramid.testing.DummyResource')),
+            sorted([root, a])
+            )
+
+    def test_remove_path_to_acl_is_None(self):
+        inst = self._makeOne()
+        inst.path_to_acl = None
+        root, a = populate(inst, '/', '/a')
+        self.assertEqual(set(inst.remove(a)), set([a]))
+
+    def test_navgen(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        result = inst.navgen((_BLANK,), 2)
+        self.assertEqual(
+            result,
+            [{'path': (_BLANK, _A),
+              'name':_A,
+              'children': [{'path': (_BLANK, _A, _B),
+                            'name':_B,
+                            'children': []}]},
+             {'path': (_BLANK, _Z),
+              'name':_Z,
+              'children': []}]
+            )
+
+    def test_navgen_nodepth(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a')
+        self.assertEqual(inst.navgen((_BLANK,), 0), [])
+
+    def test_navchildren_after(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/ab', '/z')
+        result = list(inst.navchildren((_BLANK,), after=_A))
+        self.assertEqual([x['name'] for x in result], ['ab', _Z])
+        self.assertEqual([x['count'] for x in result], [0, 0])
+
+class TestObjectMapRelocate(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _normalized_pathindex(self, inst):
+        result = {}
+        for path, omap in inst.pathindex.items():
+            levels = dict(
+                (level, sorted(oidset)) for level, oidset in omap.items()
+                )
+            if levels:
+                result[path] = levels
+        return result
+
+    def _rebuilt_pathindex(self, inst):
+        from .. import ObjectMap
+        other = ObjectMap(DummyRoot())
+        for path, oid in sorted(inst.path_to_objectid.items()):
+            thing = Dummy()
+            thing.__oid__ = oid
+            other.add(thing, path)
+        return self._normalized_pathindex(other)
+
+    def test_path_tuple_not_tuple(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a')
+        self.assertRaises(ValueError, inst.relocate, (_BLANK, _A), [_BLANK])
+
+    def test_not_resolvable(self):
+        inst = self._makeOne()
+        self.assertRaises(ValueError, inst.relocate, 1, (_BLANK, _B))
+
+    def test_not_in_objectmap(self):
+        inst = self._makeOne()
+        populate(inst, '/')
+        self.assertRaises(
+            ValueError, inst.relocate, (_BLANK, _A), (_BLANK, _B))
+
+    def test_inside_itself(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a')
+        self.assertRaises(
+            ValueError, inst.relocate, (_BLANK, _A), (_BLANK, _A, _B))
+
+    def test_target_exists(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/b')
+        self.assertRaises(
+            ValueError, inst.relocate, (_BLANK, _A), (_BLANK, _B))
+
+    def test_target_exists_beneath(self):
+        inst = self._makeOne(pathindex=False)
+        populate(inst, '/', '/a', '/b/c')
+        self.assertRaises(
+            ValueError, inst.relocate, (_BLANK, _A), (_BLANK, _B))
+
+    def test_same_path(self):
+        inst = self._makeOne()
+        root, a, ab = populate(inst, '/', '/a', '/a/b')
+        result = inst.relocate(a, (_BLANK, _A))
+        self.assertEqual(sorted(result), [a, ab])
+        self.assertEqual(inst.path_for(ab), (_BLANK, _A, _B))
+
+    def test_rename(self):
+        inst = self._makeOne()
+        root, a, ab, abc = populate(inst, '/', '/a', '/a/b', '/a/b/c')
+        rootlevels = inst.pathindex[(_BLANK,)]
+        level1 = rootlevels[1]
+        result = inst.relocate((_BLANK, _A), (_BLANK, _Z))
+        self.assertEqual(sorted(result), [a, ab, abc])
+        self.assertEqual(inst.path_for(a), (_BLANK, _Z))
+        self.assertEqual(inst.path_for(abc), (_BLANK, _Z, _B, _C))
+        self.assertEqual(inst.objectid_for((_BLANK, _Z, _B)), ab)
+        self.assertEqual(inst.objectid_for((_BLANK, _A, _B)), None)
+        self.assertTrue(inst.pathindex[(_BLANK,)] is rootlevels)
+        self.assertTrue(rootlevels[1] is level1)
+        self.assertEqual(
+            self._normalized_pathindex(inst),
+            self._rebuilt_pathindex(inst)
+            )
+
+    def test_move_to_other_parent(self):
+        inst = self._makeOne()
+        root, a, ab, abc, z = populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        result = inst.relocate(ab, (_BLANK, _Z, _B))
+        self.assertEqual(sorted(result), [ab, abc])
+        self.assertEqual(inst.path_for(abc), (_BLANK, _Z, _B, _C))
+        self.assertEqual(sorted(inst.pathlookup((_BLANK, _A))), [a])
+        self.assertEqual(sorted(inst.pathlookup((_BLANK, _Z))), sorted([z, ab, abc]))
+        self.assertEqual(
+            self._normalized_pathindex(inst),
+            self._rebuilt_pathindex(inst)
+            )
+
+    def test_move_to_different_depth(self):
+        inst = self._makeOne()
+        root, a, ab, abc, z = populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.relocate(ab, (_BLANK, _Z, _A, _B))
+        self.assertEqual(
+            sorted(inst.pathlookup((_BLANK,), depth=3, include_origin=False)),
+            sorted([a, z, ab])
+            )
+        self.assertEqual(
+            self._normalized_pathindex(inst),
+            self._rebuilt_pathindex(inst)
+            )
+
+    def test_rangescan(self):
+        inst = self._makeOne(pathindex=False)
+        root, a, ab, a_bang, z = populate(
+            inst, '/', '/a', '/a/b', '/a!', '/z')
+        result = inst.relocate((_BLANK, _A), (_BLANK, _Z, _A))
+        self.assertEqual(sorted(result), [a, ab])
+        self.assertEqual(inst.pathindex, None)
+        self.assertEqual(inst.path_for(a_bang), (_BLANK, 'a!'))
+        self.assertEqual(sorted(inst.pathlookup((_BLANK, _Z))), sorted([z, a, ab]))
+
+    def test_rekeys_acls(self):
+        inst = self._makeOne()
+        root, a, ab, a_bang = populate(inst, '/', '/a', '/a/b', '/a!')
+        inst.set_acl(a, [1])
+        inst.set_acl(ab, [2])
+        inst.set_acl(a_bang, [3])
+        inst.relocate(a, (_BLANK, _Z))
+        self.assertEqual(
+            dict(inst.path_to_acl.items()),
+            {(_BLANK, _Z):(1,),
+             (_BLANK, _Z, _B):(2,),
+             (_BLANK, 'a!'):(3,)}
+            )
+
+    def test_preserves_extents_and_references(self):
+        inst = self._makeOne()
+        root, a, ab, z = populate(inst, '/', '/a', '/a/b', '/z')
+        inst.connect(ab, z, 'reftype')
+        extents_before = dict(
+            (k, list(v)) for k, v in inst.extentmap.extent_to_oids.items())
+        inst.relocate(a, (_BLANK, _Z, _A))
+        self.assertEqual(list(inst.targetids(ab, 'reftype')), [z])
+        self.assertEqual(
+            dict((k, list(v)) for k, v in
+                 inst.extentmap.extent_to_oids.items()),
+            extents_before
+            )
+
+class TestObjectMapPathcounts(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _counts(self, inst):
+        from .. import _ALL_LEVELS
+        result = {}
+        for path, counts in inst.pathcounts.items():
+            levels = dict(
+                (level, length()) for level, length in counts.items()
+                if length() and level != _ALL_LEVELS
+                )
+            if levels:
+                total = counts[_ALL_LEVELS]()
+                self.assertEqual(total, sum(levels.values()))
+                result[path] = levels
+        return result
+
+    def _expected(self, inst):
+        result = {}
+        for path, omap in inst.pathindex.items():
+            levels = dict(
+                (level, len(oidset)) for level, oidset in omap.items()
+                if len(oidset)
+                )
+            if levels:
+                result[path] = levels
+        return result
+
+    def test_ctor(self):
+        from .. import ObjectMap
+        inst = self._makeOne()
+        self.assertEqual(dict(inst.pathcounts), {})
+        inst = ObjectMap(DummyRoot(), pathindex=False)
+        self.assertEqual(inst.pathcounts, None)
+
+    def test_add(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        self.assertEqual(self._counts(inst), self._expected(inst))
+        self.assertEqual(
+            self._counts(inst)[(_BLANK,)], {0:1, 1:2, 2:1, 3:1})
+
+    def test_add_subtree(self):
+        from ...interfaces import IFolder
+        inst = self._makeOne()
+        populate(inst, '/')
+        top = testing.DummyResource(__provides__=IFolder)
+        top['x'] = testing.DummyResource(__provides__=IFolder)
+        top['x']['y'] = testing.DummyResource()
+        inst.add_subtree(top, (_BLANK, _A))
+        self.assertEqual(self._counts(inst), self._expected(inst))
+        self.assertEqual(inst.pathcount((_BLANK,)), 4)
+
+    def test_remove(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.remove((_BLANK, _A, _B))
+        self.assertEqual(self._counts(inst), self._expected(inst))
+        self.assertFalse((_BLANK, _A, _B) in inst.pathcounts)
+        self.assertEqual(inst.pathcount((_BLANK,)), 3)
+
+    def test_relocate(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.relocate((_BLANK, _A, _B), (_BLANK, _Z, _B))
+        self.assertEqual(self._counts(inst), self._expected(inst))
+        self.assertEqual(inst.pathcount((_BLANK, _Z, _B)), 2)
+        self.assertEqual(inst.pathcount((_BLANK, _Z)), 3)
+        self.assertEqual(inst.pathcount((_BLANK, _A)), 1)
+
+    def test_pathcount_uses_counts(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.pathindex = Dummy() # it would blow up if it were used
+        self.assertEqual(inst.pathcount((_BLANK,)), 5)
+        self.assertEqual(inst.pathcount((_BLANK,), include_origin=False), 4)
+        self.assertEqual(inst.pathcount((_BLANK,), depth=1), 3)
+        self.assertEqual(inst.pathcount((_BLANK,), 1, False), 2)
+        self.assertEqual(inst.pathcount((_BLANK,), depth=10), 5)
+        self.assertEqual(inst.pathcount((_BLANK,), 0, False), 0)
+        self.assertEqual(inst.pathcount((_BLANK, 'q')), 0)
+
+    def test_pathcount_without_counts(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.pathcounts = None
+        self.assertEqual(inst.pathcount((_BLANK,)), 5)
+        self.assertEqual(inst.pathcount((_BLANK,), 1, False), 2)
+        populate(inst, '/q')
+        self.assertEqual(inst.pathcounts, None)
+
+    def test_pathcount_without_counts_matches_counts(self):
+        paths = ('/', '/a', '/a/b', '/a/b/c', '/a/d', '/z')
+        inst = self._makeOne()
+        populate(inst, *paths)
+        legacy = self._makeOne()
+        legacy.pathcounts = None # not yet evolved
+        populate(legacy, *paths)
+        self.assertEqual(legacy.pathcounts, None)
+        for path in ('/', '/a', '/a/b', '/a/b/c', '/z', '/q', '/a/q'):
+            path_tuple = split(path)
+            for depth in (None, 0, 1, 2, 3, 10):
+                for include_origin in (True, False):
+                    self.assertEqual(
+                        legacy.pathcount(path_tuple, depth, include_origin),
+                        inst.pathcount(path_tuple, depth, include_origin),
+                        (path, depth, include_origin),
+                        )
+        self.assertEqual(legacy.pathcount((_BLANK,), None, False), 5)
+        self.assertEqual(legacy.pathcount((_BLANK, _A), 3, True), 4)
+        self.assertEqual(legacy.pathcount((_BLANK, 'q')), 0)
+
+    def test_count_without_counts_is_noop(self):
+        inst = self._makeOne()
+        inst.pathcounts = None
+        inst._count((_BLANK,), 0, 1)
+        self.assertEqual(inst.pathcounts, None)
+
+    def test_pathcount_without_counts_after_remove(self):
+        inst = self._makeOne()
+        inst.pathcounts = None
+        populate(inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        inst.remove((_BLANK, _A, _B))
+        self.assertEqual(inst.pathcount((_BLANK,)), 3)
+        self.assertEqual(inst.pathcount((_BLANK,), 2, False), 2)
+        self.assertEqual(inst.pathcount((_BLANK, _A, _B)), 0)
+
+class TestObjectMapShards(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, pathindex=True):
+        from ...interfaces import IFolder
+        root = testing.DummyResource(__provides__=IFolder)
+        root['t1'] = testing.DummyResource(__provides__=IFolder)
+        root['t1']['a'] = testing.DummyResource()
+        root['t1']['b'] = testing.DummyResource(__provides__=IFolder)
+        root['t1']['b']['c'] = testing.DummyResource()
+        root['t2'] = testing.DummyResource(__provides__=IFolder)
+        root['t2']['x'] = testing.DummyResource()
+        root['z'] = testing.DummyResource()
+        inst = make_objectmap(root, pathindex=pathindex)
+        inst.add_subtree(root, (_BLANK,))
+        return inst, root
+
+    def _oids(self, inst, *paths):
+        return [ inst.objectid_for(split(path)) for path in paths ]
+
+    def test_add_shard(self):
+        from .. import _SHARD_MASK
+        inst, root = self._makeOne()
+        all_oids = set(inst.pathlookup((_BLANK,)))
+        shard = inst.add_shard(root['t1'])
+        self.assertTrue(root['t1'].__objectmap__ is shard)
+        self.assertEqual(shard.shard_path, (_BLANK, 't1'))
+        self.assertEqual(shard.shard_id, 1)
+        self.assertTrue(shard.parent_map is inst)
+        self.assertTrue(shard.referencemap is inst.referencemap)
+        self.assertEqual(dict(inst.shards), {(_BLANK, 't1'):shard})
+        self.assertTrue((_BLANK, 't1') in inst.path_to_objectid)
+        self.assertFalse((_BLANK, 't1', 'a') in inst.path_to_objectid)
+        self.assertEqual(
+            sorted(shard.path_to_objectid.keys()),
+            [(_BLANK, 't1'), (_BLANK, 't1', 'a'), (_BLANK, 't1', 'b'),
+             (_BLANK, 't1', 'b', 'c')])
+        self.assertEqual(set(inst.pathlookup((_BLANK,))), all_oids)
+        self.assertEqual(inst.pathcount((_BLANK,)), 8)
+        self.assertEqual(inst.pathcount((_BLANK,), 1, False), 3)
+        self.assertEqual(inst.pathcount((_BLANK,), 2, False), 6)
+        self.assertEqual(inst.pathcount((_BLANK, 't1'), 1, False), 2)
+        # migrated oids which don't carry the shard's number are recorded
+        for oid in shard.objectid_to_path:
+            self.assertEqual(
+                oid in inst.shard_oids, oid & _SHARD_MASK != 1)
+        self.assertEqual(set(inst.shard_oids.values()), set([1]))
+
+    def test_add_shard_rangescan(self):
+        inst, root = self._makeOne(pathindex=False)
+        all_oids = set(inst.pathlookup((_BLANK,)))
+        inst.add_shard(root['t1'])
+        self.assertEqual(set(inst.pathlookup((_BLANK,))), all_oids)
+        self.assertEqual(inst.pathcount((_BLANK,), 2, False), 6)
+
+    def test_add_shard_with_shard(self):
+        from .. import ObjectMap
+        inst, root = self._makeOne()
+        shard = ObjectMap(root)
+        self.assertTrue(inst.add_shard(root['t1'], shard) is shard)
+        self.assertEqual(shard.objectid_for((_BLANK, 't1', 'a')),
+                         inst.objectid_for((_BLANK, 't1', 'a')))
+
+    def test_add_shard_errors(self):
+        from .. import ObjectMap
+        inst, root = self._makeOne()
+        self.assertRaises(ValueError, inst.add_shard, root)
+        del inst.path_to_objectid[(_BLANK, 'z')]
+        self.assertRaises(ValueError, inst.add_shard, root['z'])
+        full = ObjectMap(root)
+        full.add(root['t2'], (_BLANK, 't2'))
+        self.assertRaises(ValueError, inst.add_shard, root['t2'], full)
+        shard = inst.add_shard(root['t1'])
+        self.assertRaises(ValueError, inst.add_shard, root['t1'])
+        self.assertRaises(ValueError, inst.add_shard, root['t1']['b'])
+        self.assertRaises(ValueError, shard.add_shard, root['t1']['b'])
+
+    def test_add_shard_too_many_shards(self):
+        from .. import _SHARD_MASK
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        inst.shard_ids[_SHARD_MASK] = shard
+        self.assertRaises(ValueError, inst.add_shard, root['t2'])
+
+    def test_object_for_routes_paths_and_unknown_objectids(self):
+        inst, root = self._makeOne()
+        inst.add_shard(root['t1'])
+        self.assertTrue(
+            inst.object_for((_BLANK, 't1', 'b', 'c')) is root['t1']['b']['c'])
+        self.assertTrue(inst.object_for((_BLANK, 'z')) is root['z'])
+        self.assertEqual(inst.object_for(12345), None)
+
+    def test_lookups_route(self):
+        from ...util import find_objectmap
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, oid_z = self._oids(inst, '/t1/b/c', '/z')
+        self.assertEqual(inst.path_for(oid_c), (_BLANK, 't1', 'b', 'c'))
+        self.assertEqual(shard.path_for(oid_z), (_BLANK, 'z'))
+        self.assertEqual(shard.objectid_for((_BLANK, 'z')), oid_z)
+        self.assertTrue(inst.object_for(oid_c) is root['t1']['b']['c'])
+        self.assertTrue(shard.object_for(oid_z) is root['z'])
+        self.assertEqual(inst.path_for(12345), None)
+        self.assertTrue(find_objectmap(root['t1']['b']['c']) is shard)
+
+    def test_new_objects_carry_shard_number(self):
+        from .. import _SHARD_MASK
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        new = testing.DummyResource()
+        oid = inst.add(new, (_BLANK, 't1', 'new'))
+        self.assertEqual(oid & _SHARD_MASK, 1)
+        self.assertEqual(shard.objectid_for((_BLANK, 't1', 'new')), oid)
+        self.assertFalse(oid in inst.objectid_to_path)
+        self.assertFalse(oid in inst.shard_oids)
+
+    def test_new_objectid_skips_oids_of_shards(self):
+        from .. import _SHARD_MASK
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        taken = shard.add(testing.DummyResource(), (_BLANK, 't1', 'new'))
+        self.assertEqual(taken & _SHARD_MASK, 1)
+        values = [taken, 1000]
+        inst._v_nextid = None
+        inst._randrange = lambda *arg: values.pop(0)
+        self.assertEqual(inst.new_objectid(), 1000)
+
+    def test_pathscan_and_navigation(self):
+        inst, root = self._makeOne()
+        inst.add_shard(root['t1'])
+        self.assertEqual(
+            [ path for path, oid in inst.pathscan((_BLANK,)) ],
+            [(_BLANK,), (_BLANK, 't1'), (_BLANK, 't1', 'a'),
+             (_BLANK, 't1', 'b'), (_BLANK, 't1', 'b', 'c'), (_BLANK, 't2'),
+             (_BLANK, 't2', 'x'), (_BLANK, 'z')])
+        self.assertEqual(
+            [ path for path, oid in inst.pathscan((_BLANK, 't1'), 1) ],
+            [(_BLANK, 't1'), (_BLANK, 't1', 'a'), (_BLANK, 't1', 'b')])
+        nodes = list(inst.navchildren((_BLANK,), expand=[(_BLANK, 't1')]))
+        self.assertEqual([ x['count'] for x in nodes ], [2, 1, 0])
+        self.assertEqual(
+            [ x['name'] for x in nodes[0]['children'] ], ['a', 'b'])
+        result = inst.navgen((_BLANK,), 2)
+        self.assertEqual(
+            [ x['name'] for x in result[0]['children'] ], ['a', 'b'])
+
+    def test_remove_shard_root(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        expected = set(inst.pathlookup((_BLANK, 't1')))
+        removed = inst.remove((_BLANK, 't1'))
+        self.assertEqual(set(removed), expected)
+        self.assertEqual(dict(inst.shards), {})
+        self.assertEqual(dict(inst.shard_ids), {})
+        self.assertEqual(dict(inst.shard_oids), {})
+        self.assertEqual(len(shard.objectid_to_path), 0)
+        self.assertEqual(inst.pathcount((_BLANK,)), 4)
+
+    def test_remove_inside_shard(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_b, oid_c = self._oids(inst, '/t1/b', '/t1/b/c')
+        self.assertEqual(set(inst.remove(oid_b)), set([oid_b, oid_c]))
+        self.assertEqual(shard.pathcount((_BLANK, 't1')), 2)
+        self.assertFalse(oid_c in inst.shard_oids)
+
+    def test_move_inside_shard_rangescan(self):
+        from pyramid.security import Allow
+        from ...util import get_factory_type
+        inst, root = self._makeOne(pathindex=False)
+        b = root['t1']['b']
+        b.__acl__ = [(Allow, 'bob', 'view')]
+        shard = inst.add_shard(root['t1'])
+        factory_type = get_factory_type(b['c'])
+        oid_b, oid_c = self._oids(inst, '/t1/b', '/t1/b/c')
+        self.assertTrue((_BLANK, 't1', 'b') in shard.path_to_acl)
+        removed = inst.remove(oid_b, moving=True)
+        self.assertEqual(set(removed), set([oid_b, oid_c]))
+        self.assertFalse(oid_c in shard.get_extent(factory_type))
+        self.assertFalse(oid_c in inst.extentmap.get(factory_type, ()))
+        self.assertFalse((_BLANK, 't1', 'b') in shard.path_to_acl)
+        inst.add_subtree(b, (_BLANK, 't1', 'd'), moving=True)
+        self.assertEqual(shard.path_for(oid_c), (_BLANK, 't1', 'd', 'c'))
+        self.assertTrue(oid_c in shard.get_extent(factory_type))
+        self.assertFalse(oid_c in inst.extentmap.get(factory_type, ()))
+        self.assertEqual(shard.path_to_acl[(_BLANK, 't1', 'd')],
+                         ((Allow, 'bob', 'view'),))
+        self.assertFalse((_BLANK, 't1', 'd') in inst.path_to_acl)
+
+    def test_remove_inside_shard_rangescan(self):
+        from ...util import get_factory_type
+        inst, root = self._makeOne(pathindex=False)
+        shard = inst.add_shard(root['t1'])
+        factory_type = get_factory_type(root['t1']['b']['c'])
+        oid_b, oid_c = self._oids(inst, '/t1/b', '/t1/b/c')
+        self.assertEqual(set(inst.remove(oid_b)), set([oid_b, oid_c]))
+        self.assertFalse(oid_c in shard.get_extent(factory_type))
+        self.assertEqual(shard.path_for(oid_c), None)
+
+    def test_allowed_shard_without_acls(self):
+        from pyramid.security import Allow
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, = self._oids(inst, '/t1/b/c')
+        inst.set_acl((_BLANK,), [(Allow, 'bob', 'view')])
+        shard.path_to_acl = None # bw compat
+        self.assertEqual(list(inst.allowed([oid_c], 'bob', 'view')), [oid_c])
+
+    def test_move_shard_root_away_and_back(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        t1 = root['t1']
+        oids = set(inst.pathlookup((_BLANK, 't1')))
+        inst.remove((_BLANK, 't1'), moving=True)
+        self.assertEqual(inst.get_extent('foo'), ())
+        inst.add_subtree(t1, (_BLANK, 'new'), moving=True)
+        self.assertTrue(t1.__objectmap__ is shard)
+        self.assertEqual(dict(inst.shards), {(_BLANK, 'new'):shard})
+        self.assertEqual(shard.shard_path, (_BLANK, 'new'))
+        self.assertEqual(set(inst.pathlookup((_BLANK, 'new'))), oids)
+        self.assertEqual(inst.objectid_for((_BLANK, 'new')), t1.__oid__)
+
+    def test_copy_of_attached_shard_root(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        copied = testing.DummyResource()
+        copied.__objectmap__ = shard
+        inst.add_subtree(copied, (_BLANK, 'copy'), duplicating=True)
+        self.assertFalse(copied.__objectmap__ is shard)
+        self.assertTrue(inst.shards[(_BLANK, 'copy')] is copied.__objectmap__)
+        self.assertEqual(inst.objectid_for((_BLANK, 'copy')), copied.__oid__)
+
+    def test_shard_root_moved_into_shard_is_dissolved(self):
+        inst, root = self._makeOne()
+        shard1 = inst.add_shard(root['t1'])
+        t2 = root['t2']
+        inst.add_shard(t2)
+        oids = set(inst.pathlookup((_BLANK, 't2')))
+        inst.remove((_BLANK, 't2'), moving=True)
+        inst.add_subtree(t2, (_BLANK, 't1', 't2'), moving=True)
+        self.assertFalse('__objectmap__' in t2.__dict__)
+        self.assertEqual(list(inst.shards.keys()), [(_BLANK, 't1')])
+        self.assertEqual(set(shard1.pathlookup((_BLANK, 't1', 't2'))), oids)
+
+    def test_relocate_shard_root(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, = self._oids(inst, '/t1/b/c')
+        relocated = inst.relocate((_BLANK, 't1'), (_BLANK, 't3'))
+        self.assertEqual(len(relocated), 4)
+        self.assertEqual(shard.shard_path, (_BLANK, 't3'))
+        self.assertEqual(dict(inst.shards), {(_BLANK, 't3'):shard})
+        self.assertEqual(inst.path_for(oid_c), (_BLANK, 't3', 'b', 'c'))
+        self.assertEqual(inst.objectid_for((_BLANK, 't3')),
+                         shard.objectid_for((_BLANK, 't3')))
+
+    def test_relocate_inside_shard(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, = self._oids(inst, '/t1/b/c')
+        inst.relocate(oid_c, (_BLANK, 't1', 'c'))
+        self.assertEqual(shard.path_for(oid_c), (_BLANK, 't1', 'c'))
+        self.assertRaises(
+            ValueError, inst.relocate, oid_c, (_BLANK, 'c'))
+        self.assertRaises(
+            ValueError, inst.relocate, (_BLANK, 'z'), (_BLANK, 't1', 'z'))
+
+    def test_references_across_shards(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_a, oid_z = self._oids(inst, '/t1/a', '/z')
+        shard.connect(oid_a, oid_z, 'ref')
+        self.assertEqual(list(inst.sourceids(oid_z, 'ref')), [oid_a])
+        self.assertEqual(list(shard.targets(oid_a, 'ref')), [root['z']])
+        inst.connect_many([(oid_z, oid_a)], 'other')
+        self.assertEqual(list(shard.sourceids(oid_a, 'other')), [oid_z])
+        self.assertRaises(ValueError, shard.connect, oid_a, 12345, 'ref')
+
+    def test_get_extent(self):
+        from ...util import get_factory_type
+        inst, root = self._makeOne()
+        factory_type = get_factory_type(root['z'])
+        all_oids = set(inst.pathlookup((_BLANK,)))
+        shard = inst.add_shard(root['t1'])
+        self.assertEqual(set(inst.get_extent(factory_type)), all_oids)
+        self.assertEqual(
+            set(shard.get_extent(factory_type)),
+            set(shard.pathlookup((_BLANK, 't1'))))
+        self.assertEqual(inst.get_extent('nope'), ())
+
+    def test_extent_count(self):
+        from ...util import get_factory_type
+        inst, root = self._makeOne()
+        factory_type = get_factory_type(root['z'])
+        total = inst.extent_count(factory_type)
+        shard = inst.add_shard(root['t1'])
+        self.assertEqual(inst.extent_count(factory_type), total)
+        self.assertEqual(
+            shard.extent_count(factory_type),
+            len(shard.pathlookup((_BLANK, 't1'))))
+
+    def test_allowed(self):
+        from pyramid.security import Allow, Deny
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, oid_z = self._oids(inst, '/t1/b/c', '/z')
+        inst.set_acl((_BLANK,), [(Allow, 'bob', 'view')])
+        self.assertEqual(
+            list(inst.allowed([oid_c, oid_z], 'bob', 'view')),
+            [oid_c, oid_z])
+        inst.set_acl((_BLANK, 't1'), [(Deny, 'bob', 'view')])
+        self.assertTrue((_BLANK, 't1') in shard.path_to_acl)
+        self.assertEqual(
+            list(inst.allowed([oid_c, oid_z], 'bob', 'view')), [oid_z])
+        self.assertEqual(list(shard.allowed([oid_z], 'bob', 'view')), [oid_z])
+
+    def test_acl_changes_in_shard_invalidate_cache(self):
+        from pyramid.security import Allow, Deny
+        from .. import AllowedCache
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['t1'])
+        oid_c, = self._oids(inst, '/t1/b/c')
+        cache = AllowedCache()
+        inst.set_acl((_BLANK,), [(Allow, 'bob', 'view')])
+        self.assertEqual(
+            list(inst.allowed([oid_c], 'bob', 'view', cache)), [oid_c])
+        shard.set_acl((_BLANK, 't1', 'b'), [(Deny, 'bob', 'view')])
+        self.assertEqual(list(inst.allowed([oid_c], 'bob', 'view', cache)), [])
+
+class TestObjectMapDocids(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    objectmap_options = {'docids':True}
+    nextid = 100
+
+    def test_ctor(self):
+        inst = self._makeOne()
+        self.assertEqual(dict(inst.oid_to_docid), {})
+        self.assertEqual(dict(inst.docid_to_oid), {})
+
+    def test_ctor_without_docids(self):
+        inst = self._makeOne(docids=False)
+        self.assertEqual(inst.docid_allocator, None)
+        populate(inst, '/')
+        self.assertEqual(inst.docid_for(100), None)
+        self.assertEqual(inst.objectid_for_docid(1), None)
+        self.assertEqual(list(inst.docids_for([100])), [])
+        self.assertEqual(list(inst.objectids_for_docids([1])), [])
+
+    def test_add(self):
+        inst = self._makeOne()
+        oids = populate(inst, '/', '/a', '/b')
+        self.assertEqual([ inst.docid_for(oid) for oid in oids ], [1, 2, 3])
+        self.assertEqual(inst.objectid_for_docid(2), oids[1])
+
+    def test_add_subtree(self):
+        from ...interfaces import IFolder
+        inst = self._makeOne()
+        top = testing.DummyResource(__provides__=IFolder)
+        top['x'] = testing.DummyResource()
+        inst.add_subtree(top, (_BLANK,))
+        self.assertEqual(sorted(inst.docid_to_oid.keys()), [1, 2])
+        self.assertEqual(
+            set(inst.docid_to_oid.values()), set(inst.objectid_to_path))
+
+    def test_remove(self):
+        inst = self._makeOne()
+        root, a, ab = populate(inst, '/', '/a', '/a/b')
+        inst.remove(a)
+        self.assertEqual(dict(inst.oid_to_docid), {root:1})
+        self.assertEqual(dict(inst.docid_to_oid), {1:root})
+        # docids aren't reused
+        c, = populate(inst, '/c')
+        self.assertEqual(inst.docid_for(c), 4)
+
+    def test_remove_moving_keeps_docids(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        inst.remove(a, moving=True)
+        self.assertEqual(inst.docid_for(a), 2)
+        obj = resource('/b')
+        obj.__oid__ = a
+        inst.add(obj, obj.path_tuple, moving=True)
+        self.assertEqual(inst.docid_for(a), 2)
+        self.assertEqual(len(inst.docid_to_oid), 2)
+
+    def test_relocate_keeps_docids(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        inst.relocate(a, (_BLANK, _B))
+        self.assertEqual(inst.docid_for(a), 2)
+
+    def test_allocated_docid_in_use_is_skipped(self):
+        inst = self._makeOne()
+        inst.docid_to_oid[1] = 12345
+        root, = populate(inst, '/')
+        self.assertEqual(inst.docid_for(root), 2)
+
+    def test_docids_for_and_back(self):
+        import BTrees
+        inst = self._makeOne()
+        oids = populate(inst, '/', '/a', '/b')
+        docids = inst.docids_for(oids + [12345])
+        self.assertTrue(isinstance(docids, BTrees.family32.IF.Set))
+        self.assertEqual(list(docids), [1, 2, 3])
+        result = inst.objectids_for_docids(list(docids) + [99])
+        self.assertTrue(isinstance(result, inst.family.IF.Set))
+        self.assertEqual(sorted(result), sorted(oids))
+
+    def test_shards_share_docids(self):
+        from ...interfaces import IFolder
+        inst = self._makeOne()
+        root = testing.DummyResource(__provides__=IFolder)
+        root['t'] = testing.DummyResource(__provides__=IFolder)
+        root['t']['x'] = testing.DummyResource()
+        inst.add_subtree(root, (_BLANK,))
+        docids = dict(inst.oid_to_docid)
+        shard = inst.add_shard(root['t'])
+        self.assertTrue(shard.oid_to_docid is inst.oid_to_docid)
+        self.assertEqual(dict(inst.oid_to_docid), docids)
+        oid = shard.add(testing.DummyResource(), (_BLANK, 't', 'y'))
+        self.assertEqual(inst.docid_for(oid), 4)
+
+class TestDocidAllocator(unittest.TestCase):
+    def _makeOne(self, start=1, block_size=None):
+        from .. import DocidAllocator
+        return DocidAllocator(start, block_size)
+
+    def test_allocate(self):
+        inst = self._makeOne(block_size=2)
+        self.assertEqual(
+            [ inst.allocate() for x in range(5) ], [1, 2, 3, 4, 5])
+        self.assertEqual(inst.next_block, 7)
+
+    def test_allocate_claims_blocks(self):
+        inst = self._makeOne(10)
+        self.assertEqual(inst.allocate(), 10)
+        self.assertEqual(inst.next_block, 10 + inst.block_size)
+        self.assertEqual(inst.allocate(), 11)
+        self.assertEqual(inst.next_block, 10 + inst.block_size)
+
+    def test_forgotten_block(self):
+        # e.g. after the allocator has been invalidated
+        inst = self._makeOne(block_size=4)
+        inst.allocate()
+        del inst._v_block
+        self.assertEqual(inst.allocate(), 5)
+
+class TestObjectMapVerifyAndRebuild(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, pathindex=True):
+        from ...interfaces import IFolder
+        root = testing.DummyResource(__provides__=IFolder)
+        root['a'] = testing.DummyResource(__provides__=IFolder)
+        root['a']['b'] = testing.DummyResource()
+        root['z'] = testing.DummyResource()
+        inst = make_objectmap(root, pathindex=pathindex)
+        inst.add_subtree(root, (_BLANK,))
+        inst.transaction = DummyTransaction()
+        return inst, root
+
+    def _verify(self, inst):
+        output = []
+        return inst.verify(output=output.append), output
+
+    def test_verify_consistent(self):
+        inst, root = self._makeOne()
+        count, output = self._verify(inst)
+        self.assertEqual(count, 0)
+        self.assertEqual(output, ['0 inconsistencies found'])
+
+    def test_verify_consistent_rangescan(self):
+        inst, root = self._makeOne(pathindex=False)
+        self.assertEqual(inst.verify(output=False), 0)
+
+    def test_verify_path_maps(self):
+        inst, root = self._makeOne()
+        oid_b = inst.objectid_for((_BLANK, _A, _B))
+        oid_z = inst.objectid_for((_BLANK, _Z))
+        del inst.path_to_objectid[(_BLANK, _A, _B)]
+        inst.objectid_to_path[oid_z] = (_BLANK, _A)
+        inst.path_to_objectid[(_BLANK, 'q')] = 12345
+        count, output = self._verify(inst)
+        self.assertTrue(
+            'error: objectid %s is missing from path_to_objectid' % oid_b
+            in output)
+        self.assertTrue(
+            'error: objectid 12345 is missing from objectid_to_path'
+            in output)
+        self.assertTrue(
+            "error: path ('', 'z') is mapped to objectid %s, which is "
+            "mapped to path ('', 'a')" % oid_z in output)
+
+    def test_verify_pathindex_and_counts(self):
+        inst, root = self._makeOne()
+        oid_b = inst.objectid_for((_BLANK, _A, _B))
+        inst.pathindex[(_BLANK,)][2].remove(oid_b)
+        inst.pathindex[(_BLANK, _Z)][1] = inst.family.IF.TreeSet([oid_b])
+        del inst.pathindex[(_BLANK, _A, _B)]
+        count, output = self._verify(inst)
+        self.assertTrue(
+            "error: pathindex level 2 of path ('',) lacks the objectids "
+            "[%s]" % oid_b in output)
+        self.assertTrue(
+            "error: pathindex level 1 of path ('', 'z') holds the stale "
+            "objectids [%s]" % oid_b in output)
+        self.assertTrue(
+            "error: path ('', 'a', 'b') is missing from the pathindex"
+            in output)
+        self.assertTrue(
+            "error: pathcount of level 2 of path ('',) is 1 rather than 0"
+            in output)
+        self.assertTrue(
+            "error: pathcount of path ('', 'z') is 1 rather than 2"
+            in output)
+        self.assertEqual(output[-1], '%s inconsistencies found' % count)
+
+    def test_verify_extentmap(self):
+        inst, root = self._makeOne()
+        oid_b = inst.objectid_for((_BLANK, _A, _B))
+        extentmap = inst.extentmap
+        extentmap.remove([oid_b])
+        extentmap.extent_to_oids['foo'] = inst.family.II.TreeSet([12345])
+        extentmap.oid_to_extents[12345] = inst.family.OO.TreeSet(['bar'])
+        count, output = self._verify(inst)
+        self.assertEqual(
+            output[:-1],
+            ['error: objectid 12345 is in an extent but not in the objectmap',
+             'error: objectid %s is in no extent' % oid_b,
+             'error: extent foo of objectid 12345 is missing from '
+             'oid_to_extents',
+             'error: objectid 12345 is missing from extent bar',
+             'error: count of extent foo is 0 rather than 1'])
+        self.assertEqual(count, 5)
+
+    def test_rebuild(self):
+        inst, root = self._makeOne()
+        oid_b = inst.objectid_for((_BLANK, _A, _B))
+        inst.pathindex[(_BLANK,)][2].remove(oid_b)
+        inst.pathindex[(_BLANK, _Z)][1] = inst.family.IF.TreeSet([oid_b])
+        inst.extentmap.remove([oid_b])
+        self.assertNotEqual(inst.verify(output=False), 0)
+        output = []
+        self.assertEqual(inst.rebuild(output=output.append), 0)
+        self.assertEqual(inst.verify(output=False), 0)
+        self.assertEqual(inst.transaction.committed, 1)
+        self.assertEqual(output[-1], '0 objects not rebuilt')
+
+    def test_rebuild_commit_interval_swaps_trees_last(self):
+        inst, root = self._makeOne()
+        pathindex = inst.pathindex
+        pathcounts = inst.pathcounts
+        extentmap = inst.extentmap
+        commits = []
+        def commit():
+            commits.append((
+                inst.pathindex is pathindex,
+                inst.pathcounts is pathcounts,
+                inst.extentmap is extentmap,
+                inst._rebuilt and len(inst._rebuilt[0]),
+                ))
+        inst.transaction.commit = commit
+        inst.rebuild(commit_interval=2, output=False)
+        self.assertEqual(len(commits), 5)
+        for commit in commits[:-1]:
+            self.assertEqual(commit[:3], (True, True, True))
+            self.assertTrue(commit[3])
+        self.assertEqual(commits[-1], (False, False, False, None))
+        self.assertFalse(inst.pathindex is pathindex)
+        self.assertFalse(inst.pathcounts is pathcounts)
+        self.assertFalse(inst.extentmap is extentmap)
+        self.assertEqual(inst.verify(output=False), 0)
+
+    def test_rebuild_rangescan(self):
+        inst, root = self._makeOne(pathindex=False)
+        inst.rebuild(output=False)
+        self.assertEqual(inst.pathindex, None)
+        self.assertEqual(inst.transaction.committed, 1)
+        self.assertEqual(inst.verify(output=False), 0)
+
+    def test_rebuild_reports_strays(self):
+        inst, root = self._makeOne()
+        root['new'] = testing.DummyResource()
+        oid_z = inst.objectid_for((_BLANK, _Z))
+        del root['z']
+        output = []
+        self.assertEqual(inst.rebuild(output=output.append), 2)
+        self.assertTrue(
+            'error: object at path /new is not in the objectmap' in output)
+        self.assertTrue(
+            'error: objectid %s (path /z) was not found in the tree' % oid_z
+            in output)
+
+    def test_rebuild_shards(self):
+        inst, root = self._makeOne()
+        shard = inst.add_shard(root['a'])
+        shard.transaction = inst.transaction
+        self.assertEqual(inst.rebuild(output=False), 0)
+        self.assertEqual(shard.rebuild(output=False), 0)
+        self.assertEqual(inst.verify(output=False), 0)
+        self.assertEqual(shard.verify(output=False), 0)
+        self.assertEqual(
+            sorted(inst.extentmap.oid_to_extents.keys()),
+            sorted(inst.objectid_to_path.keys()))
+
+class Test_encode_path(unittest.TestCase):
+    def _callFUT(self, path_tuple):
+        from .. import encode_path
+        return encode_path(path_tuple)
+
+    def test_root(self):
+        self.assertEqual(self._callFUT((_BLANK,)), b'\x00')
+
+    def test_unicode(self):
+        self.assertEqual(
+            self._callFUT((_BLANK, 'caf\xe9')),
+            b'\x00caf\xc3\xa9\x00'
+            )
+
+    def test_nul_in_segment(self):
+        self.assertRaises(ValueError, self._callFUT, (_BLANK, 'a\x00'))
+
+    def test_sorts_like_tuples(self):
+        paths = [
+            (_BLANK,),
+            (_BLANK, _A),
+            (_BLANK, _A, _B),
+            (_BLANK, _A, _B, _C),
+            (_BLANK, _A, 'b!'),
+            (_BLANK, 'a\x01'),
+            (_BLANK, 'a!'),
+            (_BLANK, 'ab'),
+            (_BLANK, _Z),
+            (_BLANK, '\xe9'),
+            (_BLANK, '\u4e2d'),
+            ]
+        shuffled = list(reversed(paths))
+        self.assertEqual(sorted(shuffled), paths)
+        self.assertEqual(
+            sorted(shuffled, key=self._callFUT),
+            paths
+            )
+
+class Test_decode_path(unittest.TestCase):
+    def _callFUT(self, key):
+        from .. import decode_path
+        return decode_path(key)
+
+    def test_roundtrip(self):
+        from .. import encode_path
+        path = (_BLANK, _A, 'caf\xe9')
+        self.assertEqual(self._callFUT(encode_path(path)), path)
+
+    def test_interns_segments(self):
+        one = self._callFUT(b'\x00segment\x00')
+        two = self._callFUT(b'\x00segment\x00other\x00')
+        self.assertTrue(one[1] is two[1])
+
+class TestObjectMapCompactPaths(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    objectmap_options = {'compact_paths':True}
+
+    def test_ctor(self):
+        from .. import ObjectMap
+        self.assertFalse(ObjectMap(DummyRoot()).compact_paths)
+        self.assertTrue(self._makeOne().compact_paths)
+
+    def test_add_stores_bytes(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        self.assertEqual(
+            dict(inst.path_to_objectid),
+            {b'\x00':root, b'\x00a\x00':a}
+            )
+        self.assertEqual(inst.objectid_to_path[a], b'\x00a\x00')
+        self.assertEqual(inst.path_for(a), (_BLANK, _A))
+        self.assertEqual(inst.objectid_for((_BLANK, _A)), a)
+        self.assertEqual(inst.path_for(99), None)
+
+    def test_add_path_exists(self):
+        inst = self._makeOne()
+        populate(inst, '/', '/a')
+        self.assertRaises(ValueError, inst.add, Dummy(), (_BLANK, _A))
+
+    def test_add_subtree(self):
+        from ...interfaces import IFolder
+        inst = self._makeOne()
+        inst._v_nextid = 1
+        top = testing.DummyResource(__provides__=IFolder)
+        top['a'] = testing.DummyResource()
+        inst.add_subtree(top, (_BLANK,))
+        self.assertEqual(
+            dict(inst.path_to_objectid),
+            {b'\x00':2, b'\x00a\x00':1}
+            )
+
+    def test_object_for(self):
+        inst = self._makeOne()
+        root, a = populate(inst, '/', '/a')
+        inst._find_resource = lambda context, path_tuple: path_tuple
+        self.assertEqual(inst.object_for(a), (_BLANK, _A))
+
+    def test_pathlookup_pathindex(self):
+        inst = self._makeOne()
+        root, a, ab, a_bang = populate(inst, '/', '/a', '/a/b', '/a!')
+        self.assertEqual(sorted(inst.pathlookup((_BLANK, _A))), [a, ab])
+
+    def test_pathscan_excludes_sibling_with_common_prefix(self):
+        inst = self._makeOne(pathindex=False)
+        root, a, ab, a_bang, abc_bang = populate(
+            inst, '/', '/a', '/a/b', '/a!', '/a/b!')
+        self.assertEqual(
+            list(inst.pathscan((_BLANK, _A))),
+            [((_BLANK, _A), a),
+             ((_BLANK, _A, _B), ab),
+             ((_BLANK, _A, 'b!'), abc_bang)]
+            )
+
+    def test_pathscan_depth(self):
+        inst = self._makeOne(pathindex=False)
+        root, a, ab, abc, z = populate(
+            inst, '/', '/a', '/a/b', '/a/b/c', '/z')
+        self.assertEqual(
+            [ x[1] for x in inst.pathscan((_BLANK,), 1, False) ],
+            [a, z]
+            )
+        self.assertEqual(inst.pathcount((_BLANK,), 2), 4)
+
+    def test_pathscan_depth_missing_intermediate(self):
+        inst = self._makeOne(pathindex=False)
+        root, abc, z = populate(inst, '/', '/a/b/c', '/z')
+        self.assertEqual(
+            [ x[1] for x in inst.pathscan((_BLANK,), 1, False) ],
+            [z]
+            )
+
+    def test_navgen(self):
+        for pathindex in (True, False):
+            inst = self._makeOne(pathindex=pathindex)
+            populate(inst, '/', '/a', '/a/b')
+            result = inst.navgen((_BLANK,), 2)
+            self.assertEqual(result[0]['path'], (_BLANK, _A))
+            self.assertEqual(
+                result[0]['children'][0]['path'], (_BLANK, _A, _B))
+
+    def test_remove(self):
+        for pathindex in (True, False):
+            inst = self._makeOne(pathindex=pathindex)
+            root, a, ab, a_bang = populate(
+                inst, '/', '/a', '/a/b', '/a!')
+            removed = inst.remove(a)
+            self.assertEqual(sorted(removed), [a, ab])
+            self.assertEqual(
+                dict(inst.path_to_objectid),
+                {b'\x00':root, b'\x00a!\x00':a_bang}
+                )
+            self.assertEqual(sorted(inst.objectid_to_path), [root, a_bang])
+
+    def test_relocate(self):
+        for pathindex in (True, False):
+            inst = self._makeOne(pathindex=pathindex)
+            root, a, ab, z = populate(inst, '/', '/a', '/a/b', '/z')
+            inst.relocate(a, (_BLANK, _Z, _A))
+            self.assertEqual(inst.path_for(ab), (_BLANK, _Z, _A, _B))
+            self.assertEqual(
+                inst.objectid_to_path[ab], b'\x00z\x00a\x00b\x00')
+            self.assertEqual(
+                sorted(inst.pathlookup((_BLANK, _Z))), sorted([z, a, ab]))
+
+    def test_allowed(self):
+        from pyramid.security import Allow
+        inst = self._makeOne()
+        root, a, ab = populate(inst, '/', '/a', '/a/b')
+        inst.set_acl((_BLANK, _A), [(Allow, 'fred', 'view')])
+        self.assertEqual(
+            sorted(inst.allowed([root, a, ab], ['fred'], 'view')),
+            [a, ab]
+            )
+
+class TestObjectMapObjectRefs(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    objectmap_options = {'objectrefs':True}
+
+    def _add(self, inst, path):
+        thing = DummyPersistent()
+        inst.add(thing, split(path))
+        return thing
+
+    def _noTraversal(self, inst):
+        def _find_resource(context, path_tuple): # pragma: no cover
+            raise AssertionError('traversed')
+        inst._find_resource = _find_resource
+
+    def test_ctor(self):
+        from .. import ObjectMap
+        self.assertEqual(ObjectMap(DummyRoot()).objectid_to_object, None)
+        inst = self._makeOne()
+        self.assertEqual(dict(inst.objectid_to_object), {})
 
-    def test_has_references_obj(self):
+    def test_add_persistent(self):
         inst = self._makeOne()
-        inst.referencemap = DummyReferenceMap(has_references=True)
-        inst.objectid_to_path[1] = (_BLANK,)
-        obj = testing.DummyResource()
-        obj.__oid__ = 1
-        self.assertTrue(inst.has_references(obj))
-        self.assertEqual(inst.referencemap.oid_arg, 1)
-        self.assertEqual(inst.referencemap.reftype_arg, None)
+        thing = self._add(inst, '/')
+        self.assertTrue(inst.objectid_to_object[thing.__oid__] is thing)
 
-    def test_has_references_oid(self):
+    def test_add_not_persistent(self):
         inst = self._makeOne()
-        inst.referencemap = DummyReferenceMap(has_references=True)
-        inst.objectid_to_path[1] = (_BLANK,)
-        self.assertTrue(inst.has_references(1))
-        self.assertEqual(inst.referencemap.oid_arg, 1)
-        self.assertEqual(inst.referencemap.reftype_arg, None)
+        inst.add(testing.DummyResource(), (_BLANK,))
+        self.assertEqual(dict(inst.objectid_to_object), {})
 
-    def test_has_references_with_reftype(self):
+    def test_add_subtree(self):
+        from ...interfaces import IFolder
         inst = self._makeOne()
-        inst.referencemap = DummyReferenceMap(has_references=True)
-        inst.objectid_to_path[1] = (_BLANK,)
-        self.assertTrue(inst.has_references(1, 'abc'))
-        self.assertEqual(inst.referencemap.oid_arg, 1)
-        self.assertEqual(inst.referencemap.reftype_arg, 'abc')
+        top = DummyPersistent()
+        alsoProvides(top, IFolder)
+        child = DummyPersistent()
+        top.items = lambda: [('child', child)]
+        inst.add_subtree(top, (_BLANK,))
+        self.assertEqual(
+            dict(inst.objectid_to_object),
+            {top.__oid__:top, child.__oid__:child}
+            )
 
-    def test_get_reftypes(self):
+    def test_object_for_objectid_without_traversal(self):
         inst = self._makeOne()
-        inst.referencemap = DummyReferenceMap(reftypes=(1,2))
-        self.assertTrue(inst.get_reftypes(), (1,2))
+        thing = self._add(inst, '/a')
+        self._noTraversal(inst)
+        self.assertTrue(inst.object_for(thing.__oid__) is thing)
 
-    def test_order_sources_order_is_None(self):
+    def test_object_for_path_tuple_without_traversal(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        result = inst.order_sources(1, 'reftype', None)
-        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', None)])
-        self.assertEqual(result, None)
+        thing = self._add(inst, '/a')
+        self._noTraversal(inst)
+        self.assertTrue(inst.object_for((_BLANK, _A)) is thing)
 
-    def test_order_sources_order_is__marker(self):
-        from substanced.objectmap import _marker
+    def test_object_for_no_reference_traverses(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        result = inst.order_sources(1, 'reftype', _marker)
-        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', _marker)])
-        self.assertEqual(result, _marker)
+        inst.add(testing.DummyResource(), (_BLANK, _A))
+        inst._find_resource = lambda context, path_tuple: path_tuple
+        self.assertEqual(inst.object_for(1), (_BLANK, _A))
+        self.assertEqual(inst.object_for((_BLANK, _A)), (_BLANK, _A))
+        self.assertEqual(inst.object_for((_BLANK, _Z)), (_BLANK, _Z))
 
-    def test_order_sources_order_is_oidlist(self):
+    def test_object_for_stale_reference_traverses(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        inst.objectid_to_path = {2:True, 3:True}
-        result = inst.order_sources(1, 'reftype', [2,3])
-        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', [2,3])])
-        self.assertEqual(result, [2,3])
+        thing = self._add(inst, '/a')
+        thing.__oid__ = 999
+        inst._find_resource = lambda context, path_tuple: path_tuple
+        self.assertEqual(inst.object_for(1), (_BLANK, _A))
 
-    def test_order_sources_order_is_objectlist(self):
+    def test_object_for_not_int_or_tuple(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        one = testing.DummyResource()
-        one.__oid__ = 1
-        two = testing.DummyResource()
-        two.__oid__ = 2
-        inst.objectid_to_path = {1:True, 2:True}
-        result = inst.order_sources(1, 'reftype', [one, two])
-        self.assertEqual(refmap.sources_ordered, [(1, 'reftype', [1,2])])
-        self.assertEqual(result, [1,2])
+        self.assertEqual(inst.object_for('a'), None)
 
-    def test_order_targets_order_is_None(self):
+    def test_remove(self):
+        for pathindex in (True, False):
+            inst = self._makeOne(pathindex=pathindex)
+            root = self._add(inst, '/')
+            a = self._add(inst, '/a')
+            self._add(inst, '/a/b')
+            inst.remove(a.__oid__)
+            self.assertEqual(
+                dict(inst.objectid_to_object), {root.__oid__:root})
+
+    def test_relocate_keeps_references(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        result = inst.order_targets(1, 'reftype', None)
-        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', None)])
-        self.assertEqual(result, None)
+        self._add(inst, '/')
+        a = self._add(inst, '/a')
+        inst.relocate(a.__oid__, (_BLANK, _Z))
+        self._noTraversal(inst)
+        self.assertTrue(inst.object_for((_BLANK, _Z)) is a)
 
-    def test_order_targets_order_is__marker(self):
-        from substanced.objectmap import _marker
+class TestObjectMapObjectForMany(ObjectMapFactory, unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_traversal(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        result = inst.order_targets(1, 'reftype', _marker)
-        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', _marker)])
-        self.assertEqual(result, _marker)
+        inst.add(testing.DummyResource(), (_BLANK,))
+        inst.add(testing.DummyResource(), (_BLANK, _A))
+        inst._find_resource = lambda context, path_tuple: path_tuple
+        result = list(inst.object_for_many([2, 1, 99, (_BLANK, _Z)]))
+        self.assertEqual(
+            result,
+            [(_BLANK, _A), (_BLANK,), None, (_BLANK, _Z)]
+            )
 
-    def test_order_targets_order_is_oidlist(self):
+    def test_generator_input_batches(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        inst.objectid_to_path = {2:True, 3:True}
-        result = inst.order_targets(1, 'reftype', [2,3])
-        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', [2,3])])
-        self.assertEqual(result, [2,3])
+        for x in range(5):
+            inst.add(testing.DummyResource(), (_BLANK, str(x)))
+        inst._find_resource = lambda context, path_tuple: path_tuple[-1]
+        batches = []
+        def _prefetch(batch):
+            batches.append(batch)
+        inst._prefetch = _prefetch
+        result = list(inst.object_for_many((x for x in range(1, 6)), 2))
+        self.assertEqual(result, ['0', '1', '2', '3', '4'])
+        self.assertEqual(batches, [[1, 2], [3, 4], [5]])
+
+    def test_prefetches_ghosts(self):
+        inst = self._makeOne(objectrefs=True)
+        jar1 = DummyJar()
+        jar2 = DummyJar()
+        ghost1 = DummyGhost(1, jar1)
+        ghost2 = DummyGhost(2, jar2)
+        ghost3 = DummyGhost(3, jar1)
+        loaded = DummyGhost(4, jar1)
+        loaded._p_changed = False
+        for ghost in (ghost1, ghost2, ghost3, loaded):
+            inst.objectid_to_path[ghost.__oid__] = (_BLANK, str(ghost.__oid__))
+            inst.path_to_objectid[(_BLANK, str(ghost.__oid__))] = ghost.__oid__
+            inst.objectid_to_object[ghost.__oid__] = ghost
+        result = list(inst.object_for_many([1, (_BLANK, '2'), 3, 4, 99, 'x']))
+        self.assertEqual(result, [ghost1, ghost2, ghost3, loaded, None, None])
+        self.assertEqual(jar1.prefetched, [[ghost1, ghost3]])
+        self.assertEqual(jar2.prefetched, [[ghost2]])
+
+    def test_prefetch_jar_without_prefetch(self):
+        inst = self._makeOne(objectrefs=True)
+        ghost = DummyGhost(1, object())
+        inst.objectid_to_path[1] = (_BLANK,)
+        inst.objectid_to_object[1] = ghost
+        self.assertEqual(list(inst.object_for_many([1])), [ghost])
 
-    def test_order_targets_order_is_objectlist(self):
+    def test_sources_and_targets(self):
         inst = self._makeOne()
-        refmap = DummyReferenceMap()
-        inst.referencemap = refmap
-        one = testing.DummyResource()
-        one.__oid__ = 1
-        two = testing.DummyResource()
-        two.__oid__ = 2
-        inst.objectid_to_path = {1:True, 2:True}
-        result = inst.order_targets(1, 'reftype', [one, two])
-        self.assertEqual(refmap.targets_ordered, [(1, 'reftype', [1,2])])
-        self.assertEqual(result, [1,2])
-        
+        inst.add(testing.DummyResource(), (_BLANK,))
+        inst.add(testing.DummyResource(), (_BLANK, _A))
+        inst.connect(1, 2, 'reftype')
+        inst._find_resource = lambda context, path_tuple: path_tuple
+        self.assertEqual(list(inst.targets(1, 'reftype')), [(_BLANK, _A)])
+        self.assertEqual(list(inst.sources(2, 'reftype')), [(_BLANK,)])
+
 class TestReferenceSet(unittest.TestCase):
     def _makeOne(self):
         from .. import ReferenceSet
@@ -877,6 +2647,37 @@ class TestReferenceSet(unittest.TestCase):
         self.assertEqual(sorted(list(refset.src2target[1])), [2, 3])
         self.assertEqual(sorted(list(refset.target2src[2])), [1, 4])
 
+    def test_connect_many(self):
+        refset = self._makeOne()
+        refset.target2src[2] = DummyTreeSet([4])
+        refset.connect_many([(1, 2), (1, 3), (5, 2)])
+        self.assertEqual(list(refset.src2target[1]), [2, 3])
+        self.assertEqual(list(refset.src2target[5]), [2])
+        self.assertEqual(sorted(refset.target2src[2]), [1, 4, 5])
+        self.assertEqual(list(refset.target2src[3]), [1])
+
+    def test_connect_many_ordered(self):
+        refset = self._makeOne()
+        refset.order_targets(1, [])
+        refset.connect_many([(1, 3), (1, 2), (1, 3)])
+        self.assertEqual(refset.src2target[1].__class__, refset.oidlist_class)
+        self.assertEqual(list(refset.src2target[1]), [3, 2])
+
+    def test_disconnect_many(self):
+        refset = self._makeOne()
+        refset.connect_many([(1, 2), (1, 3), (5, 2)])
+        refset.disconnect_many([(1, 2), (5, 2), (6, 7)])
+        self.assertEqual(list(refset.src2target[1]), [3])
+        self.assertEqual(list(refset.src2target[5]), [])
+        self.assertEqual(list(refset.target2src[2]), [])
+
+    def test_disconnect_many_ordered(self):
+        refset = self._makeOne()
+        refset.order_targets(1, [])
+        refset.connect_many([(1, 3), (1, 2), (1, 4)])
+        refset.disconnect_many([(1, 2)])
+        self.assertEqual(list(refset.src2target[1]), [3, 4])
+
     def test_disconnect_empty(self):
         refset = self._makeOne()
         refset.disconnect(1, 2)
@@ -1020,6 +2821,28 @@ class TestReferenceSet(unittest.TestCase):
         self.assertEqual(oids, refset.oidlist_class([3,2]))
         self.assertEqual(oids, refset.src2target[1])
 
+    def test_order_targets_same_order_no_write(self):
+        refset = self._makeOne()
+        refset.order_targets(1, [])
+        refset.connect(1, 3)
+        refset.connect(1, 2)
+        oids = refset.src2target[1]
+        self.assertTrue(refset.order_targets(1, [3, 2]) is oids)
+
+    def test_order_targets_listset_bw_compat(self):
+        from .. import ListSet
+        refset = self._makeOne()
+        refset.src2target[1] = ListSet([3, 2])
+        self.assertTrue(
+            refset.order_targets(1, [3, 2]) is refset.src2target[1])
+        refset.connect_many([(1, 4)])
+        self.assertEqual(list(refset.src2target[1]), [3, 2, 4])
+        oids = refset.order_targets(1, [4, 3, 2])
+        self.assertEqual(oids.__class__, refset.oidlist_class)
+        self.assertEqual(list(oids), [4, 3, 2])
+        refset.order_targets(1, None)
+        self.assertEqual(refset.src2target[1].__class__, refset.oidset_class)
+
     def test_order_sources_oid_exists_order_is_None(self):
         refset = self._makeOne()
         refset.target2src[1] = refset.oidlist_class([2])
@@ -1095,6 +2918,141 @@ class TestListSet(unittest.TestCase):
         inst = self._makeOne(['foo'])
         self.assertEqual(repr(inst), "<ListSet: ['foo']>")
         
+class TestCompiledACL(unittest.TestCase):
+    def _makeOne(self, acl):
+        from .. import CompiledACL
+        return CompiledACL(acl)
+
+    def test_allows_no_match(self):
+        inst = self._makeOne([('Allow', 'fred', 'view')])
+        self.assertEqual(inst.allows(frozenset(['bob']), 'view'), None)
+        self.assertEqual(inst.allows(frozenset(['fred']), 'edit'), None)
+
+    def test_allows_permission_sequence(self):
+        inst = self._makeOne([('Allow', 'fred', ('view', 'edit'))])
+        self.assertEqual(inst.by_permission, {
+            'view':{'fred':(0, True)},
+            'edit':{'fred':(0, True)},
+            })
+        self.assertTrue(inst.allows(frozenset(['fred']), 'edit'))
+
+    def test_allows_first_ace_wins(self):
+        inst = self._makeOne([
+            ('Allow', 'bob', 'view'),
+            ('Deny', 'fred', 'view'),
+            ('Allow', 'fred', 'view'),
+            ])
+        self.assertEqual(inst.allows(frozenset(['fred']), 'view'), False)
+        self.assertEqual(inst.allows(frozenset(['fred', 'bob']), 'view'), True)
+
+    def test_allows_opaque_permissions(self):
+        from pyramid.security import ALL_PERMISSIONS
+        inst = self._makeOne([
+            ('Allow', 'bob', 'view'),
+            ('Deny', 'fred', ALL_PERMISSIONS),
+            ('Allow', 'fred', 'view'),
+            ])
+        self.assertEqual(len(inst.opaque), 1)
+        self.assertEqual(inst.allows(frozenset(['fred']), 'view'), False)
+        self.assertEqual(inst.allows(frozenset(['fred', 'bob']), 'view'), True)
+        self.assertEqual(inst.allows(frozenset(['fred']), 'edit'), False)
+
+class TestAllowedCache(unittest.TestCase):
+    def _makeOne(self):
+        from .. import AllowedCache
+        return AllowedCache()
+
+    def test_for_objectmap(self):
+        inst = self._makeOne()
+        objectmap1, objectmap2 = Dummy(), Dummy()
+        compiled, decisions = inst.for_objectmap(objectmap1)
+        self.assertEqual((compiled, decisions), ({}, {}))
+        compiled['a'] = None
+        self.assertTrue(inst.for_objectmap(objectmap1)[0] is compiled)
+        self.assertFalse(inst.for_objectmap(objectmap2)[0] is compiled)
+
+    def test_for_objectmap_acl_changed(self):
+        inst = self._makeOne()
+        objectmap = Dummy()
+        compiled, decisions = inst.for_objectmap(objectmap)
+        objectmap._v_acl_token = object()
+        self.assertFalse(inst.for_objectmap(objectmap)[0] is compiled)
+
+class TestOrderedTreeSet(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from substanced.objectmap import OrderedTreeSet
+        return OrderedTreeSet(*arg, **kw)
+
+    def test_ctor(self):
+        inst = self._makeOne([3, 1, 3, 2])
+        self.assertEqual(list(inst), [3, 1, 2])
+        self.assertEqual(len(inst), 3)
+
+    def test_insert(self):
+        inst = self._makeOne()
+        self.assertTrue(inst.insert(2))
+        self.assertTrue(inst.insert(1))
+        self.assertFalse(inst.insert(2))
+        self.assertEqual(list(inst), [2, 1])
+        self.assertEqual(len(inst), 2)
+
+    def test_update(self):
+        inst = self._makeOne([1])
+        self.assertEqual(inst.update([3, 1, 2]), 2)
+        self.assertEqual(list(inst), [1, 3, 2])
+
+    def test_remove(self):
+        inst = self._makeOne([1, 2, 3])
+        inst.remove(2)
+        self.assertEqual(list(inst), [1, 3])
+        self.assertEqual(len(inst), 2)
+        self.assertFalse(2 in inst)
+        self.assertRaises(KeyError, inst.remove, 2)
+
+    def test_insert_after_remove_appends(self):
+        inst = self._makeOne([1, 2])
+        inst.remove(2)
+        inst.insert(2)
+        inst.remove(1)
+        inst.insert(1)
+        self.assertEqual(list(inst), [2, 1])
+
+    def test___contains__(self):
+        inst = self._makeOne([1])
+        self.assertTrue(1 in inst)
+        self.assertFalse(2 in inst)
+
+    def test___bool__(self):
+        self.assertFalse(self._makeOne())
+        self.assertTrue(self._makeOne([1]))
+
+    def test___getitem__(self):
+        inst = self._makeOne([5, 4, 3])
+        inst.remove(4)
+        self.assertEqual(inst[0], 5)
+        self.assertEqual(inst[1], 3)
+        self.assertEqual(inst[-1], 3)
+        self.assertRaises(IndexError, inst.__getitem__, 2)
+        self.assertRaises(IndexError, inst.__getitem__, -3)
+
+    def test___getitem___slice(self):
+        inst = self._makeOne(range(10))
+        self.assertEqual(inst[2:5], [2, 3, 4])
+        self.assertEqual(inst[-2:], [8, 9])
+        self.assertEqual(inst[::3], [0, 3, 6, 9])
+        self.assertEqual(inst[20:], [])
+
+    def test___eq__(self):
+        inst = self._makeOne([2, 1])
+        self.assertEqual(inst, [2, 1])
+        self.assertEqual(inst, self._makeOne([2, 1]))
+        self.assertNotEqual(inst, [1, 2])
+        self.assertNotEqual(inst, object())
+
+    def test___repr__(self):
+        inst = self._makeOne(['foo'])
+        self.assertEqual(repr(inst), "<OrderedTreeSet: ['foo']>")
+
 class TestReferenceMap(unittest.TestCase):
     def _makeOne(self, map=None):
         from .. import ReferenceMap
@@ -1223,8 +3181,186 @@ class TestReferenceMap(unittest.TestCase):
         self.assertEqual(
             refset.src2target['a'], refset.oidlist_class()
             )
-        
-        
+
+    def test_ctor_index(self):
+        refs = self._makeOne()
+        self.assertEqual(dict(refs.oid_to_reftypes), {})
+        refs = self._makeOne({})
+        self.assertEqual(refs.oid_to_reftypes, None)
+
+    def test_connect_indexes(self):
+        refs = self._makeOne()
+        refs.connect(1, 2, 'reftype')
+        refs.connect(1, 3, 'reftype2')
+        self.assertEqual(list(refs.oid_to_reftypes[1]), ['reftype', 'reftype2'])
+        self.assertEqual(list(refs.oid_to_reftypes[2]), ['reftype'])
+        self.assertEqual(list(refs.oid_to_reftypes[3]), ['reftype2'])
+
+    def test_order_indexes(self):
+        refs = self._makeOne()
+        refs.order_sources(1, 'reftype', [])
+        refs.order_targets(2, 'reftype2', [])
+        refs.order_targets(3, 'reftype2', None)
+        self.assertEqual(list(refs.oid_to_reftypes[1]), ['reftype'])
+        self.assertEqual(list(refs.oid_to_reftypes[2]), ['reftype2'])
+        self.assertFalse(3 in refs.oid_to_reftypes)
+
+    def test_remove_touches_only_indexed_refsets(self):
+        refs = self._makeOne()
+        refs.connect(1, 2, 'reftype')
+        refs.connect(3, 4, 'reftype2')
+        L = []
+        refset2 = refs.refmap['reftype2']
+        refset2.remove = lambda oids: L.append(oids)
+        refs.remove([1, 99])
+        self.assertEqual(L, [])
+        self.assertFalse(refs.has_references(1))
+        self.assertFalse(refs.has_references(2))
+        self.assertFalse(1 in refs.oid_to_reftypes)
+        self.assertEqual(list(refs.targetids(1, 'reftype')), [])
+        self.assertEqual(list(refs.sourceids(2, 'reftype')), [])
+
+    def test_remove_groups_oids_by_reftype(self):
+        refs = self._makeOne()
+        refs.connect(1, 2, 'reftype')
+        refs.connect(3, 2, 'reftype')
+        L = []
+        refs.refmap['reftype'].remove = lambda oids: L.append(oids)
+        refs.remove([1, 3])
+        self.assertEqual(L, [[1, 3]])
+
+    def test_remove_indexed_reftype_without_refset(self):
+        refs = self._makeOne()
+        refs._index(1, 'gone')
+        refs.remove([1])
+        self.assertFalse(1 in refs.oid_to_reftypes)
+
+    def test_has_references_indexed(self):
+        refs = self._makeOne()
+        refs.connect(1, 2, 'reftype')
+        refs._index(3, 'gone')
+        refs.refmap['reftype2'] = DummyReferenceSet(True)
+        self.assertTrue(refs.has_references(1))
+        self.assertTrue(refs.has_references(2))
+        self.assertFalse(refs.has_references(3))
+        self.assertFalse(refs.has_references(4))
+
+    def test_has_references_indexed_stale(self):
+        refs = self._makeOne()
+        refs.connect(1, 2, 'reftype')
+        refs.connect(3, 2, 'reftype')
+        refs.remove([2])
+        # 1 and 3 are still indexed under reftype but no longer referenced
+        self.assertEqual(list(refs.oid_to_reftypes[1]), ['reftype'])
+        self.assertFalse(refs.has_references(1))
+
+    def test_connect_many_indexes(self):
+        refs = self._makeOne()
+        refs.connect_many([(1, 2), (1, 3)], 'reftype')
+        self.assertEqual(list(refs.targetids(1, 'reftype')), [2, 3])
+        self.assertEqual(sorted(refs.oid_to_reftypes.keys()), [1, 2, 3])
+
+    def test_connect_many_empty(self):
+        refs = self._makeOne()
+        refs.connect_many([], 'reftype')
+        self.assertFalse('reftype' in refs.refmap)
+
+    def test_disconnect_many(self):
+        refs = self._makeOne()
+        refs.connect_many([(1, 2), (1, 3)], 'reftype')
+        refs.disconnect_many([(1, 2)], 'reftype')
+        refs.disconnect_many([(1, 2)], 'nonesuch')
+        self.assertEqual(list(refs.targetids(1, 'reftype')), [3])
+
+    def test_rebuild_index(self):
+        from .. import ReferenceSet
+        refset = ReferenceSet()
+        refset.connect(1, 2)
+        refs = self._makeOne({'reftype':refset})
+        refs.rebuild_index()
+        self.assertEqual(list(refs.oid_to_reftypes[1]), ['reftype'])
+        self.assertEqual(list(refs.oid_to_reftypes[2]), ['reftype'])
+        refs.remove([1])
+        self.assertFalse(refs.has_references(2))
+
+    def _makeGraph(self):
+        # 1 -> 2 -> 3 -> 1 (a cycle), 3 -> 4, 2 => 5 (another reftype)
+        refs = self._makeOne()
+        refs.connect_many([(1, 2), (2, 3), (3, 1), (3, 4)], 'a')
+        refs.connect(2, 5, 'b')
+        return refs
+
+    def test_traverse_targets(self):
+        refs = self._makeGraph()
+        levels = list(refs.traverse([1], ['a']))
+        self.assertEqual([list(x) for x in levels], [[2], [3], [4]])
+        self.assertEqual(levels[0].__class__.__name__, 'LFSet')
+
+    def test_traverse_sources(self):
+        refs = self._makeGraph()
+        levels = list(refs.traverse([4], ['a'], direction='sources'))
+        self.assertEqual([list(x) for x in levels], [[3], [2], [1]])
+
+    def test_traverse_both(self):
+        refs = self._makeGraph()
+        levels = list(refs.traverse([5], ['a', 'b'], direction='both'))
+        self.assertEqual([list(x) for x in levels], [[2], [1, 3], [4]])
+
+    def test_traverse_depth(self):
+        refs = self._makeGraph()
+        levels = list(refs.traverse([1], ['a'], depth=2))
+        self.assertEqual([list(x) for x in levels], [[2], [3]])
+        self.assertEqual(list(refs.traverse([1], ['a'], depth=0)), [])
+
+    def test_traverse_multiple_reftypes(self):
+        refs = self._makeGraph()
+        levels = list(refs.traverse([1], ['a', 'b', 'nonesuch']))
+        self.assertEqual([list(x) for x in levels], [[2], [3, 5], [4]])
+
+    def test_traverse_no_refsets(self):
+        refs = self._makeGraph()
+        self.assertEqual(list(refs.traverse([1], ['nonesuch'])), [])
+
+    def test_traverse_ordered(self):
+        refs = self._makeGraph()
+        refs.order_targets(3, 'a', [4, 1])
+        levels = list(refs.traverse([2], ['a']))
+        self.assertEqual([list(x) for x in levels], [[3], [1, 4]])
+
+    def test_traverse_bad_direction(self):
+        refs = self._makeGraph()
+        self.assertRaises(
+            ValueError, list, refs.traverse([1], ['a'], direction='up'))
+
+    def test_closure(self):
+        refs = self._makeGraph()
+        self.assertEqual(list(refs.closure([1], ['a'])), [2, 3, 4])
+        self.assertEqual(list(refs.closure([4], ['a'])), [])
+
+    def test_closure_include_origin(self):
+        refs = self._makeGraph()
+        result = refs.closure([4], ['a'], include_origin=True)
+        self.assertEqual(list(result), [4])
+        result = refs.closure([1], ['a'], depth=1, include_origin=True)
+        self.assertEqual(list(result), [1, 2])
+
+    def test_references_among(self):
+        from BTrees.OOBTree import OOSet
+        refs = self._makeGraph()
+        result = refs.references_among(OOSet([2, 3, 4, 6]), 'a')
+        self.assertEqual(
+            [(oid, list(oids)) for oid, oids in result], [(2, [3]), (3, [1, 4])])
+        result = refs.references_among(OOSet([1, 4]), 'a', 'sources')
+        self.assertEqual(
+            [(oid, list(oids)) for oid, oids in result], [(1, [3]), (4, [3])])
+
+    def test_references_among_no_refset(self):
+        from BTrees.OOBTree import OOSet
+        refs = self._makeGraph()
+        result = refs.references_among(OOSet([1]), 'nonesuch')
+        self.assertEqual(list(result), [])
+
+
 class TestExtentMap(unittest.TestCase):
     def _makeOne(self):
         from .. import ExtentMap
@@ -1293,6 +3429,40 @@ class TestExtentMap(unittest.TestCase):
         self.assertEqual(inst.get('foo', 'bar'), 'bar')
         self.assertEqual(inst.get('foo'), None)
 
+    def test_count(self):
+        inst = self._makeOne()
+        dummy_dotted = 'substanced.objectmap.tests.test_init.Dummy'
+        obj = Dummy()
+        inst.add(obj, 1)
+        inst.add(obj, 1)
+        inst.add_many({dummy_dotted:[1, 2, 3], 'other':[4]})
+        self.assertEqual(inst.count(dummy_dotted), 3)
+        self.assertEqual(inst.count('other'), 1)
+        self.assertEqual(inst.count('foo'), 0)
+        inst.remove([1, 4, 5])
+        self.assertEqual(inst.count(dummy_dotted), 2)
+        self.assertEqual(inst.count('other'), 0)
+        self.assertFalse('other' in inst.extent_lengths)
+
+    def test_count_bw_compat(self):
+        inst = self._makeOne()
+        inst.extent_lengths = None
+        dummy_dotted = 'substanced.objectmap.tests.test_init.Dummy'
+        inst.add(Dummy(), 1)
+        inst.add_many({dummy_dotted:[2]})
+        self.assertEqual(inst.count(dummy_dotted), 2)
+        inst.remove([1, 2])
+        self.assertEqual(inst.count(dummy_dotted), 0)
+
+    def test_rebuild_lengths(self):
+        inst = self._makeOne()
+        dummy_dotted = 'substanced.objectmap.tests.test_init.Dummy'
+        inst.extent_lengths = None
+        inst.add_many({dummy_dotted:[1, 2]})
+        inst.rebuild_lengths()
+        self.assertEqual(inst.extent_lengths[dummy_dotted](), 2)
+        self.assertEqual(inst.count(dummy_dotted), 2)
+
 class Test_reference_sourceid_property(unittest.TestCase):
     def setUp(self):
         from substanced.interfaces import IFolder
@@ -2385,7 +4555,7 @@ class TestMultireference(unittest.TestCase):
             resolve=resolve,
             orientation=orientation
             )
-        m.get_oids = lambda: oids
+        m.get_oids = lambda copy=True: oids
         return m
 
     def _makeContext(self):
@@ -2421,7 +4591,7 @@ class TestMultireference(unittest.TestCase):
     def test___contains___withresolve_True(self):
         objectmap = DummyObjectMap(result=object)
         inst = self._makeOne(None, [1], objectmap, resolve=True)
-        self.assertTrue(inst.__contains__(object))
+        self.assertTrue(inst.__contains__(testing.DummyResource(__oid__=1)))
         
     def test___contains___withresolve_False_empty(self):
         objectmap = DummyObjectMap(result=object)
@@ -2433,6 +4603,58 @@ class TestMultireference(unittest.TestCase):
         inst = self._makeOne(None, [1], objectmap, resolve=True)
         self.assertFalse(inst.__contains__(None))
 
+    def test___getitem___slice(self):
+        inst = self._makeOne(None, [1, 2, 3], None)
+        self.assertEqual(inst[1:], [2, 3])
+
+    def test___getitem___slice_with_resolve(self):
+        objectmap = DummyObjectMap(result=object)
+        inst = self._makeOne(None, [1, 2, 3], objectmap, resolve=True)
+        self.assertEqual(inst[:2], [object, object])
+
+    def test___getitem___ordered(self):
+        from .. import OrderedTreeSet
+        inst = self._makeOne(None, OrderedTreeSet([3, 1, 2]), None)
+        self.assertEqual(inst[0], 3)
+        self.assertEqual(inst[1:], [1, 2])
+
+    def test___getitem___unordered(self):
+        import BTrees
+        oids = BTrees.family64.OO.TreeSet([3, 1, 2])
+        inst = self._makeOne(None, oids, None)
+        self.assertEqual(inst[0], 1)
+        self.assertEqual(inst[-2:], [2, 3])
+
+    def test___len___ordered_treeset(self):
+        from .. import OrderedTreeSet
+        inst = self._makeOne(None, OrderedTreeSet([3, 1]), None)
+        self.assertEqual(len(inst), 2)
+
+    def test_get_oids_nocopy(self):
+        from .. import (
+            Multireference,
+            ObjectMap,
+            OrderedTreeSet,
+            )
+        context = self._makeContext()
+        objectmap = ObjectMap(context)
+        objectmap.objectid_to_path[-1] = (_BLANK,)
+        objectmap.objectid_to_path[1] = (_BLANK, _A)
+        objectmap.order_targets(-1, 'reftype', [])
+        objectmap.connect(-1, 1, 'reftype')
+        inst = Multireference(
+            context, objectmap, 'reftype', False, False, 'source')
+        oids = inst.get_oids(copy=False)
+        self.assertEqual(oids.__class__, OrderedTreeSet)
+        self.assertTrue(
+            oids is objectmap.referencemap.refmap['reftype'].src2target[-1])
+        copied = inst.get_oids()
+        self.assertFalse(copied is oids)
+        self.assertEqual(list(copied), [1])
+        inst = Multireference(
+            context, objectmap, 'reftype', False, False, 'target')
+        self.assertEqual(list(inst.get_oids(copy=False)), [])
+
     def test___iter__(self):
         inst = self._makeOne(None, [1], None)
         self.assertEqual(list(inst.__iter__()), [1])
@@ -2619,6 +4841,155 @@ class Test_ReferencedPredicate(unittest.TestCase):
         inst.has_references = has_references
         self.assertEqual(inst(None, None), True)
 
+class Test_get_path_tuple(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, resource, objectmap=None):
+        from .. import get_path_tuple
+        return get_path_tuple(resource, objectmap)
+
+    def _makeTree(self):
+        from .. import ObjectMap
+        from ...interfaces import IFolder
+        root = testing.DummyResource(__provides__=IFolder)
+        root['a'] = testing.DummyResource(__provides__=IFolder)
+        root['a']['b'] = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add_subtree(root, (_BLANK,))
+        return root, objectmap
+
+    def _makeUnnavigable(self, root):
+        # the path can only come from the objectmap if the lineage of b
+        # can't be walked past a
+        class Unnavigable(object):
+            @property
+            def __name__(self): # pragma: no cover
+                raise AssertionError('lineage was walked')
+        b = root['a']['b']
+        root['a'].__parent__ = Unnavigable()
+        return b
+
+    def test_seated(self):
+        root, objectmap = self._makeTree()
+        b = self._makeUnnavigable(root)
+        self.assertEqual(self._callFUT(b, objectmap), (_BLANK, _A, _B))
+
+    def test_objectmap_of_current_request(self):
+        root, objectmap = self._makeTree()
+        request = testing.DummyRequest()
+        request.root = root
+        self.config.begin(request=request)
+        b = self._makeUnnavigable(root)
+        self.assertEqual(self._callFUT(b), (_BLANK, _A, _B))
+
+    def test_no_objectmap(self):
+        root, objectmap = self._makeTree()
+        self.assertEqual(self._callFUT(root['a']['b']), (_BLANK, _A, _B))
+
+    def test_root(self):
+        root, objectmap = self._makeTree()
+        self.assertEqual(self._callFUT(root, objectmap), (_BLANK,))
+
+    def test_unseated(self):
+        root, objectmap = self._makeTree()
+        root['c'] = testing.DummyResource()
+        self.assertEqual(self._callFUT(root['c'], objectmap), (_BLANK, 'c'))
+
+    def test_unseated_with_unknown_oid(self):
+        root, objectmap = self._makeTree()
+        root['c'] = testing.DummyResource()
+        root['c'].__oid__ = 12345
+        self.assertEqual(self._callFUT(root['c'], objectmap), (_BLANK, 'c'))
+
+    def test_bears_oid_of_root(self):
+        root, objectmap = self._makeTree()
+        root['c'] = testing.DummyResource()
+        root['c'].__oid__ = root.__oid__
+        self.assertEqual(self._callFUT(root['c'], objectmap), (_BLANK, 'c'))
+
+    def test_renamed_behind_objectmaps_back(self):
+        root, objectmap = self._makeTree()
+        b = root['a']['b']
+        b.__name__ = 'c'
+        self.assertEqual(self._callFUT(b, objectmap), (_BLANK, _A, 'c'))
+
+    def test_copy_bearing_oid_of_original(self):
+        root, objectmap = self._makeTree()
+        copy = testing.DummyResource(__oid__=root['a']['b'].__oid__)
+        root['b'] = copy
+        self.assertEqual(self._callFUT(copy, objectmap), (_BLANK, _B))
+
+class Test_get_path(unittest.TestCase):
+    def _callFUT(self, resource, objectmap=None):
+        from .. import get_path
+        return get_path(resource, objectmap)
+
+    def test_it(self):
+        root = testing.DummyResource()
+        root['a b'] = testing.DummyResource()
+        self.assertEqual(self._callFUT(root['a b']), '/a%20b')
+        self.assertEqual(self._callFUT(root), '/')
+
+class TestResourceURL(unittest.TestCase):
+    def _makeOne(self, resource, request):
+        from .. import ResourceURL
+        return ResourceURL(resource, request)
+
+    def _makeTree(self):
+        from .. import ObjectMap
+        from ...interfaces import IFolder
+        root = testing.DummyResource(__provides__=IFolder)
+        root['a'] = testing.DummyResource(__provides__=IFolder)
+        root['a']['b'] = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add_subtree(root, (_BLANK,))
+        return root
+
+    def test_class_conforms_to_IResourceURL(self):
+        from zope.interface.verify import verifyClass
+        from pyramid.interfaces import IResourceURL
+        from .. import ResourceURL
+        verifyClass(IResourceURL, ResourceURL)
+
+    def test_it(self):
+        root = self._makeTree()
+        request = testing.DummyRequest()
+        request.root = root
+        root['a'].__parent__ = None # the path must come from the objectmap
+        inst = self._makeOne(root['a']['b'], request)
+        self.assertEqual(inst.physical_path, '/a/b/')
+        self.assertEqual(inst.virtual_path, '/a/b/')
+        self.assertEqual(inst.physical_path_tuple, (_BLANK, _A, _B, _BLANK))
+        self.assertEqual(inst.virtual_path_tuple, (_BLANK, _A, _B, _BLANK))
+
+    def test_root(self):
+        root = self._makeTree()
+        inst = self._makeOne(root, testing.DummyRequest())
+        self.assertEqual(inst.physical_path, '/')
+        self.assertEqual(inst.physical_path_tuple, (_BLANK,))
+
+    def test_virtual_root(self):
+        root = self._makeTree()
+        request = testing.DummyRequest()
+        request.environ['HTTP_X_VHM_ROOT'] = '/a/'
+        inst = self._makeOne(root['a']['b'], request)
+        self.assertEqual(inst.physical_path, '/a/b/')
+        self.assertEqual(inst.virtual_path, '/b/')
+        self.assertEqual(inst.virtual_path_tuple, (_BLANK, _B, _BLANK))
+
+    def test_virtual_root_not_an_ancestor(self):
+        root = self._makeTree()
+        request = testing.DummyRequest()
+        request.environ['HTTP_X_VHM_ROOT'] = '/z'
+        inst = self._makeOne(root['a']['b'], request)
+        self.assertEqual(inst.virtual_path, '/a/b/')
+
 class Test_has_references(unittest.TestCase):
     def _callFUT(self, context):
         from .. import has_references
@@ -2719,6 +5090,14 @@ class Test_referential_integrity(unittest.TestCase):
         event = DummyEvent(obj)
         self.assertRaises(TargetIntegrityError, self._callFUT, event)
 
+    def test_reftype_with_integrity_not_an_interface(self):
+        obj = testing.DummyResource()
+        obj.__objectmap__ = DummyObjectMap(
+            reftypes=('abc',), targetids=(1,), sourceids=(1,)
+            )
+        event = DummyEvent(obj)
+        self.assertFalse(self._callFUT(event))
+
     def test_reftype_with_target_integrity_with_only_self_sourceid(self):
         from substanced.interfaces import ReferenceType
         obj = testing.DummyResource()
@@ -2730,6 +5109,49 @@ class Test_referential_integrity(unittest.TestCase):
         event = DummyEvent(obj)
         self.assertEqual(None, self._callFUT(event)) # self-reference ignored
 
+    def test_removed_subtree_with_objectmap(self):
+        from substanced.interfaces import (
+            IFolder,
+            ReferenceType,
+            )
+        from .. import (
+            ObjectMap,
+            SourceIntegrityError,
+            TargetIntegrityError,
+            )
+        class Sourced(ReferenceType):
+            source_integrity = True
+        class Targeted(ReferenceType):
+            target_integrity = True
+        class Unconstrained(ReferenceType):
+            pass
+        root = testing.DummyResource(__provides__=IFolder)
+        root['a'] = testing.DummyResource(__provides__=IFolder)
+        root['a']['b'] = testing.DummyResource()
+        root['c'] = testing.DummyResource()
+        objectmap = ObjectMap(root)
+        root.__objectmap__ = objectmap
+        objectmap.add_subtree(root, (_BLANK,))
+        oid_a = root['a'].__oid__
+        oid_b = root['a']['b'].__oid__
+        oid_c = root['c'].__oid__
+        objectmap.connect(oid_a, oid_b, Sourced) # within the subtree
+        objectmap.connect(oid_b, oid_c, Unconstrained)
+        objectmap.connect(oid_b, oid_b, Targeted) # self-referential
+        event = DummyEvent(root['a'])
+        event.removed_oids = objectmap.pathlookup(root['a'])
+        self.assertRaises(SourceIntegrityError, self._callFUT, event)
+        objectmap.disconnect(oid_a, oid_b, Sourced)
+        self.assertEqual(self._callFUT(event), None)
+        objectmap.connect(oid_c, oid_b, Targeted)
+        try:
+            self._callFUT(event)
+        except TargetIntegrityError as e:
+            self.assertEqual(e.obj, root['a']['b'])
+            self.assertEqual(list(e.oids), [oid_c])
+        else: # pragma: no cover
+            raise AssertionError('TargetIntegrityError not raised')
+
 class TestReferentialIntegrityError(unittest.TestCase):
     def _makeOne(self, obj, reftype, oids):
         from .. import ReferentialIntegrityError
@@ -2775,9 +5197,25 @@ def resource(path):
 def split(s):
     return (_BLANK,) + tuple(filter(None, s.split(_SLASH)))
 
+def make_objectmap(root=None, nextid=1, **kw):
+    # an object map of ``root`` (a dummy root by default) made with the
+    # keyword arguments, which hands out oids from ``nextid`` up
+    from .. import ObjectMap
+    if root is None:
+        root = DummyRoot()
+    inst = ObjectMap(root, **kw)
+    inst._v_nextid = nextid
+    return inst
+
+def populate(inst, *paths):
+    # add a resource to the object map ``inst`` at each of ``paths``
+    return [ inst.add(resource(path), split(path)) for path in paths ]
+
 _marker = object()
 
 class DummyObjectMap(object):
+    family = BTrees.family64
+
     def __init__(self, targetids=(), sourceids=(), result=None, toraise=None,
                  reftypes=()):
         self.added = []
@@ -2791,10 +5229,14 @@ class DummyObjectMap(object):
         self.toraise = toraise
         self.sources_ordered = []
         self.targets_ordered = []
+        self.referencemap = self # fbo Multireference.get_oids(copy=False)
 
     def object_for(self, objectid):
         return self.result
 
+    def object_for_many(self, objectids):
+        return [ self.result for objectid in objectids ]
+
     def path_for(self, objectid):
         return self.result
 
@@ -2804,6 +5246,15 @@ class DummyObjectMap(object):
     def sourceids(self, context, reftype):
         return self._sourceids
 
+    def references_among(self, oids, reftype, direction):
+        if direction == 'targets':
+            oidset = self._targetids
+        else:
+            oidset = self._sourceids
+        if oidset:
+            for oid in oids:
+                yield oid, oidset
+
     def disconnect(self, source, target, reftype):
         if self.toraise:
             raise self.toraise
@@ -2814,6 +5265,18 @@ class DummyObjectMap(object):
             raise self.toraise
         self.connected.append((source, target, reftype))
 
+    def connect_many(self, pairs, reftype, ignore_missing=False):
+        if self.toraise and ignore_missing:
+            return
+        for source, target in pairs:
+            self.connect(source, target, reftype)
+
+    def disconnect_many(self, pairs, reftype, ignore_missing=False):
+        if self.toraise and ignore_missing:
+            return
+        for source, target in pairs:
+            self.disconnect(source, target, reftype)
+
     def has_references(self, oid):
         return self.result
 
@@ -2905,3 +5368,25 @@ class DummyReferenceMap(dict):
     
 class DummyRoot(object):
     pass
+
+class DummyPersistent(Persistent):
+    pass
+
+class DummyGhost(object):
+    _p_changed = None
+    def __init__(self, oid, jar):
+        self.__oid__ = oid
+        self._p_jar = jar
+
+class DummyJar(object):
+    def __init__(self):
+        self.prefetched = []
+
+    def prefetch(self, objs):
+        self.prefetched.append(objs)
+
+class DummyTransaction(object):
+    committed = 0
+
+    def commit(self):
+        self.committed += 1
@@ -116,13 +116,14 @@ def acl_maybe_added(event):
     objectmap = find_objectmap(obj)
 
     if objectmap is not None: # object might not yet be seated
+        pairs = []
         for resource in postorder(obj):
             acl = get_acl(resource, None)
             if acl is not None:
                 for princid in _referenceable_principals(acl):
-                    objectmap.connect(
-                        princid, resource, PrincipalToACLBearing
-                        )
+                    pairs.append((princid, resource))
+        if pairs:
+            objectmap.connect_many(pairs, PrincipalToACLBearing)
 
 @subscribe_acl_modified()
 def acl_modified(event):
@@ -139,16 +140,14 @@ def acl_modified(event):
         principals_removed = old_principals.difference(new_principals)
         principals_added = new_principals.difference(old_principals)
 
-        for princid in principals_removed:
-            objectmap.disconnect(
-                princid,
-                event.object,
+        if principals_removed:
+            objectmap.disconnect_many(
+                [ (princid, event.object) for princid in principals_removed ],
                 PrincipalToACLBearing
                 )
 
-        for princid in principals_added:
-            objectmap.connect(
-                princid,
-                event.object,
+        if principals_added:
+            objectmap.connect_many(
+                [ (princid, event.object) for princid in principals_added ],
                 PrincipalToACLBearing
                 )
@@ -682,7 +682,7 @@ class DummyObjectMap(object):
     def connect(self, source, target, reftype):
         self.connections.append((source, target, reftype))
 
-    def add(self, node, path_tuple, duplicating=False, moving=False):
+    def add_subtree(self, node, path_tuple, duplicating=False, moving=False):
         pass
 
 class DummyContentRegistry(object):
@@ -218,6 +218,14 @@ class DummyObjectMap(object):
 
     def disconnect(self, source, target, reftype):
         self.disconnections.append((source, target, reftype))
+
+    def connect_many(self, pairs, reftype):
+        for source, target in pairs:
+            self.connect(source, target, reftype)
+
+    def disconnect_many(self, pairs, reftype):
+        for source, target in pairs:
+            self.disconnect(source, target, reftype)
     
 class DummyEvent(object):
     def __init__(self, **kw):
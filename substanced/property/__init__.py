@@ -51,7 +51,7 @@ class PropertySheet(object):
     def set(self, struct, omit=()):
         if not is_nonstr_iter(omit):
             omit = (omit,)
-        changed = False
+        changed = set()
         for child in self.schema:
             name = child.name
             if (name in struct) and not (name in omit):
@@ -61,8 +61,10 @@ class PropertySheet(object):
                 new_val = struct[name]
                 if existing_val != new_val:
                     setattr(self.context, name, new_val)
-                    changed = True
-        return changed
+                    changed.add(name)
+        if not changed:
+            return False
+        return frozenset(changed)
 
     def before_render(self, form): #pragma NO COVER
         """ Hook:  allow subclasses to scribble on form.
@@ -73,7 +75,10 @@ class PropertySheet(object):
 
     def after_set(self, changed):
         if changed is not False:
-            event = ObjectModified(self.context)
+            names = None
+            if isinstance(changed, (set, frozenset)):
+                names = changed
+            event = ObjectModified(self.context, changed=names)
             self.request.registry.subscribers((event, self.context), None)
 
 def is_propertied(context, request):
@@ -31,7 +31,8 @@ class TestPropertySheet(unittest.TestCase):
         context.description = 'description'
         inst.schema = [DummySchemaNode('title'),
                        DummySchemaNode('description')]
-        inst.set(dict(title='t', description='d'))
+        result = inst.set(dict(title='t', description='d'))
+        self.assertEqual(result, frozenset(['title', 'description']))
         self.assertEqual(context.title, 't')
         self.assertEqual(context.description, 'd')
 
@@ -54,7 +55,8 @@ class TestPropertySheet(unittest.TestCase):
                        DummySchemaNode('description')]
         context.title = 't'
         context.description = 'd'
-        inst.set(dict(title='t', description='d'))
+        result = inst.set(dict(title='t', description='d'))
+        self.assertEqual(result, False)
         self.assertEqual(context.title, 't')
         self.assertEqual(context.description, 'd')
 
@@ -66,7 +68,8 @@ class TestPropertySheet(unittest.TestCase):
         context.description = 'description'
         inst.schema = [DummySchemaNode('title'),
                        DummySchemaNode('description')]
-        inst.set(dict(title='t', description='d'), omit=('title',))
+        result = inst.set(dict(title='t', description='d'), omit=('title',))
+        self.assertEqual(result, frozenset(['description']))
         self.assertEqual(context.title, 'title')
         self.assertEqual(context.description, 'd')
 
@@ -93,6 +96,16 @@ class TestPropertySheet(unittest.TestCase):
         self.assertEqual(subscribed[1], None)
         self.assertEqual(subscribed[0][0].__class__, ObjectModified)
         self.assertEqual(subscribed[0][1], context)
+        self.assertEqual(subscribed[0][0].changed, None)
+
+    def test_after_set_changed_names(self):
+        request = testing.DummyRequest()
+        request.registry = DummyRegistry()
+        context = testing.DummyResource()
+        inst = self._makeOne(context, request)
+        inst.after_set(frozenset(['title']))
+        subscribed = request.registry.subscribed[0]
+        self.assertEqual(subscribed[0][0].changed, frozenset(['title']))
 
     def test_after_set_changed_False(self):
         request = testing.DummyRequest()
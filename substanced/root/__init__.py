@@ -2,6 +2,7 @@ import colander
 from zope.interface import implementer
 
 from pyramid.exceptions import ConfigurationError
+from pyramid.settings import asbool
 from pyramid.security import (
     Allow,
     ALL_PERMISSIONS,
@@ -61,7 +62,18 @@ class Root(Folder):
         # dump system loader to successfully load a root object; if this were
         # done in __init__, the oid of the root object would not be resettable,
         # and loaded references to the root object could not be resolved.
-        self.__objectmap__ = ObjectMap(self)
+        settings = registry.settings
+        rangescan = asbool(settings.get('substanced.objectmap.rangescan'))
+        compact = asbool(settings.get('substanced.objectmap.compact_paths'))
+        objectrefs = asbool(settings.get('substanced.objectmap.objectrefs'))
+        docids = asbool(settings.get('substanced.objectmap.docids'))
+        self.__objectmap__ = ObjectMap(
+            self,
+            pathindex=not rangescan,
+            compact_paths=compact,
+            objectrefs=objectrefs,
+            docids=docids,
+            )
         self.__objectmap__.add(self, ('',))
 
         catalogs = registry.content.create('Catalogs')
@@ -71,7 +83,6 @@ class Root(Folder):
         # self-index so catalogs service shows up in folder contents
         oid = get_oid(catalogs)
         catalog.index_doc(oid, catalogs)
-        settings = registry.settings
         password = settings.get('substanced.initial_password')
         if password is None:
             raise ConfigurationError(
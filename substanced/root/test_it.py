@@ -75,6 +75,58 @@ class TestRoot(unittest.TestCase):
         self.assertFalse(registry.created.__sdi_deletable__)
         self.assertTrue(IService.providedBy(locks))
 
+    def test_after_create_objectmap_rangescan(self):
+        settings = {
+            'substanced.initial_password':'pass',
+            'substanced.objectmap.rangescan':'true',
+            }
+        registry = self._makeRegistry(settings)
+        inst = self._makeOne()
+        inst.__oid__ = 1
+        inst.after_create(inst, registry)
+        objectmap = inst.__objectmap__
+        self.assertEqual(objectmap.pathindex, None)
+        self.assertEqual(objectmap.path_for(1), ('',))
+
+    def test_after_create_objectmap_compact_paths(self):
+        settings = {
+            'substanced.initial_password':'pass',
+            'substanced.objectmap.compact_paths':'true',
+            }
+        registry = self._makeRegistry(settings)
+        inst = self._makeOne()
+        inst.__oid__ = 1
+        inst.after_create(inst, registry)
+        objectmap = inst.__objectmap__
+        self.assertTrue(objectmap.compact_paths)
+        self.assertEqual(objectmap.objectid_to_path[1], b'\x00')
+        self.assertEqual(objectmap.path_for(1), ('',))
+
+    def test_after_create_objectmap_objectrefs(self):
+        settings = {
+            'substanced.initial_password':'pass',
+            'substanced.objectmap.objectrefs':'true',
+            }
+        registry = self._makeRegistry(settings)
+        inst = self._makeOne()
+        inst.__oid__ = 1
+        inst.after_create(inst, registry)
+        objectmap = inst.__objectmap__
+        self.assertTrue(objectmap.objectid_to_object[1] is inst)
+        self.assertTrue(objectmap.object_for(1) is inst)
+
+    def test_after_create_objectmap_docids(self):
+        settings = {
+            'substanced.initial_password':'pass',
+            'substanced.objectmap.docids':'true',
+            }
+        registry = self._makeRegistry(settings)
+        inst = self._makeOne()
+        inst.__oid__ = 1
+        inst.after_create(inst, registry)
+        objectmap = inst.__objectmap__
+        self.assertEqual(objectmap.docid_for(1), 1)
+
     def test_after_create_without_password(self):
         from pyramid.exceptions import ConfigurationError
         settings = {}
@@ -0,0 +1,60 @@
+""" Verify (and optionally rebuild) the pathindex and extent map of the
+object map """
+
+from optparse import OptionParser
+import sys
+
+from pyramid.paster import (
+    setup_logging,
+    bootstrap,
+    )
+
+from substanced.objectmap import find_objectmap
+
+def _print(msg):
+    sys.stdout.write('%s\n' % msg)
+
+def main():
+    parser = OptionParser(description=__doc__)
+    parser.add_option('-r', '--rebuild', dest='rebuild',
+        action="store_true", default=False,
+        help="Rebuild the pathindex and the extent map before verifying")
+    parser.add_option('-i', '--interval', dest='commit_interval',
+        action="store", default=3000,
+        help="Commit every N objects during a rebuild")
+
+    options, args = parser.parse_args()
+
+    if args:
+        config_uri = args[0]
+    else:
+        parser.error("Requires a config_uri as an argument")
+
+    commit_interval = int(options.commit_interval)
+
+    setup_logging(config_uri)
+    env = bootstrap(config_uri)
+    site = env['root']
+
+    objectmap = find_objectmap(site)
+    objectmaps = [ ('/', objectmap) ]
+    for path, shard in (objectmap.shards or {}).items():
+        objectmaps.append(('/'.join(path), shard))
+
+    problems = 0
+
+    for path, omap in objectmaps:
+        if options.rebuild:
+            _print('Rebuilding the objectmap of %s' % path)
+            omap.rebuild(
+                commit_interval=commit_interval,
+                output=_print,
+                )
+        _print('Verifying the objectmap of %s' % path)
+        problems += omap.verify(output=_print)
+
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
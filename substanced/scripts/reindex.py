@@ -32,6 +32,14 @@ def main():
     parser.add_option('-c', '--catalog', dest='catalog_specs', action="append",
         help=("Reindex only the catalog provided (may be a path or a name "
               "and may be specified multiple times)"))
+    parser.add_option('-w', '--workers', dest='workers',
+        action="store", default=None, metavar='N',
+        help=("Compute index values in N worker processes, each with its "
+              "own database connection"))
+    parser.add_option('-r', '--resume', dest='resume',
+        action="store_true", default=False,
+        help=("Continue an interrupted reindex of the same indexes and path "
+              "after its last commit"))
 
     options, args = parser.parse_args()
 
@@ -49,6 +57,11 @@ def main():
     kw = {}
     if options.indexes:
         kw['indexes'] = options.indexes
+    if options.workers:
+        kw['workers'] = int(options.workers)
+        kw['config_uri'] = config_uri
+    if options.resume:
+        kw['resume'] = True
 
     setup_logging(config_uri)
     env = bootstrap(config_uri)
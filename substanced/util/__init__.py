@@ -587,7 +587,8 @@ def get_principal_repr(principal_or_id):
             
 def find_objectmap(context):
     """ Returns the object map for the root object in the lineage of the
-    ``context`` or ``None`` if no objectmap can be found."""
+    ``context`` (or, if ``context`` is within a shard, the shard's object map)
+    or ``None`` if no objectmap can be found."""
     return acquire(context, '__objectmap__', None)
 
 def get_icon_name(resource, request):